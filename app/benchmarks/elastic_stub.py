@@ -0,0 +1,487 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ..core.search.documents import candidate_document
+
+
+"""
+    Local stand-in for the Elasticsearch 'candidates' index, used by tests
+    and benchmarks. It answers _msearch and _bulk (index, update with
+    'doc_as_upsert' and delete, with external versions) requests over
+    in-memory documents with an optional artificial latency and implements
+    the subset of the query DSL used by this project and by the
+    ReactiveSearch front-end: match_all, bool, constant_score, term, terms,
+    range (also on range fields), exists, nested, 'sort', 'from', 'size',
+    '_source' and 'terms' aggregations.
+"""
+
+
+class UnsupportedQuery(ValueError):
+    pass
+
+
+def documents_from_snapshot(candidate_snapshot):
+    """Create the 'candidates' documents, as indexed by the import, from a
+    candidate snapshot
+
+    Args:
+        candidate_snapshot (CandidateSnapshot): Candidate snapshot
+
+    Returns:
+        list[dict]: Elasticsearch documents
+    """
+    documents = []
+    for position, candidate_id in enumerate(candidate_snapshot.candidate_ids):
+        technologies = [
+            {"name": candidate_snapshot.tech_name(tech_id),
+             "is_main_tech": is_main_tech}
+            for tech_id, is_main_tech
+            in candidate_snapshot.candidate_techs(position)
+        ]
+        documents.append(candidate_document(
+            candidate_id,
+            candidate_snapshot.city_name(
+                candidate_snapshot.candidate_city_ids[position]
+            ),
+            candidate_snapshot.experience_min[position],
+            candidate_snapshot.experience_max[position],
+            technologies
+        ))
+    return documents
+
+
+def _values(document, field):
+    value = document.get(field)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _single_field(clause):
+    if not isinstance(clause, dict) or len(clause) != 1:
+        raise UnsupportedQuery('Expected a single field: {}'.format(clause))
+    return next(iter(clause.items()))
+
+
+def _in_range(value, bounds):
+    return all([
+        'gte' not in bounds or value >= bounds['gte'],
+        'gt' not in bounds or value > bounds['gt'],
+        'lte' not in bounds or value <= bounds['lte'],
+        'lt' not in bounds or value < bounds['lt'],
+    ])
+
+
+def _range_matches(value, bounds):
+    if not isinstance(value, dict):
+        return _in_range(value, bounds)
+
+    # range fields, ex.: "years_experience": {"gte": 1, "lte": 2}
+    low = bounds.get('gte', bounds.get('gt', float('-inf')))
+    high = bounds.get('lte', bounds.get('lt', float('inf')))
+    relation = bounds.get('relation', 'intersects')
+    if relation == 'within':
+        return low <= value['gte'] and value['lte'] <= high
+    if relation == 'contains':
+        return value['gte'] <= low and high <= value['lte']
+    return value['gte'] <= high and low <= value['lte']
+
+
+def evaluate(query, document):
+    """Check if the document matches the query
+
+    Args:
+        query (dict): Elasticsearch query
+        document (dict): Document source
+
+    Raises:
+        UnsupportedQuery: if the query uses something the stub does not know
+
+    Returns:
+        bool, float: If the document matches and its score
+    """
+    query_type, clause = _single_field(query)
+
+    if query_type == 'match_all':
+        return True, 1.0
+
+    if query_type == 'term':
+        field, value = _single_field(clause)
+        if isinstance(value, dict):
+            value = value['value']
+        return value in _values(document, field), 1.0
+
+    if query_type == 'terms':
+        field, values = _single_field(clause)
+        matched = any(value in values for value in _values(document, field))
+        return matched, 1.0
+
+    if query_type == 'range':
+        field, bounds = _single_field(clause)
+        matched = any(
+            _range_matches(value, bounds) for value in _values(document, field)
+        )
+        return matched, 1.0
+
+    if query_type == 'exists':
+        return bool(_values(document, clause['field'])), 1.0
+
+    if query_type == 'constant_score':
+        matched, _ = evaluate(clause['filter'], document)
+        return matched, float(clause.get('boost', 1.0))
+
+    if query_type == 'nested':
+        path = clause['path']
+        for nested_document in _values(document, path):
+            prefixed = {
+                '{}.{}'.format(path, key): value
+                for key, value in nested_document.items()
+            }
+            matched, score = evaluate(clause['query'], prefixed)
+            if matched:
+                return True, score
+        return False, 0.0
+
+    if query_type == 'bool':
+        return _evaluate_bool(clause, document)
+
+    raise UnsupportedQuery('Unsupported query: {}'.format(query_type))
+
+
+def _clauses(clause, occurrence):
+    clauses = clause.get(occurrence, [])
+    return clauses if isinstance(clauses, list) else [clauses]
+
+
+def _evaluate_bool(clause, document):
+    score = 0.0
+    for occurrence in ('must', 'filter'):
+        for sub_query in _clauses(clause, occurrence):
+            matched, sub_score = evaluate(sub_query, document)
+            if not matched:
+                return False, 0.0
+            if occurrence == 'must':
+                score += sub_score
+
+    for sub_query in _clauses(clause, 'must_not'):
+        if evaluate(sub_query, document)[0]:
+            return False, 0.0
+
+    should = _clauses(clause, 'should')
+    matched_should = 0
+    for sub_query in should:
+        matched, sub_score = evaluate(sub_query, document)
+        if matched:
+            matched_should += 1
+            score += sub_score
+
+    default_minimum = 0 if clause.get('must') or clause.get('filter') else 1
+    minimum = clause.get('minimum_should_match',
+                         default_minimum if should else 0)
+    return matched_should >= int(minimum), score
+
+
+def _sort_key(sort, document, score):
+    """Sort key of a hit, numbers are negated for descending orders"""
+    key = []
+    for sort_field in sort:
+        if isinstance(sort_field, str):
+            field, order = sort_field, 'asc'
+        else:
+            field, order = _single_field(sort_field)
+            if isinstance(order, dict):
+                order = order.get('order', 'asc')
+
+        value = score if field == '_score' else document.get(field)
+        if value is None:
+            value = float('-inf') if order == 'desc' else float('inf')
+        key.append(-value if order == 'desc' else value)
+    return key
+
+
+def _source(document, source):
+    if source is False:
+        return None
+    includes = source.get('includes') if isinstance(source, dict) else source
+    if not includes or includes == ['*']:
+        return document
+    return {key: value for key, value in document.items() if key in includes}
+
+
+def _aggregate(aggregations, matched_documents):
+    results = {}
+    for name, aggregation in aggregations.items():
+        if 'terms' not in aggregation:
+            raise UnsupportedQuery('Only terms aggregations are supported')
+
+        terms = aggregation['terms']
+        counts = {}
+        for document in matched_documents:
+            for value in set(_values(document, terms['field'])):
+                counts[value] = counts.get(value, 0) + 1
+
+        buckets = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        results[name] = {
+            "doc_count_error_upper_bound": 0,
+            "sum_other_doc_count": sum(
+                count for _, count in buckets[terms.get('size', 10):]
+            ),
+            "buckets": [
+                {"key": key, "doc_count": count}
+                for key, count in buckets[:terms.get('size', 10)]
+            ],
+        }
+    return results
+
+
+def search(documents, body):
+    """Run one search over the documents
+
+    Args:
+        documents (list[dict]): Documents of the index
+        body (dict): Search body
+
+    Returns:
+        dict: Elasticsearch search response
+    """
+    started = time.perf_counter()
+    query = body.get('query', {'match_all': {}})
+
+    matches = []
+    for document in documents:
+        matched, score = evaluate(query, document)
+        if matched:
+            matches.append((document, score))
+
+    sort = body.get('sort', ['_score'])
+    sort = sort if isinstance(sort, list) else [sort]
+    matches.sort(key=lambda match: _sort_key(sort, match[0], match[1]))
+
+    start = body.get('from', 0)
+    page = matches[start:start + body.get('size', 10)]
+
+    response = {
+        "took": int((time.perf_counter() - started) * 1000),
+        "timed_out": False,
+        "hits": {
+            "total": {"value": len(matches), "relation": "eq"},
+            "max_score": None,
+            "hits": [
+                {
+                    "_index": "candidates",
+                    "_id": str(document['candidate_id']),
+                    "_score": score,
+                    "_source": _source(document, body.get('_source')),
+                }
+                for document, score in page
+            ],
+        },
+        "status": 200,
+    }
+
+    aggregations = body.get('aggs', body.get('aggregations'))
+    if aggregations:
+        response['aggregations'] = _aggregate(
+            aggregations, [document for document, _ in matches]
+        )
+    return response
+
+
+def msearch(documents, ndjson):
+    """Run every search of an _msearch NDJSON body
+
+    Args:
+        documents (list[dict]): Documents of the index
+        ndjson (str): _msearch request body
+
+    Returns:
+        dict: Elasticsearch _msearch response
+    """
+    lines = [json.loads(line) for line in ndjson.splitlines() if line.strip()]
+
+    responses = []
+    for body in lines[1::2]:
+        try:
+            responses.append(search(documents, body))
+        except UnsupportedQuery as error:
+            responses.append({
+                "error": {"type": "parsing_exception", "reason": str(error)},
+                "status": 400,
+            })
+    return {"took": 0, "responses": responses}
+
+
+def bulk(documents, versions, ndjson):
+    """Apply the index, update ('doc_as_upsert') and delete actions of a
+    _bulk body, with optional external versions
+
+    Args:
+        documents (dict[str, dict]): Documents of the index by ID, changed in
+            place
+        versions (dict[str, int]): External version by ID, also kept for
+            deleted documents, changed in place
+        ndjson (str): _bulk request body
+
+    Returns:
+        dict: Elasticsearch _bulk response
+    """
+    lines = iter(
+        [json.loads(line) for line in ndjson.splitlines() if line.strip()]
+    )
+
+    items = []
+    for line in lines:
+        action, metadata = _single_field(line)
+        document_id = str(metadata['_id'])
+        result = {"_index": "candidates", "_id": document_id, "status": 200}
+        source = next(lines) if action in ('index', 'update') else None
+
+        if metadata.get('version_type') == 'external':
+            if metadata['version'] <= versions.get(document_id, 0):
+                result.update(status=409, error={
+                    "type": "version_conflict_engine_exception"
+                })
+                items.append({action: result})
+                continue
+            versions[document_id] = metadata['version']
+
+        if action == 'delete':
+            if documents.pop(document_id, None) is None:
+                result.update(status=404, result='not_found')
+            else:
+                result['result'] = 'deleted'
+        elif action == 'index':
+            if document_id not in documents:
+                result.update(status=201, result='created')
+            else:
+                result['result'] = 'updated'
+            documents[document_id] = dict(source)
+        elif action == 'update':
+            if document_id in documents:
+                documents[document_id].update(source['doc'])
+                result['result'] = 'updated'
+            elif source.get('doc_as_upsert'):
+                documents[document_id] = dict(source['doc'])
+                result.update(status=201, result='created')
+            else:
+                result.update(status=404, error={
+                    "type": "document_missing_exception"
+                })
+        else:
+            raise UnsupportedQuery('Unsupported bulk action: {}'.format(
+                action
+            ))
+        items.append({action: result})
+
+    return {
+        "took": 0,
+        "errors": any(
+            'error' in item[action] for item in items for action in item
+        ),
+        "items": items,
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(200, {"version": {"number": "7.10.1"}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        ndjson = self.rfile.read(length).decode('utf-8')
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if '/_bulk' in self.path:
+            with self.server.lock:
+                self._reply(200, bulk(self.server.documents,
+                                      self.server.versions, ndjson))
+            return
+
+        if '/_msearch' not in self.path:
+            self._reply(404, {
+                "error": "Only _msearch and _bulk are supported"
+            })
+            return
+
+        self.server.requests += 1
+        with self.server.lock:
+            documents = list(self.server.documents.values())
+        self._reply(200, msearch(documents, ndjson))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ElasticStub:
+    """HTTP server answering _msearch and _bulk requests in a background
+    thread
+
+    Usage:
+        with ElasticStub(documents, latency=0.01) as url:
+            settings.ELASTIC_HOST = url
+    """
+
+    def __init__(self, documents, latency=0.0):
+        """
+        Args:
+            documents (list[dict]): Documents of the 'candidates' index
+            latency (float): Seconds added to every request
+        """
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.documents = {
+            str(document['candidate_id']): document for document in documents
+        }
+        self._server.versions = {}
+        self._server.lock = threading.Lock()
+        self._server.latency = latency
+        self._server.requests = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    @property
+    def documents(self):
+        """Documents of the index by ID"""
+        return self._server.documents
+
+    @property
+    def versions(self):
+        """External versions by ID, also of deleted documents"""
+        return self._server.versions
+
+    @property
+    def requests(self):
+        """Number of _msearch requests answered"""
+        return self._server.requests
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,452 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+
+"""
+    Concurrent load test of the ASGI application, run in-process against a
+    synthetic SQLite database and the local Elasticsearch stub.
+
+    Requests are replayed open-loop: they start at the target rate whatever
+    the response times are, and latencies are measured from the moment each
+    request was due, so a blocked event loop or an exhausted connection pool
+    shows up as latency instead of silently lowering the request rate.
+
+    Usage (from the repository root):
+        python -m app.benchmarks.loadtest --rate 50 --duration 10 \\
+            --mix candidates=6,search-options=2,msearch=2 --es-latency 0.02
+
+    The report, which includes the database pool telemetry, is printed as
+    JSON (or written to --output).
+"""
+
+DEFAULT_MIX = {'candidates': 6, 'search-options': 2, 'msearch': 2}
+
+
+def create_dataset(path, candidates=2000, cities=200, techs=300, seed=0):
+    """Create a SQLite database with synthetic cities, techs and candidates
+
+    Args:
+        path (str): SQLite file path
+        candidates (int): Number of candidates
+        cities (int): Number of cities
+        techs (int): Number of technologies
+        seed (int): Random seed
+
+    Returns:
+        str: pyDAL URI of the database
+    """
+    from pydal import DAL
+    from ..core.models.database_tables import define_tables
+
+    uri = 'sqlite://{}'.format(path)
+    randomizer = random.Random(seed)
+
+    db = DAL(uri, folder=os.path.dirname(path))
+    define_tables(db)
+
+    db.city.bulk_insert([
+        {'id': city_id, 'name': 'City {:04d} - ST'.format(city_id)}
+        for city_id in range(1, cities + 1)
+    ])
+    db.tech.bulk_insert([
+        {'id': tech_id, 'name': 'Tech {:03d}'.format(tech_id)}
+        for tech_id in range(1, techs + 1)
+    ])
+
+    references = []
+    candidate_rows = []
+    for candidate_id in range(1, candidates + 1):
+        years_min = randomizer.randint(0, 12)
+        years_max = 99 if years_min == 12 else years_min + 1
+        candidate_rows.append({
+            'id': candidate_id,
+            'city_id': randomizer.randint(1, cities),
+            'years_experience_min': years_min,
+            'years_experience_max': years_max,
+        })
+
+        candidate_techs = randomizer.sample(range(1, techs + 1),
+                                            randomizer.randint(1, 6))
+        for position, tech_id in enumerate(candidate_techs):
+            references.append({
+                'candidate_id': candidate_id,
+                'tech_id': tech_id,
+                'is_main_tech': position == 0,
+            })
+
+    db.candidate.bulk_insert(candidate_rows)
+    db.candidate_tech_reference.bulk_insert(references)
+    db.commit()
+    db.close()
+
+    return uri
+
+
+def _candidates_request(randomizer, cities, techs):
+    experience_min = randomizer.randint(0, 10)
+    params = {
+        'experience_min': experience_min,
+        'experience_max': experience_min + randomizer.randint(0, 10),
+    }
+    if randomizer.random() < 0.5:
+        params['city_id'] = randomizer.randint(1, cities)
+    if randomizer.random() < 0.8:
+        params['techs'] = ','.join(
+            str(tech_id) for tech_id
+            in randomizer.sample(range(1, techs + 1), randomizer.randint(1, 3))
+        )
+    query_string = '&'.join(
+        '{}={}'.format(key, value) for key, value in params.items()
+    )
+    return 'GET', '/candidates', query_string, b''
+
+
+def _search_options_request(randomizer, cities, techs):
+    return 'GET', '/candidates/search-options', '', b''
+
+
+def _msearch_request(randomizer, cities, techs):
+    """A search like the ones sent by the ReactiveSearch front-end"""
+    experience_min = randomizer.randint(0, 10)
+    search = {
+        "query": {"bool": {"must": [
+            {"range": {"years_experience": {
+                "gte": experience_min, "lte": experience_min + 5
+            }}},
+            {"terms": {"techs": [
+                'Tech {:03d}'.format(randomizer.randint(1, techs))
+            ]}},
+        ]}},
+        "aggs": {"techs": {"terms": {"field": "techs", "size": 20}}},
+        "size": 5,
+        "from": 0,
+        "_source": {"includes": ["*"], "excludes": []},
+    }
+    body = '{}\n{}\n'.format(
+        json.dumps({"preference": "ReactiveListResult"}), json.dumps(search)
+    )
+    return 'POST', '/candidates/elastic-proxy/candidates/_msearch', '', \
+        body.encode('utf-8')
+
+
+REQUESTS = {
+    'candidates': _candidates_request,
+    'search-options': _search_options_request,
+    'msearch': _msearch_request,
+}
+
+
+async def asgi_request(app, method, path, query_string='', body=b''):
+    """Call the ASGI application directly, without a network server
+
+    Returns:
+        int, bool: Response status and if the application raised an error
+        (also after the response was sent)
+    """
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode('utf-8'),
+        'query_string': query_string.encode('utf-8'),
+        'root_path': '',
+        'headers': [
+            (b'host', b'loadtest'),
+            (b'content-type', b'application/x-ndjson'),
+            (b'content-length', str(len(body)).encode('utf-8')),
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': ('loadtest', 80),
+    }
+    request_sent = False
+    disconnected = asyncio.Event()
+    status = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    try:
+        await app(scope, receive, send)
+        raised = False
+    except Exception:
+        raised = True
+    finally:
+        disconnected.set()
+
+    return (status[0] if status else 500), raised
+
+
+def percentiles(values):
+    """p50, p95, p99 and max of a list of latencies, in milliseconds"""
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+
+    ordered = sorted(values)
+
+    def nearest_rank(percentile):
+        index = max(0, int(round(percentile / 100 * len(ordered))) - 1)
+        return round(ordered[index] * 1000, 3)
+
+    return {
+        'p50': nearest_rank(50),
+        'p95': nearest_rank(95),
+        'p99': nearest_rank(99),
+        'max': round(ordered[-1] * 1000, 3),
+    }
+
+
+def _summary(results, elapsed):
+    errors = [
+        result for result in results
+        if result['status'] >= 500 or result['raised']
+    ]
+    status_codes = {}
+    for result in results:
+        status = str(result['status'])
+        status_codes[status] = status_codes.get(status, 0) + 1
+
+    return {
+        'requests': len(results),
+        'throughput_rps': round(len(results) / elapsed, 3) if elapsed else 0,
+        'errors': len(errors),
+        'error_rate': round(len(errors) / len(results), 4) if results else 0,
+        'application_exceptions': sum(
+            1 for result in results if result['raised']
+        ),
+        'status_codes': status_codes,
+        'latency_ms': percentiles([result['latency'] for result in results]),
+    }
+
+
+async def _watch_event_loop(lags, stop, interval=0.01):
+    """Measure how late the event loop wakes up a sleeping task, the lag is
+    the time the loop was blocked by synchronous code"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - started - interval))
+
+
+async def replay(app, rate, duration, mix, cities, techs, seed=0,
+                 timeout=30):
+    """Replay the traffic mix at the target rate
+
+    Args:
+        app (ASGI application): Application under test
+        rate (float): Requests started per second
+        duration (float): Seconds of traffic
+        mix (dict[str, int]): Weight of each request type
+        cities (int): Number of cities in the dataset
+        techs (int): Number of technologies in the dataset
+        seed (int): Random seed
+        timeout (float): Seconds to wait for the last requests
+
+    Returns:
+        dict: Load test report, without the configuration
+    """
+    randomizer = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = []
+
+    async def timed_request(name, due):
+        method, path, query_string, body = REQUESTS[name](
+            randomizer, cities, techs
+        )
+        status, raised = await asgi_request(app, method, path, query_string,
+                                            body)
+        results.append({
+            'name': name,
+            'status': status,
+            'raised': raised,
+            'latency': time.perf_counter() - due,
+        })
+
+    lags = []
+    stop = asyncio.Event()
+    watcher = asyncio.ensure_future(_watch_event_loop(lags, stop))
+
+    started = time.perf_counter()
+    tasks = []
+    for index in range(int(rate * duration)):
+        due = started + index / rate
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        name = randomizer.choices(names, weights)[0]
+        tasks.append(asyncio.ensure_future(timed_request(name, due)))
+
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await watcher
+
+    report = _summary(results, elapsed)
+    report['duration_seconds'] = round(elapsed, 3)
+    report['unfinished_requests'] = sum(1 for task in tasks if not task.done())
+    report['event_loop_lag_ms'] = percentiles(lags)
+    report['endpoints'] = {
+        name: _summary(
+            [result for result in results if result['name'] == name], elapsed
+        )
+        for name in names
+    }
+    return report
+
+
+def run_load_test(rate=20, duration=5, mix=None, candidates=2000,
+                  cities=200, techs=300, es_latency=0.0,
+                  search_backend='mysql', seed=0):
+    """Start the application in-process against a synthetic SQLite database
+    and the Elasticsearch stub, then replay the traffic mix
+
+    Returns:
+        dict: Load test report
+    """
+    from .elastic_stub import ElasticStub, \
+        documents_from_snapshot
+    from ..core.models.database import database_pool
+    from ..core.middleware.admission import admission_limiters
+    from ..core.search import snapshot
+    from ..core import settings
+    from ..main import app
+
+    mix = mix or DEFAULT_MIX
+    unknown = set(mix) - set(REQUESTS)
+    if unknown:
+        raise ValueError('Unknown request types: {}'.format(unknown))
+
+    previous_directory = os.getcwd()
+    previous_settings = {
+        name: getattr(settings, name)
+        for name in ('DB_URI', 'SNAPSHOT_PATH', 'ELASTIC_HOST',
+                     'SEARCH_BACKEND')
+    }
+
+    with tempfile.TemporaryDirectory() as working_directory:
+        # pyDAL writes its migration files to the working directory
+        os.chdir(working_directory)
+        try:
+            settings.DB_URI = create_dataset(
+                os.path.join(working_directory, 'loadtest.sqlite'),
+                candidates, cities, techs, seed
+            )
+            settings.SNAPSHOT_PATH = os.path.join(working_directory,
+                                                  'candidates.snapshot')
+            settings.SEARCH_BACKEND = search_backend
+
+            from pydal import DAL
+            from ..core.models.database_tables import define_tables
+
+            db = DAL(settings.DB_URI, folder=working_directory)
+            define_tables(db)
+            candidate_snapshot = snapshot.write_snapshot(
+                db, settings.SNAPSHOT_PATH
+            )
+            db.close()
+
+            stub = ElasticStub(documents_from_snapshot(candidate_snapshot),
+                               latency=es_latency)
+            settings.ELASTIC_HOST = stub.start()
+            try:
+                report = asyncio.run(
+                    replay(app, rate, duration, mix, cities, techs, seed)
+                )
+            finally:
+                stub.stop()
+        finally:
+            os.chdir(previous_directory)
+            for name, value in previous_settings.items():
+                setattr(settings, name, value)
+
+    report['db_pool'] = database_pool.stats()
+    report['admission'] = [
+        limiter.stats()
+        for limiter in dict.fromkeys(admission_limiters.values())
+    ]
+    report['config'] = {
+        'rate': rate,
+        'duration': duration,
+        'mix': mix,
+        'candidates': candidates,
+        'cities': cities,
+        'techs': techs,
+        'es_latency': es_latency,
+        'search_backend': search_backend,
+        'seed': seed,
+    }
+    return report
+
+
+def _parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        mix[name.strip()] = int(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Concurrent load test of the application'
+    )
+    parser.add_argument('--rate', type=float, default=20,
+                        help='Requests started per second')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds of traffic')
+    parser.add_argument('--mix', type=_parse_mix,
+                        default=DEFAULT_MIX,
+                        help='Weight of each request type, ex.: '
+                             'candidates=6,search-options=2,msearch=2')
+    parser.add_argument('--candidates', type=int, default=2000)
+    parser.add_argument('--cities', type=int, default=200)
+    parser.add_argument('--techs', type=int, default=300)
+    parser.add_argument('--es-latency', type=float, default=0.0,
+                        help='Seconds added to every Elasticsearch request')
+    parser.add_argument('--search-backend', default='mysql',
+                        choices=['mysql', 'elasticsearch'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='File to write the JSON report to')
+    arguments = parser.parse_args()
+
+    report = run_load_test(
+        rate=arguments.rate,
+        duration=arguments.duration,
+        mix=arguments.mix,
+        candidates=arguments.candidates,
+        cities=arguments.cities,
+        techs=arguments.techs,
+        es_latency=arguments.es_latency,
+        search_backend=arguments.search_backend,
+        seed=arguments.seed,
+    )
+
+    report_json = json.dumps(report, indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            output_file.write(report_json)
+    else:
+        print(report_json)
+
+
+if __name__ == '__main__':
+    main()
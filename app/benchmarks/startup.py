@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+
+"""
+    Startup benchmark: measures how long a fresh process takes from launch to
+    its first successful /health-check and which modules cost the most to
+    import.
+
+    Usage (from the repository root):
+        python -m app.benchmarks.startup --runs 5 --max-startup-seconds 3
+
+    A JSON report is printed, and the exit code is 1 when one of the informed
+    limits is exceeded, so it can be used to catch regressions in CI.
+"""
+
+REPOSITORY_ROOT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+_IMPORT_TIME_LINE = re.compile(
+    r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)$'
+)
+
+
+def _environment(db_uri):
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = REPOSITORY_ROOT
+    environment['DB_URI'] = db_uri
+    return environment
+
+
+def measure_import_times(db_uri, top=15):
+    """Import the application with '-X importtime' and parse its output
+
+    Args:
+        db_uri (str): pyDAL URI used by the application
+        top (int): Number of modules to report
+
+    Returns:
+        float, list[dict]: Total import time of 'app.main' in seconds and the
+        slowest top level imports
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app.main'],
+        env=_environment(db_uri),
+        cwd=tempfile.gettempdir(),
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    # '-X importtime' prints the imports of a module before the module
+    # itself, so the direct imports of 'app.main' are the second level lines
+    # found after the previous top level import
+    modules = []
+    total_seconds = None
+    for line in process.stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+
+        self_us, cumulative_us, indentation, module = match.groups()
+        if len(indentation) == 1:
+            if module == 'app.main':
+                total_seconds = int(cumulative_us) / 1e6
+                break
+            modules = []
+        elif len(indentation) == 3:
+            modules.append({
+                'module': module,
+                'self_ms': int(self_us) / 1e3,
+                'cumulative_ms': int(cumulative_us) / 1e3,
+            })
+
+    modules.sort(key=lambda module: module['cumulative_ms'], reverse=True)
+    return total_seconds, modules[:top]
+
+
+def _free_port():
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        return free_socket.getsockname()[1]
+
+
+def measure_time_to_first_health_check(db_uri, timeout=30):
+    """Start uvicorn in a new process and poll /health-check until it passes
+
+    Args:
+        db_uri (str): pyDAL URI used by the application
+        timeout (float): Seconds to wait for the health check to pass
+
+    Raises:
+        RuntimeError: if the application does not become healthy in time
+
+    Returns:
+        float: Seconds from process launch to the first healthy response
+    """
+    port = _free_port()
+    url = 'http://127.0.0.1:{}/health-check'.format(port)
+
+    with tempfile.TemporaryDirectory() as working_directory:
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'app.main:app',
+             '--host', '127.0.0.1', '--port', str(port),
+             '--log-level', 'warning'],
+            env=_environment(db_uri),
+            cwd=working_directory,
+        )
+
+        try:
+            while time.perf_counter() - started < timeout:
+                if server.poll() is not None:
+                    raise RuntimeError('The application exited on startup')
+                try:
+                    with urllib.request.urlopen(url, timeout=1) as response:
+                        if response.status == 200:
+                            return time.perf_counter() - started
+                except OSError:
+                    time.sleep(0.01)
+            raise RuntimeError('Health check did not pass in time')
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def run_benchmark(runs=3, db_uri=None):
+    """Measure the startup of the application a few times
+
+    Args:
+        runs (int): Number of cold starts to measure
+        db_uri (str): pyDAL URI used by the application, a temporary SQLite
+            database when not informed
+
+    Returns:
+        dict: Benchmark report
+    """
+    with tempfile.TemporaryDirectory() as database_directory:
+        if not db_uri:
+            db_uri = 'sqlite://{}'.format(
+                os.path.join(database_directory, 'startup.sqlite')
+            )
+
+        import_seconds, modules = measure_import_times(db_uri)
+        startup_seconds = [
+            measure_time_to_first_health_check(db_uri) for _ in range(runs)
+        ]
+
+    return {
+        'runs': runs,
+        'import_seconds': import_seconds,
+        'time_to_first_health_check_seconds': {
+            'median': statistics.median(startup_seconds),
+            'min': min(startup_seconds),
+            'max': max(startup_seconds),
+        },
+        'slowest_imports': modules,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the application cold start'
+    )
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--db-uri', default=None)
+    parser.add_argument('--max-import-seconds', type=float, default=None)
+    parser.add_argument('--max-startup-seconds', type=float, default=None)
+    arguments = parser.parse_args()
+
+    report = run_benchmark(arguments.runs, arguments.db_uri)
+    print(json.dumps(report, indent=2))
+
+    startup_seconds = report['time_to_first_health_check_seconds']['median']
+    if arguments.max_import_seconds is not None \
+            and report['import_seconds'] > arguments.max_import_seconds:
+        sys.exit(1)
+    if arguments.max_startup_seconds is not None \
+            and startup_seconds > arguments.max_startup_seconds:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
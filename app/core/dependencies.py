@@ -1,22 +1,170 @@
-from .models.database import retrieve_dal_connection
+import threading
+from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from .models.database import retrieve_dal_connection, database_pool
+from .models.pool import PoolTimeout
+from .search import autocomplete, facets, snapshot
 from . import settings
 
 
-def get_db():
-    """Get a new or existing database connection and yields it, after which
-    the connection is closed and returned to the connection pool
+# Serializes the cold start build of the snapshot by the threadpool threads
+# running 'get_snapshot'
+_snapshot_build_lock = threading.Lock()
 
-    Yields:
+
+def connect_db():
+    """Create a pyDAL connection using the project settings
+
+    Returns:
         DAL: pyDAL connection object
     """
-    db = retrieve_dal_connection(
+    return retrieve_dal_connection(
         db_host=settings.DB_HOST,
         db_name=settings.DB_NAME,
         db_user=settings.DB_USER,
         db_password=settings.DB_PASSWORD,
+        uri=settings.DB_URI,
     )
 
+
+async def get_db():
+    """Get a new or existing database connection and yields it, after which
+    the connection is closed and returned to the connection pool.
+
+    It waits, without blocking the event loop, while the worker already has
+    DB_POOL_SIZE + DB_MAX_OVERFLOW connections checked out. It runs in the
+    event loop thread, like the endpoints using it, because pyDAL keeps its
+    connections in thread locals
+
+    Raises:
+        HTTPException: raises exception 503 when no connection is available
+        within DB_POOL_TIMEOUT
+
+    Yields:
+        DAL: pyDAL connection object
+    """
+    try:
+        slot = await database_pool.acquire()
+    except PoolTimeout as error:
+        raise HTTPException(status_code=503, detail=str(error),
+                            headers={'Retry-After': '1'})
+
+    try:
+        db = connect_db()
+        database_pool.checked_out(db)
+        try:
+            yield db
+        finally:
+            database_pool.checked_in(db)
+            db.close()
+    finally:
+        database_pool.release(slot)
+
+
+async def run_with_db(function, *args):
+    """Run 'function(db, *args)' in a threadpool thread, with a database
+    connection checked out for this call only. Streamed responses use it for
+    each part, so they neither hold a connection between parts nor block the
+    event loop with their queries
+
+    Args:
+        function (callable): Called with a pyDAL connection object and args
+        args: Arguments of the function
+
+    Raises:
+        HTTPException: raises exception 503 when no connection is available
+        within DB_POOL_TIMEOUT
+
+    Returns:
+        The function result
+    """
+    try:
+        slot = await database_pool.acquire()
+    except PoolTimeout as error:
+        raise HTTPException(status_code=503, detail=str(error),
+                            headers={'Retry-After': '1'})
+
+    def run():
+        # the connection belongs to the threadpool thread running the call
+        db = connect_db()
+        database_pool.checked_out(db)
+        try:
+            return function(db, *args)
+        finally:
+            database_pool.checked_in(db)
+            db.close()
+
     try:
-        yield db
+        return await run_in_threadpool(run)
     finally:
-        db.close()
+        database_pool.release(slot)
+
+
+def get_db_runner():
+    """Get the function running database calls with a connection of their
+    own, see 'run_with_db'
+
+    Returns:
+        callable: Async function called with a function and its arguments
+    """
+    return run_with_db
+
+
+def _current_snapshot():
+    """Returns the snapshot file, None when it is missing or was written in
+    an older format version"""
+    try:
+        return snapshot.get_snapshot(settings.SNAPSHOT_PATH)
+    except snapshot.SnapshotError:
+        return None
+
+
+def get_snapshot():
+    """Get the memory-mapped candidate snapshot. It is only created from the
+    database when no import has written it yet (or it was written by an
+    older version), by a single thread of the worker
+
+    Returns:
+        CandidateSnapshot: Current candidate snapshot
+    """
+    candidate_snapshot = _current_snapshot()
+    if candidate_snapshot is not None:
+        return candidate_snapshot
+
+    with _snapshot_build_lock:
+        # written by another thread while waiting for the lock
+        candidate_snapshot = _current_snapshot()
+        if candidate_snapshot is not None:
+            return candidate_snapshot
+
+        db = connect_db()
+        try:
+            return snapshot.write_snapshot(db, settings.SNAPSHOT_PATH)
+        finally:
+            db.close()
+
+
+def get_autocomplete_indexes(candidate_snapshot=Depends(get_snapshot)):
+    """Get the in-memory autocomplete indexes of this worker, built from the
+    candidate snapshot
+
+    Args:
+        candidate_snapshot (CandidateSnapshot): Current candidate snapshot
+
+    Returns:
+        dict[str, PrefixIndex]: Prefix index per field
+    """
+    return autocomplete.get_indexes(candidate_snapshot)
+
+
+def get_facet_index(candidate_snapshot=Depends(get_snapshot)):
+    """Get the in-memory facet index of this worker, built from the
+    candidate snapshot
+
+    Args:
+        candidate_snapshot (CandidateSnapshot): Current candidate snapshot
+
+    Returns:
+        FacetIndex: Facet counts of the current snapshot generation
+    """
+    return facets.get_index(candidate_snapshot)
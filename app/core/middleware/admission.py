@@ -0,0 +1,283 @@
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from .. import settings
+
+
+"""
+    Admission control of the expensive endpoints.
+
+    Each limited path has a maximum number of requests running at once and a
+    short bounded queue. A request is rejected with a fast 503 and a
+    'Retry-After' header, instead of waiting, when:
+    - the queue is full
+    - the expected wait, estimated from the queue position and the moving
+    average of the service time, exceeds the client deadline
+    - it is still queued when the deadline expires
+
+    The deadline is read from the 'X-Request-Timeout-Ms' header, or
+    ADMISSION_DEFAULT_DEADLINE_MS, and capped at ADMISSION_MAX_DEADLINE_MS.
+    Paths without a limiter, like the management and health check routes,
+    are never queued. Every public route using the database has a limiter,
+    and the limits add up below the database pool size so those routes still
+    get connections during spikes. A limiter may be shared by several paths.
+"""
+
+DEADLINE_HEADER = b'x-request-timeout-ms'
+
+# Weight of the last request in the service time moving average
+EWMA_WEIGHT = 0.2
+
+
+class Rejected(Exception):
+
+    def __init__(self, reason, retry_after):
+        """
+        Args:
+            reason (str): Why the request was rejected
+            retry_after (float): Seconds after which a retry may be admitted
+        """
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+
+    def __init__(self, name, max_concurrency, max_queue):
+        """
+        Args:
+            name (str): Limiter name, used in the metrics
+            max_concurrency (int): Requests running at once
+            max_queue (int): Requests waiting for a slot
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+
+        self.in_flight = 0
+        self._queue = deque()
+        self.service_time = None
+
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_deadline = 0
+        self.shed_timeout = 0
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    def expected_wait(self):
+        """Seconds a new request is expected to wait for a slot
+
+        Returns:
+            float: Expected wait, 0 while no service time was measured
+        """
+        if self.in_flight < self.max_concurrency and not self._queue:
+            return 0.0
+        if self.service_time is None:
+            return 0.0
+        # requests ahead of it leave every 'service_time / max_concurrency'
+        return (self.queued + 1) * self.service_time / self.max_concurrency
+
+    async def acquire(self, deadline):
+        """Wait for a slot
+
+        Args:
+            deadline (float): Seconds the client waits for the response
+
+        Raises:
+            Rejected: if no slot is expected to be free before the deadline
+        """
+        if self.in_flight < self.max_concurrency and not self._queue:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+
+        expected_wait = self.expected_wait()
+        if len(self._queue) >= self.max_queue:
+            self.shed_queue_full += 1
+            raise Rejected('Too many requests waiting', expected_wait)
+        if expected_wait > deadline:
+            self.shed_deadline += 1
+            raise Rejected(
+                'Expected wait of {:.3f}s exceeds the deadline'.format(
+                    expected_wait
+                ),
+                expected_wait
+            )
+
+        slot = asyncio.get_event_loop().create_future()
+        self._queue.append(slot)
+        try:
+            await asyncio.wait_for(asyncio.shield(slot), deadline)
+        except asyncio.TimeoutError:
+            if not slot.done():
+                slot.cancel()
+                self._queue.remove(slot)
+                self.shed_timeout += 1
+                raise Rejected('Deadline expired while waiting',
+                               self.expected_wait())
+        except asyncio.CancelledError:
+            if slot.done() and not slot.cancelled():
+                # the slot was handed over before the client left
+                self.release(None)
+            else:
+                slot.cancel()
+                self._queue.remove(slot)
+            raise
+
+        # released requests hand their slot over, 'in_flight' is unchanged
+        self.admitted += 1
+
+    def release(self, service_time):
+        """Give the slot to the next queued request
+
+        Args:
+            service_time (float): Seconds the request took, None when it did
+                not run
+        """
+        if service_time is not None:
+            if self.service_time is None:
+                self.service_time = service_time
+            else:
+                self.service_time += EWMA_WEIGHT * (
+                    service_time - self.service_time
+                )
+
+        while self._queue:
+            slot = self._queue.popleft()
+            if not slot.done():
+                slot.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self):
+        """Limiter configuration, state and counters
+
+        Returns:
+            dict: Limiter metrics
+        """
+        return {
+            'name': self.name,
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'admitted': self.admitted,
+            'shed_queue_full': self.shed_queue_full,
+            'shed_deadline': self.shed_deadline,
+            'shed_timeout': self.shed_timeout,
+            'service_time_ms': round(self.service_time * 1000, 3)
+            if self.service_time is not None else None,
+        }
+
+
+def _deadline(scope, default_deadline, max_deadline):
+    deadline = default_deadline
+    for name, value in scope.get('headers', []):
+        if name == DEADLINE_HEADER:
+            try:
+                value = float(value) / 1000
+            except ValueError:
+                break
+            # 'nan' and 'inf' parse as floats too
+            if math.isfinite(value):
+                deadline = max(0.0, value)
+            break
+    return min(deadline, max_deadline)
+
+
+async def _reject(send, rejected):
+    body = json.dumps({"detail": str(rejected)}).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': 503,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('ascii')),
+            (b'retry-after',
+             str(max(1, math.ceil(rejected.retry_after))).encode('ascii')),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware limiting the concurrency of the routes with a limiter.
+    Other methods of the same path, like the CORS preflight requests, are not
+    limited"""
+
+    def __init__(self, app, limiters, default_deadline, max_deadline):
+        """
+        Args:
+            app (ASGIApp): Application
+            limiters (dict[tuple[str, str], AdmissionLimiter]): Limiter by
+                (method, path)
+            default_deadline (float): Seconds the clients wait for the
+                response, when not informed by the request
+            max_deadline (float): Maximum seconds a request waits for a
+                slot, whatever the client informs
+        """
+        self.app = app
+        self.limiters = limiters
+        self.default_deadline = default_deadline
+        self.max_deadline = max_deadline
+
+    async def __call__(self, scope, receive, send):
+        limiter = None
+        if scope['type'] == 'http':
+            limiter = self.limiters.get(
+                (scope['method'], scope['path'].rstrip('/'))
+            )
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await limiter.acquire(_deadline(scope, self.default_deadline,
+                                            self.max_deadline))
+        except Rejected as rejected:
+            await _reject(send, rejected)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.perf_counter() - started)
+
+
+def _create_limiters():
+    limits = [
+        ([('GET', '/candidates')], 'candidates',
+         settings.ADMISSION_CANDIDATES_CONCURRENCY,
+         settings.ADMISSION_CANDIDATES_QUEUE),
+        ([('POST', '/candidates/elastic-proxy/candidates/_msearch')],
+         'elastic-proxy',
+         settings.ADMISSION_PROXY_CONCURRENCY,
+         settings.ADMISSION_PROXY_QUEUE),
+        # the slot is held while the whole export is streamed
+        ([('GET', '/candidates/export')], 'export',
+         settings.ADMISSION_EXPORT_CONCURRENCY,
+         settings.ADMISSION_EXPORT_QUEUE),
+        # served from the snapshot or short queries, the snapshot is built
+        # from the database on a cold start
+        ([('GET', '/candidates/facets'),
+          ('GET', '/candidates/search-options'),
+          ('GET', '/candidates/autocomplete')], 'lookups',
+         settings.ADMISSION_LOOKUP_CONCURRENCY,
+         settings.ADMISSION_LOOKUP_QUEUE),
+    ]
+    limiters = {}
+    for routes, name, max_concurrency, max_queue in limits:
+        if max_concurrency > 0:
+            limiter = AdmissionLimiter(name, max_concurrency, max_queue)
+            for route in routes:
+                limiters[route] = limiter
+    return limiters
+
+
+admission_limiters = _create_limiters()
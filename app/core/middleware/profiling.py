@@ -0,0 +1,359 @@
+import contextvars
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+from .. import settings
+
+
+"""
+    Opt-in statistical profiler of single requests.
+
+    A profiled request is sampled by a background thread, which reads the
+    stacks of the threads serving the request every PROFILING_INTERVAL_MS:
+    the event loop thread, as the endpoints are 'async def', and the
+    threadpool threads while they run its sync dependencies or
+    run_in_threadpool calls, tracked by ProfiledExecutor. Requests running
+    concurrently in the same event loop show up in the profile too, which
+    is what slows the profiled request down as well.
+
+    Requests are profiled when they send the 'X-Profile' header with
+    PROFILING_SECRET, or at random with PROFILING_SAMPLE_RATE. One request
+    is profiled at a time per worker.
+
+    The middleware is only added when profiling is enabled, so it costs
+    nothing otherwise.
+"""
+
+PROFILE_HEADER = b'x-profile'
+PROFILE_ID_HEADER = b'x-profile-id'
+
+_PROFILE_ID = re.compile(r'[0-9a-f]{32}')
+
+# Reading the profiles sends the 'X-Profile' header too, without profiling
+# the read and pushing the stored profiles out of the ring buffer
+PROFILES_PATH = '/management/profiles'
+
+
+class _Sampler:
+    """Counts the stacks of the threads serving a request, sampled from a
+    background thread"""
+
+    def __init__(self, thread_id, interval):
+        """
+        Args:
+            thread_id (int): Identifier of the thread running the request
+            interval (float): Seconds between samples
+        """
+        self.thread_ids = {thread_id}
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='request-profiler')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        (code.co_name, code.co_filename, code.co_firstlineno)
+                    )
+                    frame = frame.f_back
+                if stack:
+                    stack.reverse()
+                    self.stacks[tuple(stack)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+# Sampler of the request running in the current context
+_active_sampler = contextvars.ContextVar('active_sampler', default=None)
+
+
+class ProfiledExecutor(ThreadPoolExecutor):
+    """Default executor of the event loop while profiling is enabled. The
+    threadpool threads running work of a profiled request (sync
+    dependencies, run_in_threadpool calls like the Elasticsearch requests)
+    are sampled with it while they run"""
+
+    def submit(self, fn, *args, **kwargs):
+        # called from the event loop, in the context of the request
+        sampler = _active_sampler.get()
+        if sampler is None:
+            return super().submit(fn, *args, **kwargs)
+
+        def run_sampled():
+            thread_id = threading.get_ident()
+            sampler.thread_ids.add(thread_id)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                sampler.thread_ids.discard(thread_id)
+
+        return super().submit(run_sampled)
+
+
+class ProfileStore:
+    """Ring buffer of profiles stored as JSON files in a directory, the
+    oldest ones are removed when there are more than 'max_profiles'"""
+
+    def __init__(self, directory, max_profiles):
+        """
+        Args:
+            directory (str): Directory of the profiles
+            max_profiles (int): Profiles kept
+        """
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def _files(self):
+        """Profile file names, oldest first"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if name.endswith('.json'))
+
+    def save(self, profile):
+        """Store a profile, removing the oldest ones over the limit
+
+        Args:
+            profile (dict): Profile, as created by ProfilingMiddleware
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        name = '{:020d}-{}.json'.format(time.time_ns(), profile['id'])
+        path = os.path.join(self.directory, name)
+
+        with open(path + '.tmp', 'w') as profile_file:
+            json.dump(profile, profile_file)
+        os.replace(path + '.tmp', path)
+
+        with self._lock:
+            files = self._files()
+            for old_name in files[:max(0, len(files) - self.max_profiles)]:
+                try:
+                    os.remove(os.path.join(self.directory, old_name))
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        """Summary of the stored profiles, newest first
+
+        Returns:
+            list[dict]: Profiles without their stacks
+        """
+        summaries = []
+        for name in reversed(self._files()):
+            profile = self._read(name)
+            if profile is not None:
+                profile.pop('frames')
+                profile.pop('stacks')
+                summaries.append(profile)
+        return summaries
+
+    def load(self, profile_id):
+        """Read a stored profile
+
+        Args:
+            profile_id (str): Profile ID
+
+        Returns:
+            dict: Profile, None if it is not stored
+        """
+        if not _PROFILE_ID.fullmatch(profile_id):
+            return None
+        for name in self._files():
+            if name.endswith('-{}.json'.format(profile_id)):
+                return self._read(name)
+        return None
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.directory, name)) as profile_file:
+                return json.load(profile_file)
+        except (FileNotFoundError, ValueError):
+            # removed by the ring buffer meanwhile
+            return None
+
+
+def _frame_name(frame):
+    name, filename, line = frame
+    return '{} ({}:{})'.format(name, filename, line)
+
+
+def to_collapsed(profile):
+    """Convert a profile to the collapsed stack format, one
+    'frame;frame;frame count' line per stack, used by flamegraph.pl and
+    speedscope
+
+    Args:
+        profile (dict): Stored profile
+
+    Returns:
+        str: Collapsed stacks
+    """
+    lines = []
+    for frame_ids, count in profile['stacks']:
+        lines.append('{} {}'.format(
+            ';'.join(_frame_name(profile['frames'][frame_id])
+                     for frame_id in frame_ids),
+            count
+        ))
+    return '\n'.join(lines) + '\n'
+
+
+def to_speedscope(profile):
+    """Convert a profile to the speedscope file format
+
+    Args:
+        profile (dict): Stored profile
+
+    Returns:
+        dict: speedscope 'sampled' profile, with weights in milliseconds
+    """
+    interval_ms = profile['interval_ms']
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "exporter": "job-finder-back",
+        "name": '{} {}'.format(profile['method'], profile['path']),
+        "activeProfileIndex": 0,
+        "shared": {
+            "frames": [
+                {"name": name, "file": filename, "line": line}
+                for name, filename, line in profile['frames']
+            ]
+        },
+        "profiles": [{
+            "type": "sampled",
+            "name": '{} {}'.format(profile['method'], profile['path']),
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": profile['samples'] * interval_ms,
+            "samples": [frame_ids for frame_ids, _ in profile['stacks']],
+            "weights": [
+                count * interval_ms for _, count in profile['stacks']
+            ],
+        }],
+    }
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the requests selected by the 'X-Profile'
+    header or by the sample rate, the ID of the stored profile is returned in
+    the 'X-Profile-Id' response header"""
+
+    def __init__(self, app, store, secret='', sample_rate=0.0,
+                 interval=0.005):
+        """
+        Args:
+            app (ASGIApp): Application
+            store (ProfileStore): Where profiles are stored
+            secret (str): Value of the 'X-Profile' header profiling a
+                request, empty to only profile sampled requests
+            sample_rate (float): Fraction of the requests profiled
+            interval (float): Seconds between samples
+        """
+        self.app = app
+        self.store = store
+        self.secret = secret.encode('utf-8')
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self._busy = threading.Lock()
+
+    def _selected(self, scope):
+        if scope['path'].startswith(PROFILES_PATH):
+            return False
+        if self.secret:
+            for name, value in scope.get('headers', []):
+                if name == PROFILE_HEADER:
+                    return hmac.compare_digest(value, self.secret)
+        return random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self._selected(scope) \
+                or not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self._profile(scope, receive, send)
+        finally:
+            self._busy.release()
+
+    async def _profile(self, scope, receive, send):
+        profile_id = uuid.uuid4().hex
+        status_code = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                message = dict(message)
+                message['headers'] = list(message.get('headers', [])) + [
+                    (PROFILE_ID_HEADER, profile_id.encode('ascii'))
+                ]
+            await send(message)
+
+        sampler = _Sampler(threading.get_ident(), self.interval)
+        started = time.perf_counter()
+        sampler.start()
+        token = _active_sampler.set(sampler)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _active_sampler.reset(token)
+            sampler.stop()
+            duration = time.perf_counter() - started
+            # file writes and pruning stay off the event loop
+            await run_in_threadpool(self.store.save, self._create_profile(
+                profile_id, scope, status_code, duration, sampler
+            ))
+
+    def _create_profile(self, profile_id, scope, status_code, duration,
+                        sampler):
+        frames = {}
+        stacks = []
+        for stack, count in sampler.stacks.most_common():
+            frame_ids = [
+                frames.setdefault(frame, len(frames)) for frame in stack
+            ]
+            stacks.append([frame_ids, count])
+
+        return {
+            'id': profile_id,
+            'created_on': datetime.utcnow().isoformat(),
+            'method': scope['method'],
+            'path': scope['path'],
+            'query': scope.get('query_string', b'').decode('latin-1'),
+            'status_code': status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'interval_ms': self.interval * 1000,
+            'samples': sum(sampler.stacks.values()),
+            'frames': list(frames),
+            'stacks': stacks,
+        }
+
+
+profile_store = ProfileStore(settings.PROFILING_DIR,
+                             settings.PROFILING_MAX_PROFILES)
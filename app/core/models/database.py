@@ -1,30 +1,50 @@
-from pydal import DAL
 from .database_tables import define_tables
+from .pool import DatabasePool
+from .. import settings
 
+database_pool = DatabasePool(
+    size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    timeout=settings.DB_POOL_TIMEOUT,
+    max_age=settings.DB_CONN_MAX_AGE,
+    pre_ping=settings.DB_POOL_PRE_PING,
+)
 
-def retrieve_dal_connection(db_host, db_name, db_user, db_password):
-    """Create pyDAL connection or retrieves it from the connection pool
+
+def retrieve_dal_connection(db_host, db_name, db_user, db_password, uri=None):
+    """Create pyDAL connection or retrieves it from the connection pool.
+
+    pyDAL is imported on the first connection and tables are defined lazily,
+    on first access, so neither slows down the application startup
 
     Args:
         db_host (str): Database hostname and port, ex.: "localhost:3306"
         db_name (str): Database schema name
         db_user (str): Databse user
         db_password (str): Database password
+        uri (str): Full pyDAL connection URI, when informed it is used instead
+            of the MySQL parameters. Ex.: "sqlite://jobfinder.sqlite"
 
     Returns:
         DAL: pyDAL connection object
     """
-    uri = "mysql://{0}:{1}@{2}/{3}".format(db_user, db_password, db_host,
-                                           db_name)
+    from pydal import DAL
+
+    if not uri:
+        uri = "mysql://{0}:{1}@{2}/{3}".format(db_user, db_password, db_host,
+                                               db_name)
     db = DAL(
         uri,
-        pool_size=10,
+        pool_size=database_pool.size,
         folder='./',
         migrate=True,
         fake_migrate=True,
         fake_migrate_all=True,
         check_reserved=['all'],
+        lazy_tables=True,
+        after_connection=database_pool.after_connection,
     )
+    database_pool.instrument(db._adapter)
     define_tables(db)
 
     return db
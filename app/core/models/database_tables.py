@@ -1,4 +1,90 @@
-from pydal import Field
+import datetime
+
+
+def record_search_changes(db, candidate_ids):
+    """Record in the search outbox that the Elasticsearch documents of the
+    candidates must be synced, and increment their search version. Both are
+    written in the same transaction as the change.
+
+    Incrementing the version locks the candidate rows until the transaction
+    ends, so the versions of a candidate follow the commit order of its
+    changes, which outbox row IDs do not
+
+    Args:
+        db (DAL): pyDAL connection object
+        candidate_ids (iterable[int]): Changed candidate IDs
+    """
+    candidate_ids = set(candidate_ids)
+    if not candidate_ids:
+        return
+
+    changed = db(db.candidate.id.belongs(candidate_ids))
+    changed.update_naive(
+        search_version=db.candidate.search_version.coalesce(0) + 1
+    )
+
+    now = datetime.datetime.utcnow()
+    for candidate in changed.select(db.candidate.id,
+                                    db.candidate.search_version):
+        db.search_outbox.insert(
+            candidate_id=candidate.id,
+            version=candidate.search_version,
+            created_on=now,
+            next_attempt_on=now,
+        )
+
+
+def _record_candidate_changes(table):
+    """Callbacks recording every write to 'candidate' in the search outbox"""
+    db = table._db
+
+    def changed_ids(rows_set):
+        return [row.id for row in rows_set.select(table.id)]
+
+    table._after_insert.append(
+        lambda fields, candidate_id: record_search_changes(db, [candidate_id])
+    )
+    table._before_update.append(
+        lambda rows_set, fields: record_search_changes(
+            db, changed_ids(rows_set)
+        )
+    )
+    table._before_delete.append(
+        lambda rows_set: record_search_changes(db, changed_ids(rows_set))
+    )
+
+
+def _record_tech_reference_changes(table):
+    """Callbacks recording every write to 'candidate_tech_reference' in the
+    search outbox"""
+    db = table._db
+
+    def changed_ids(rows_set):
+        return [
+            row.candidate_id
+            for row in rows_set.select(table.candidate_id, distinct=True)
+        ]
+
+    def updated_ids(rows_set, fields):
+        # a reference moved to another candidate changes both documents
+        candidate_ids = changed_ids(rows_set)
+        if fields.get('candidate_id') is not None:
+            candidate_ids.append(fields.get('candidate_id'))
+        return candidate_ids
+
+    table._after_insert.append(
+        lambda fields, reference_id: record_search_changes(
+            db, [fields['candidate_id']]
+        )
+    )
+    table._before_update.append(
+        lambda rows_set, fields: record_search_changes(
+            db, updated_ids(rows_set, fields)
+        )
+    )
+    table._before_delete.append(
+        lambda rows_set: record_search_changes(db, changed_ids(rows_set))
+    )
 
 
 def define_tables(db):
@@ -14,6 +100,7 @@ def define_tables(db):
     Args:
         db (DAL): pyDAL connection object
     """
+    from pydal import Field
 
     db.define_table(
         'city',
@@ -32,6 +119,10 @@ def define_tables(db):
         # composite index
         Field('years_experience_min', 'integer', default=0),  # needs index
         Field('years_experience_max', 'integer', default=99),  # needs index
+        # Incremented on every change, the version of the Elasticsearch
+        # document
+        Field('search_version', 'integer', default=0),
+        on_define=_record_candidate_changes,
     )
 
     db.define_table(
@@ -41,4 +132,21 @@ def define_tables(db):
         Field('tech_id', 'integer', 'reference tech', notnull=True,
               required=True),
         Field('is_main_tech', 'boolean', default=False),
+        on_define=_record_tech_reference_changes,
+    )
+
+    # Candidates whose Elasticsearch documents must be synced, written in the
+    # same transaction as the candidate changes and read by the search syncer
+    db.define_table(
+        'search_outbox',
+        Field('candidate_id', 'integer', notnull=True, required=True),
+        # search_version of the candidate after the change
+        Field('version', 'integer'),
+        Field('created_on', 'datetime', notnull=True),
+        Field('attempts', 'integer', default=0),
+        Field('next_attempt_on', 'datetime', notnull=True),  # needs index
+        Field('last_error', 'string', length=255),
+        # Syncer claiming the row until 'claimed_until'
+        Field('claimed_by', 'string', length=32),
+        Field('claimed_until', 'datetime'),
     )
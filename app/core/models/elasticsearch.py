@@ -1,34 +1,60 @@
-from elasticsearch import Elasticsearch
 from .. import settings
 
-ELASTIC_HOST = settings.ELASTIC_HOST
-ELASTIC_USERNAME = settings.ELASTIC_USERNAME
-ELASTIC_PASSWORD = settings.ELASTIC_PASSWORD
+"""
+    The Elasticsearch client is only imported and created on first use, so
+    the application starts without loading it.
 
+    ELASTIC_HOST may also be a full URL, ex.: "http://127.0.0.1:9201", which
+    is used as is (local stand-ins for benchmarks and tests)
+"""
 
-def get_elastic(): 
-    if ELASTIC_HOST == 'localhost':
-        es = Elasticsearch()
-    else:
-        es = Elasticsearch(
-            [ELASTIC_HOST],
-            http_auth=(
-                ELASTIC_USERNAME,
-                ELASTIC_PASSWORD
-            ),
-            scheme="https",
-            port=443,
-        )
-    return es
+# (ELASTIC_HOST, client) of the client already created
+_client = None
+
+
+def _is_url(host):
+    return host.startswith('http://') or host.startswith('https://')
+
+
+def get_elastic():
+    """Returns the Elasticsearch client, creating it on first use
+
+    Returns:
+        Elasticsearch: Elasticsearch client
+    """
+    global _client
+
+    host = settings.ELASTIC_HOST
+    if _client is None or _client[0] != host:
+        from elasticsearch import Elasticsearch
+
+        if host == 'localhost':
+            es = Elasticsearch()
+        elif _is_url(host):
+            es = Elasticsearch([host])
+        else:
+            es = Elasticsearch(
+                [host],
+                http_auth=(
+                    settings.ELASTIC_USERNAME,
+                    settings.ELASTIC_PASSWORD
+                ),
+                scheme="https",
+                port=443,
+            )
+        _client = (host, es)
+    return _client[1]
 
 
 def get_elastic_credentials():
-    return ELASTIC_USERNAME, ELASTIC_PASSWORD
+    return settings.ELASTIC_USERNAME, settings.ELASTIC_PASSWORD
 
 
 def get_elastic_base_url():
-    if ELASTIC_HOST == 'localhost':
-        httpsElastic = f"http://{ELASTIC_HOST}:9200/"
+    if settings.ELASTIC_HOST == 'localhost':
+        httpsElastic = f"http://{settings.ELASTIC_HOST}:9200/"
+    elif _is_url(settings.ELASTIC_HOST):
+        httpsElastic = settings.ELASTIC_HOST.rstrip('/') + '/'
     else:
-        httpsElastic = f"https://{ELASTIC_HOST}/"
+        httpsElastic = f"https://{settings.ELASTIC_HOST}/"
     return httpsElastic
@@ -0,0 +1,258 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+
+"""
+    pyDAL keeps up to 'pool_size' idle connections per database URI, but it
+    opens as many connections as requested and does not record anything
+    about them. DatabasePool limits how many connections a worker checks out
+    at once (pool size + max overflow), recycles connections older than the
+    max age and keeps the telemetry used to tune the pool size against the
+    number of uvicorn workers.
+
+    Every uvicorn worker has its own pool, so the database may receive up to
+    workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+"""
+
+# Number of recent checkout wait times kept for the percentiles
+WAIT_TIMES_KEPT = 1000
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class DatabasePool:
+
+    def __init__(self, size, max_overflow, timeout, max_age, pre_ping):
+        """
+        Args:
+            size (int): Idle connections kept by pyDAL
+            max_overflow (int): Connections allowed above 'size' under load,
+                closed when they are returned
+            timeout (float): Seconds to wait for a connection
+            max_age (float): Seconds after which a connection is replaced,
+                0 to keep connections forever
+            pre_ping (bool): Test pooled connections before using them
+        """
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.max_age = max_age
+        self.pre_ping = pre_ping
+
+        self._lock = threading.Lock()
+        # set while a new connection runs its hooks
+        self._connecting = threading.local()
+        self._semaphore = None
+        self._semaphore_loop = None
+        # id(connection): creation time, pyDAL connections can not be
+        # weak-referenced (sqlite3) nor extended with attributes
+        self._created_on = {}
+        self._active = set()
+        self._uris = set()
+        self._wait_times = deque(maxlen=WAIT_TIMES_KEPT)
+
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connections_created = 0
+        self.connections_recycled = 0
+        self.pre_ping_failures = 0
+
+    @property
+    def max_connections(self):
+        return self.size + self.max_overflow
+
+    @property
+    def active(self):
+        return len(self._active)
+
+    def _get_semaphore(self):
+        """asyncio primitives belong to an event loop, so the semaphore is
+        created on the loop running the application"""
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    def instrument(self, adapter):
+        """Configure the pre-ping of a pyDAL adapter, on the adapter instead of
+        pyDAL's class-level ConnectionPool.check_active_connection, and count
+        the pooled connections failing it, which pyDAL drops and replaces
+        with new ones
+
+        Args:
+            adapter (BaseAdapter): pyDAL adapter of a new DAL, before it
+                connects
+        """
+        adapter.check_active_connection = self.pre_ping
+        test_connection = adapter.test_connection
+
+        def pre_ping():
+            new_connection = getattr(self._connecting, 'value', False)
+            self._connecting.value = False
+            try:
+                test_connection()
+            except Exception:
+                if not new_connection:
+                    with self._lock:
+                        self.pre_ping_failures += 1
+                raise
+
+        adapter.test_connection = pre_ping
+
+    def after_connection(self, adapter):
+        """pyDAL 'after_connection' hook, called for every new connection
+
+        Args:
+            adapter (BaseAdapter): pyDAL adapter of the new connection
+        """
+        # pyDAL tests new connections too, right after this hook
+        self._connecting.value = True
+        with self._lock:
+            self.connections_created += 1
+            self._created_on[id(adapter.connection)] = time.monotonic()
+
+    async def acquire(self):
+        """Wait for a free connection slot
+
+        Raises:
+            PoolTimeout: if no slot was released within the pool timeout
+
+        Returns:
+            asyncio.Semaphore: Semaphore the slot was taken from, to be given
+            back to 'release'
+        """
+        semaphore = self._get_semaphore()
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PoolTimeout(
+                'No database connection available after {}s'.format(
+                    self.timeout
+                )
+            )
+        finally:
+            self.waiting -= 1
+
+        self.checkouts += 1
+        self._wait_times.append(time.perf_counter() - started)
+        return semaphore
+
+    def release(self, semaphore):
+        """Free a connection slot
+
+        Args:
+            semaphore (asyncio.Semaphore): Returned by 'acquire', as the
+                current semaphore may belong to another event loop by now
+        """
+        semaphore.release()
+
+    def checked_out(self, db):
+        """Register the connection of a DAL taken from the pool, replacing it
+        when it is older than the max age
+
+        Args:
+            db (DAL): pyDAL connection object
+        """
+        adapter = db._adapter
+        try:
+            connection = adapter.connection
+        except Exception:
+            # pyDAL connects lazily, so connection errors are left to be
+            # raised by the first query, as without the pool
+            return
+
+        with self._lock:
+            self._uris.add(adapter.uri)
+            created_on = self._created_on.setdefault(id(connection),
+                                                     time.monotonic())
+
+        if self.max_age and time.monotonic() - created_on > self.max_age:
+            with self._lock:
+                self._created_on.pop(id(connection), None)
+                self.connections_recycled += 1
+            try:
+                connection.close()
+            except Exception:
+                pass
+            adapter.set_connection(None)
+            connection = adapter.get_connection(use_pool=False)
+
+        with self._lock:
+            self._active.add(id(connection))
+
+    def checked_in(self, db):
+        """Unregister the connection of a DAL about to be closed
+
+        Args:
+            db (DAL): pyDAL connection object
+        """
+        from pydal._globals import THREAD_LOCAL
+
+        # without connecting, when no query was made
+        connection = getattr(THREAD_LOCAL, db._adapter._connection_uname_,
+                             None)
+        with self._lock:
+            self._active.discard(id(connection))
+
+    def _prune(self, idle_connections):
+        """Forget the creation time of connections pyDAL already closed"""
+        alive = self._active | {id(conn) for conn in idle_connections}
+        for connection_id in list(self._created_on):
+            if connection_id not in alive:
+                del self._created_on[connection_id]
+
+    def stats(self):
+        """Pool telemetry of this worker
+
+        Returns:
+            dict: Pool configuration, counters and checkout wait times
+        """
+        from pydal.connection import ConnectionPool
+
+        idle_connections = []
+        for uri in list(self._uris):
+            idle_connections.extend(ConnectionPool.POOLS.get(uri, []))
+        wait_times = sorted(self._wait_times)
+
+        def wait_time_ms(percentile):
+            if not wait_times:
+                return 0.0
+            index = min(len(wait_times) - 1,
+                        int(percentile / 100 * len(wait_times)))
+            return round(wait_times[index] * 1000, 3)
+
+        with self._lock:
+            self._prune(idle_connections)
+            return {
+                'worker_pid': os.getpid(),
+                'pool_size': self.size,
+                'max_overflow': self.max_overflow,
+                'timeout_seconds': self.timeout,
+                'max_age_seconds': self.max_age,
+                'pre_ping': self.pre_ping,
+                'active': self.active,
+                'idle': len(idle_connections),
+                'waiting': self.waiting,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'connections_created': self.connections_created,
+                'connections_recycled': self.connections_recycled,
+                'pre_ping_failures': self.pre_ping_failures,
+                'wait_time_ms': {
+                    'p50': wait_time_ms(50),
+                    'p95': wait_time_ms(95),
+                    'p99': wait_time_ms(99),
+                    'max': round(wait_times[-1] * 1000, 3)
+                    if wait_times else 0.0,
+                },
+            }
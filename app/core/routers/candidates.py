@@ -1,13 +1,24 @@
-from fastapi import APIRouter, Response, Depends, HTTPException, Request
+import csv
+import io
+from fastapi import APIRouter, Response, Depends, HTTPException, Request, \
+                    Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from typing import Optional
-from requests.auth import HTTPBasicAuth
-import requests
-from sentry_sdk import capture_exception, push_scope
 from ..schemas.candidates import CandidateSearchResult, Candidate, \
-                                        CandidateSearchOptions
+                                        CandidateSearchOptions, \
+                                        CandidateExportFormat
 from ..schemas.city import City
 from ..schemas.technology import Technology
-from ..dependencies import get_db
+from ..schemas.autocomplete import AutocompleteField, AutocompleteResult, \
+                                   AutocompleteSuggestion
+from ..schemas.facets import CandidateFacets
+from ..dependencies import get_db, get_autocomplete_indexes, get_snapshot, \
+                           get_facet_index, get_db_runner
+from ..search import elastic_backend
+from ..search.autocomplete import MAX_SUGGESTIONS
+from ..search.msearch import rewrite_msearch_body, InvalidSearchRequest, \
+                             FILTER_PATH
 from ..models.elasticsearch import get_elastic_base_url, \
                                           get_elastic_credentials
 from .. import settings
@@ -18,21 +29,21 @@ router = APIRouter(
 )
 
 
-def _get_candidate_techs(db, candidate_id):
-    """Returns a list of the candidate technologies based on candidate_id
+def _get_candidates_techs(db, candidate_ids):
+    """Returns the technologies of the candidates with a single query
 
     Args:
         db (DAL): pyDAL connection object
-        candidate_id (int): Candidate ID
+        candidate_ids (list[int]): Candidate IDs
 
     Returns:
-        list[Technology]: List of the candidates techs
+        dict[int, list[Technology]]: List of the techs by candidate ID
     """
-    technologies = []
+    technologies = {candidate_id: [] for candidate_id in candidate_ids}
     techs = db(
         (db.candidate_tech_reference.tech_id == db.tech.id)
-        & (db.candidate_tech_reference.candidate_id == candidate_id)
-    ).select()
+        & (db.candidate_tech_reference.candidate_id.belongs(candidate_ids))
+    ).select(orderby=db.tech.id)
 
     for tech in techs:
         technology = Technology(
@@ -40,12 +51,45 @@ def _get_candidate_techs(db, candidate_id):
             name=tech.tech.name,
             is_main_tech=tech.candidate_tech_reference.is_main_tech
         )
-        technologies.append(technology)
+        technologies[tech.candidate_tech_reference.candidate_id].append(
+            technology
+        )
     return technologies
 
 
-def _search_candidates(db, city_id, experience_min, experience_max, techs):
-    """Match candidates with the specified parameters and returns them
+def _parse_tech_ids(techs):
+    """Parse the comma separated tech IDs of the search filters, empty items
+    are ignored
+
+    Args:
+        techs (str): Comma separated string of Tech IDs
+
+    Raises:
+        HTTPException: raises exception 422 when an item is not an integer
+
+    Returns:
+        list[int]: Tech IDs, None when no tech filter is informed
+    """
+    if not techs:
+        return None
+
+    tech_ids = []
+    for tech_id in techs.split(','):
+        if not tech_id.strip():
+            continue
+        try:
+            tech_ids.append(int(tech_id))
+        except ValueError:
+            raise HTTPException(
+                status_code=422,
+                detail="'techs' must be a comma separated list of tech IDs"
+            )
+    return tech_ids
+
+
+def _candidates_query(db, city_id, experience_min, experience_max, techs):
+    """Create the query matching candidates with the specified parameters,
+    joined with their city, technology references and technologies
 
     Args:
         db (DAL): pyDAL connection object
@@ -55,14 +99,8 @@ def _search_candidates(db, city_id, experience_min, experience_max, techs):
         techs (str): Comma separated string of Tech IDs
 
     Returns:
-        list(Candidate): List of matched candidates
+        Set: pyDAL set of the matches, one row per matched technology
     """
-    candidates = []
-
-    tech_count = db.tech.id.count()
-    years_min = db.candidate.years_experience_min.max()
-    years_max = db.candidate.years_experience_max.max()
-
     matches_query = db(
         (db.candidate.city_id == db.city.id)
         & (db.candidate_tech_reference.candidate_id == db.candidate.id)
@@ -80,38 +118,79 @@ def _search_candidates(db, city_id, experience_min, experience_max, techs):
             db.candidate.city_id == city_id
         )
 
-    if techs:
-        techs_list = techs.split(',')
+    tech_ids = _parse_tech_ids(techs)
+    if tech_ids is not None:
         matches_query = matches_query(
-            db.candidate_tech_reference.tech_id.belongs(techs_list)
+            db.candidate_tech_reference.tech_id.belongs(tech_ids)
         )
 
-    matches = matches_query.select(
-        db.candidate.ALL,
-        db.city.ALL,
-        tech_count,
-        years_min,
-        years_max,
-        groupby=db.candidate.id,
-        orderby=[~years_max, ~tech_count],
-        limitby=(0, 5)
+    return matches_query
+
+
+def _create_candidates(db, matches):
+    """Create the candidates of the matched rows, their technologies are read
+    with a single query
+
+    Args:
+        db (DAL): pyDAL connection object
+        matches (Rows): Rows with the 'candidate' and 'city' fields
+
+    Returns:
+        list(Candidate): List of candidates
+    """
+    candidates = []
+    technologies = _get_candidates_techs(
+        db, [match.candidate.id for match in matches]
     )
 
     for match in matches:
         city = City(id=match.city.id, name=match.city.name)
-        technologies = _get_candidate_techs(db, match.candidate.id)
         candidate = Candidate(
             id=match.candidate.id,
             city=city,
             experience_min=match.candidate.years_experience_min,
             experience_max=match.candidate.years_experience_max,
-            technologies=technologies
+            technologies=technologies[match.candidate.id]
         )
 
         candidates.append(candidate)
     return candidates
 
 
+def _search_candidates(db, city_id, experience_min, experience_max, techs):
+    """Match candidates with the specified parameters and returns them
+
+    Args:
+        db (DAL): pyDAL connection object
+        city_id (int): City ID
+        experience_min (int): Minimum Years of experience
+        experience_max (int): Maximum Years of experience
+        techs (str): Comma separated string of Tech IDs
+
+    Returns:
+        list(Candidate): List of matched candidates
+    """
+    tech_count = db.tech.id.count()
+    years_min = db.candidate.years_experience_min.max()
+    years_max = db.candidate.years_experience_max.max()
+
+    matches_query = _candidates_query(db, city_id, experience_min,
+                                      experience_max, techs)
+
+    matches = matches_query.select(
+        db.candidate.ALL,
+        db.city.ALL,
+        tech_count,
+        years_min,
+        years_max,
+        groupby=db.candidate.id,
+        orderby=[~years_max, ~tech_count, db.candidate.id],
+        limitby=(0, 5)
+    )
+
+    return _create_candidates(db, matches)
+
+
 @router.get(
     "",
     name="Search for candidates",
@@ -123,6 +202,9 @@ then in the number of technologies the candidate knows.
 If there aren't 5 primary results a secondary search will be performed
 increasing the 'experience_max' parameter to 99
 
+The search runs in MySQL or, when SEARCH_BACKEND is "elasticsearch", in a
+single Elasticsearch request, falling back to MySQL if it is unavailable
+
     TODO: Improve technologies matching
     """,
     response_model=CandidateSearchResult,
@@ -136,31 +218,219 @@ async def search_candidates(city_id: Optional[int] = None,
                             experience_max: Optional[int] = 99,
                             techs: Optional[str] = None,
                             db=Depends(get_db)):
+    # invalid tech IDs are rejected before any search
+    _parse_tech_ids(techs)
+
     matches_result = CandidateSearchResult(
         main_candidates=[],
         secondary_candidates=[]
     )
 
-    main_results = _search_candidates(
-        db, city_id, experience_min, experience_max, techs
-    )
+    main_results = None
+    if settings.SEARCH_BACKEND == 'elasticsearch':
+        try:
+            # in a worker thread, so waiting for Elasticsearch, or loading
+            # the snapshot on a cold worker, does not block the event loop
+            main_results, secondary_results = await run_in_threadpool(
+                elastic_backend.search_candidates,
+                get_snapshot, city_id, experience_min, experience_max, techs
+            )
+        except elastic_backend.SearchBackendUnavailable as error:
+            from sentry_sdk import capture_exception
 
-    if len(main_results) < 5:
-        experience_max = 99
-        secondary_results = _search_candidates(
+            # falls back to MySQL
+            capture_exception(error)
+
+    if main_results is None:
+        main_results = _search_candidates(
             db, city_id, experience_min, experience_max, techs
         )
+        if len(main_results) < 5:
+            experience_max = 99
+            secondary_results = _search_candidates(
+                db, city_id, experience_min, experience_max, techs
+            )
 
-        for main_result in main_results:
-            secondary_results.remove(main_result)
-
-        matches_result.secondary_candidates = secondary_results
+    if len(main_results) < 5:
+        main_ids = {main_result.id for main_result in main_results}
+        matches_result.secondary_candidates = [
+            secondary_result for secondary_result in secondary_results
+            if secondary_result.id not in main_ids
+        ]
 
     matches_result.main_candidates = main_results
 
     return matches_result
 
 
+def _read_candidates_batch(db, city_id, experience_min, experience_max,
+                           techs, after_id, batch_size):
+    """Read a batch of the candidates matching the specified parameters,
+    ordered by ID.
+
+    A batch continues after the last ID of the previous one (keyset
+    pagination), so every batch is a short query of its own and the
+    technologies of a batch are read with a single query
+
+    Args:
+        db (DAL): pyDAL connection object
+        city_id (int): City ID
+        experience_min (int): Minimum Years of experience
+        experience_max (int): Maximum Years of experience
+        techs (str): Comma separated string of Tech IDs
+        after_id (int): Last candidate ID of the previous batch, 0 for the
+            first one
+        batch_size (int): Candidates per batch
+
+    Returns:
+        list(Candidate): Batch of matched candidates, shorter than
+        'batch_size' for the last one
+    """
+    matches_query = _candidates_query(db, city_id, experience_min,
+                                      experience_max, techs)
+    matches = matches_query(db.candidate.id > after_id).select(
+        db.candidate.ALL,
+        db.city.ALL,
+        groupby=db.candidate.id,
+        orderby=db.candidate.id,
+        limitby=(0, batch_size)
+    )
+    return _create_candidates(db, matches)
+
+
+CSV_HEADER = ['id', 'city_id', 'city', 'experience_min', 'experience_max',
+              'technologies', 'main_technologies']
+
+
+def _format_ndjson(candidates):
+    """One JSON line per candidate"""
+    return ''.join(
+        candidate.json(ensure_ascii=False) + '\n' for candidate in candidates
+    )
+
+
+def _format_csv(candidates):
+    """One CSV row per candidate, technology names are separated by ';'"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for candidate in candidates:
+        writer.writerow([
+            candidate.id,
+            candidate.city.id,
+            candidate.city.name,
+            candidate.experience_min,
+            candidate.experience_max,
+            ';'.join(tech.name for tech in candidate.technologies),
+            ';'.join(
+                tech.name for tech in candidate.technologies
+                if tech.is_main_tech
+            ),
+        ])
+    return output.getvalue()
+
+
+@router.get(
+    "/export",
+    name="Export every matching candidate",
+    description="""Streams every candidate matching the same filters as the
+/candidates endpoint, ordered by ID, as NDJSON (one candidate per line, like
+the /candidates results) or CSV.
+
+Candidates are read EXPORT_BATCH_SIZE at a time and sent as soon as each
+batch is read. Each batch is read in a worker thread with a database
+connection of its own, so a slow client does not hold a connection for the
+whole export
+    """,
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}, "text/csv": {}}
+        }
+    }
+)
+async def export_candidates(city_id: Optional[int] = None,
+                            experience_min: Optional[int] = 0,
+                            experience_max: Optional[int] = 99,
+                            techs: Optional[str] = None,
+                            export_format: CandidateExportFormat = Query(
+                                CandidateExportFormat.ndjson, alias='format'
+                            ),
+                            run_with_db=Depends(get_db_runner)):
+    # invalid tech IDs are rejected before the response starts
+    _parse_tech_ids(techs)
+
+    batch_size = settings.EXPORT_BATCH_SIZE
+
+    def read_batch(db, after_id):
+        return _read_candidates_batch(db, city_id, experience_min,
+                                      experience_max, techs, after_id,
+                                      batch_size)
+
+    # read before the response starts, so a busy pool still returns a 503
+    first_batch = await run_with_db(read_batch, 0)
+
+    if export_format == CandidateExportFormat.csv:
+        media_type = 'text/csv'
+        header = ','.join(CSV_HEADER) + '\r\n'
+        format_batch = _format_csv
+    else:
+        media_type = 'application/x-ndjson'
+        header = ''
+        format_batch = _format_ndjson
+
+    async def content():
+        if header:
+            yield header.encode('utf-8')
+        batch = first_batch
+        while batch:
+            yield format_batch(batch).encode('utf-8')
+            if len(batch) < batch_size:
+                return
+            batch = await run_with_db(read_batch, batch[-1].id)
+
+    return StreamingResponse(
+        content(),
+        media_type=media_type,
+        headers={
+            'Content-Disposition':
+                'attachment; filename="candidates.{}"'.format(
+                    export_format.value
+                )
+        }
+    )
+
+
+@router.get(
+    "/facets",
+    name="Candidate counts per search filter option",
+    description="""Counts the candidates per city, technology and experience
+bucket (years_experience_min, years_experience_max) for the same filters as
+the /candidates endpoint
+
+Each facet ignores its own filter, so the city counts are the candidates
+every city would return with the current experience and technologies
+filters. Only candidates with at least one technology are counted, as in
+the search.
+
+Counts are answered from in-memory aggregates, rebuilt after every import,
+so the database is not queried.
+    """,
+    response_model=CandidateFacets,
+    responses={
+        200: {
+        }
+    }
+)
+async def candidate_facets(city_id: Optional[int] = None,
+                           experience_min: Optional[int] = 0,
+                           experience_max: Optional[int] = 99,
+                           techs: Optional[str] = None,
+                           facet_index=Depends(get_facet_index)):
+    return facet_index.facets(
+        city_id, experience_min, experience_max, _parse_tech_ids(techs)
+    )
+
+
 def _get_city_options(db):
     """Gets all available cities from the database
 
@@ -243,11 +513,47 @@ async def search_options(db=Depends(get_db)):
     return search_options
 
 
+@router.get(
+    "/autocomplete",
+    name="Typeahead suggestions for technology and city names",
+    description="""Returns the technologies or cities whose name, or one of its
+words, starts with 'q'. Matching ignores case and accents ("sao" matches
+"São Paulo - SP") and the names with most candidates come first.
+
+Suggestions are answered from an in-memory prefix index, rebuilt after every
+import, so the database is not queried.
+    """,
+    response_model=AutocompleteResult,
+    responses={
+        200: {
+        }
+    }
+)
+async def autocomplete(field: AutocompleteField,
+                       q: str = '',
+                       limit: int = Query(10, ge=1, le=MAX_SUGGESTIONS),
+                       indexes=Depends(get_autocomplete_indexes)):
+    matches = indexes[field.value].search(q, limit)
+
+    suggestions = []
+    for entry_id, name, candidate_count in matches:
+        suggestions.append(
+            AutocompleteSuggestion(
+                id=entry_id,
+                name=name,
+                candidate_count=candidate_count
+            )
+        )
+
+    return AutocompleteResult(field=field, suggestions=suggestions)
+
+
 @router.post(
     "/elastic-proxy/candidates/_msearch",
     name='Proxy for searching candidates in Elastic',
     description="""This endpoint receives a request from ReactiveSearch,
-    forward the request to ElasticSearch and returns the results.
+    rewrites it to limit its cost, forward the request to ElasticSearch and
+    returns the results.
     Additional check could be performed here
     like user authorization or customized filters""")
 async def elastic_proxy_candidates(request: Request):
@@ -255,6 +561,9 @@ async def elastic_proxy_candidates(request: Request):
     'candidates' index. It is called by the ReactiveSearch Front-End component.
     
     What this code does:
+    - Rewrites each search: caps 'size', 'from' and aggregation buckets,
+    forces the 'candidates' index and only requests the fields used by the
+    front-end
     - Makes search request to ElasticSearch
     - Returns Elastic response to the front-end
 
@@ -263,18 +572,30 @@ async def elastic_proxy_candidates(request: Request):
         Body
 
     Raises:
-        HTTPException: raises exception 400
+        HTTPException: raises exception 400 for invalid or too expensive
+        searches
 
     Returns:
         (dict): Elasticsearch response
     """
-    body = await request.body()
+    import requests
+    from requests.auth import HTTPBasicAuth
+
+    try:
+        body = rewrite_msearch_body(await request.body())
+    except InvalidSearchRequest as error:
+        raise HTTPException(status_code=400, detail=str(error))
 
-    es_url = '{}candidates/_msearch?'.format(get_elastic_base_url())
+    es_url = '{}candidates/_msearch?filter_path={}'.format(
+        get_elastic_base_url(), FILTER_PATH
+    )
     es_user, es_password = get_elastic_credentials()
     headers = {'Content-Type': 'application/x-ndjson'}
 
-    es_request = requests.post(
+    # in a worker thread, so waiting for Elasticsearch does not block the
+    # event loop
+    es_request = await run_in_threadpool(
+        requests.post,
         es_url,
         auth=HTTPBasicAuth(es_user, es_password),
         headers=headers,
@@ -283,6 +604,8 @@ async def elastic_proxy_candidates(request: Request):
     )
     
     if es_request.status_code != 200:
+        from sentry_sdk import capture_exception, push_scope
+
         error_message = "Error performing the search"
         with push_scope() as scope:
             scope.set_context(
@@ -1,10 +1,21 @@
-import requests
+import hmac
 import re
-import json
-from fastapi import APIRouter, Response, Depends
+from fastapi import APIRouter, Response, Depends, HTTPException, Query, \
+                    Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import List
 from ..schemas.candidates import CandidateImportResult
+from ..schemas.management import DatabasePoolStats, SearchSyncStats, \
+                                 ProfileFormat, ProfileSummary, \
+                                 AdmissionLimiterStats
+from ..middleware.admission import admission_limiters
+from ..middleware.profiling import profile_store, to_collapsed, to_speedscope
 from ..dependencies import get_db
-from ..models.elasticsearch import get_elastic
+from ..models.database import database_pool
+from ..search import snapshot
+from ..search.sync import outbox_syncer
+from .. import settings
 
 
 router = APIRouter(
@@ -18,6 +29,8 @@ def _read_candidates_from_s3():
     Returns:
         list[dict]: List of candidates
     """
+    import requests
+
     file_url = "https://geekhunter-recruiting.s3.amazonaws.com/code_challenge.json"
     file_request = requests.get(file_url, timeout=5)
 
@@ -130,73 +143,14 @@ def _import_candidates_to_db(db, candidates):
     return candidates_import
 
 
-def _create_elastic_candidates_upsert_body(candidates):
-    """Create the bulk insert/update elastic body for the 'listings'
-    Note: Upsert is used here because in case the document already exists we
-    don't want to overwrite the 'clientsClassifiedIsGood' and
-    'clientsClassifiedIsNotGood' fields 
-
-    Args:
-        listings (list(dict)): List of listings
-
-    Returns:
-        str: Elastic bulk insert/update request
-    """
-    elastic_upsert_body = []
-    for candidate in candidates:
-        candidate_upsert_action = {
-            "update": {
-                "_id": candidate["id"],
-                "_index": "candidates"
-            }
-        }
-
-        techs = list(map(lambda tech: tech["name"], candidate["technologies"]))
-        years_min, years_max = _extract_years_min_max_from_experience(
-            candidate['experience']
-        )
-
-        candidate_upsert_detail = {
-            "doc": {
-                "candidate_id": candidate["id"],
-                "years_experience": {
-                    "gte": years_min,
-                    "lte": years_max
-                },
-                "city": candidate["city"],
-                "techs": techs,
-                "techs_nested": candidate["technologies"]
-            },
-            "doc_as_upsert": True
-        }
-        elastic_upsert_body.append(json.dumps(candidate_upsert_action))
-        elastic_upsert_body.append(json.dumps(candidate_upsert_detail))
-    elastic_upsert_body.append('')
-
-    return '\n'.join(elastic_upsert_body)
-
-
-def _import_cadidates_to_elastic(candidates):
-    """- Creates elastic bulk upsert based on cadidates
-    - Executes elastic bulk upsert
-
-    Args:
-        candidates (list[dict]): List of candidates
-    """
-    elastic_bulk_upsert = _create_elastic_candidates_upsert_body(candidates)
-
-    es = get_elastic()
-    elastic_response = es.bulk(
-        elastic_bulk_upsert,
-        'candidates',
-        timeout='10s'
-    )
-    if elastic_response['errors'] is True:
-        raise Exception('Error Inserting candidates into elastic')
-
-
 def _import_s3_data(db):
-    """Read candidate list from S3 and import them into the DB
+    """Read candidate list from S3 and import them into the DB, then publish a
+    new candidate snapshot for the workers and sync the changed candidates
+    to Elasticsearch.
+
+    The changes are recorded in the search outbox with the import
+    transaction, so candidates that could not be synced here are retried by
+    the background syncer
 
     Args:
         db (DAL): pyDAL connection object
@@ -209,9 +163,10 @@ def _import_s3_data(db):
     _import_cities(db, candidates)
     _import_technologies(db, candidates)
     candidates_imported = _import_candidates_to_db(db, candidates)
-    _import_cadidates_to_elastic(candidates)
 
     db.commit()
+    snapshot.write_snapshot(db, settings.SNAPSHOT_PATH)
+    outbox_syncer.sync(db)
     return candidates_imported
 
 
@@ -229,4 +184,129 @@ def _import_s3_data(db):
 async def import_s3_data(response: Response, db=Depends(get_db)):
     candidates_imported = _import_s3_data(db)
     response.status_code = 201
-    return CandidateImportResult(candidates_imported=candidates_imported)
\ No newline at end of file
+    return CandidateImportResult(candidates_imported=candidates_imported)
+
+
+@router.get(
+    "/db-pool-stats",
+    name="Database connection pool telemetry",
+    description="""Returns the connection pool configuration and telemetry of
+the worker answering the request: active, idle and waiting connections,
+checkout wait times, timeouts and recycled connections.
+
+Every uvicorn worker has its own pool, use it to tune DB_POOL_SIZE and
+DB_MAX_OVERFLOW against the number of workers""",
+    response_model=DatabasePoolStats,
+)
+async def db_pool_stats():
+    return DatabasePoolStats(**database_pool.stats())
+
+
+@router.get(
+    "/admission-stats",
+    name="Admission control metrics",
+    description="""Returns, for each limited endpoint of the worker answering
+the request, the requests running and queued and how many were rejected
+because the queue was full (shed_queue_full), the expected wait exceeded
+the client deadline (shed_deadline) or the deadline expired while queued
+(shed_timeout)""",
+    response_model=List[AdmissionLimiterStats],
+)
+async def admission_stats():
+    # limiters shared by several paths are listed once
+    return [limiter.stats()
+            for limiter in dict.fromkeys(admission_limiters.values())]
+
+
+@router.get(
+    "/search-sync-stats",
+    name="Elasticsearch sync lag",
+    description="""Returns the candidates waiting to be synced to
+Elasticsearch: pending and retrying outbox rows and the age of the oldest
+one (lag_seconds), and the syncer counters of the worker answering the
+request""",
+    response_model=SearchSyncStats,
+)
+async def search_sync_stats(db=Depends(get_db)):
+    return SearchSyncStats(**outbox_syncer.stats(db))
+
+
+def _require_profiling_secret(x_profile: str = Header('')):
+    """Allows the profile routes only to requests sending PROFILING_SECRET in
+    the 'X-Profile' header, as the profiled requests do. Profiles show the
+    paths and query strings of other clients, so they are not readable when
+    no secret is set
+
+    Args:
+        x_profile (str): Value of the 'X-Profile' header
+
+    Raises:
+        HTTPException: raises exception 403 when the header does not match
+        PROFILING_SECRET
+    """
+    secret = settings.PROFILING_SECRET.encode('utf-8')
+    if not secret or not hmac.compare_digest(x_profile.encode('utf-8'),
+                                             secret):
+        raise HTTPException(status_code=403,
+                            detail="Invalid or missing X-Profile header")
+
+
+@router.get(
+    "/profiles",
+    name="Stored request profiles",
+    description="""Lists the request profiles stored by the worker answering
+the request, newest first. Requests are profiled when profiling is enabled
+by PROFILING_SECRET or PROFILING_SAMPLE_RATE. Requires the 'X-Profile'
+header with PROFILING_SECRET""",
+    response_model=List[ProfileSummary],
+    dependencies=[Depends(_require_profiling_secret)],
+    responses={
+        403: {
+            "description": "Missing or invalid 'X-Profile' header",
+        }
+    }
+)
+async def list_profiles():
+    return await run_in_threadpool(profile_store.list)
+
+
+@router.get(
+    "/profiles/{profile_id}",
+    name="Download a request profile",
+    description="""Downloads a request profile as a speedscope file
+(https://www.speedscope.app) or as collapsed stacks, as used by
+flamegraph.pl. Requires the 'X-Profile' header with PROFILING_SECRET""",
+    dependencies=[Depends(_require_profiling_secret)],
+    responses={
+        200: {
+            "content": {"application/json": {}, "text/plain": {}}
+        },
+        403: {
+            "description": "Missing or invalid 'X-Profile' header",
+        },
+        404: {
+            "description": "Profile not found",
+        }
+    }
+)
+async def download_profile(profile_id: str,
+                           profile_format: ProfileFormat = Query(
+                               ProfileFormat.speedscope, alias='format'
+                           )):
+    profile = await run_in_threadpool(profile_store.load, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    if profile_format == ProfileFormat.collapsed:
+        return PlainTextResponse(
+            to_collapsed(profile),
+            headers={'Content-Disposition':
+                     'attachment; filename="{}.txt"'.format(profile_id)}
+        )
+    return JSONResponse(
+        to_speedscope(profile),
+        headers={'Content-Disposition':
+                 'attachment; filename="{}.speedscope.json"'.format(
+                     profile_id
+                 )}
+    )
@@ -0,0 +1,29 @@
+from enum import Enum
+from pydantic import BaseModel
+from typing import List
+
+
+class AutocompleteField(str, Enum):
+    tech = 'tech'
+    city = 'city'
+
+
+class AutocompleteSuggestion(BaseModel):
+    id: int
+    name: str
+    candidate_count: int
+
+
+class AutocompleteResult(BaseModel):
+    field: AutocompleteField
+    suggestions: List[AutocompleteSuggestion]
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "field": "city",
+                "suggestions": [
+                    {"id": 3, "name": "São Paulo - SP", "candidate_count": 42}
+                ]
+            }
+        }
@@ -1,3 +1,4 @@
+from enum import Enum
 from pydantic import BaseModel
 from typing import List, Optional
 from .city import City
@@ -33,3 +34,8 @@ class CandidateSearchOptions(BaseModel):
     technologies: List[Technology]
     experience_min: int
     experience_max: int
+
+
+class CandidateExportFormat(str, Enum):
+    ndjson = 'ndjson'
+    csv = 'csv'
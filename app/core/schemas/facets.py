@@ -0,0 +1,39 @@
+from pydantic import BaseModel
+from typing import List
+
+
+class FacetCount(BaseModel):
+    id: int
+    name: str
+    count: int
+
+
+class ExperienceFacetCount(BaseModel):
+    experience_min: int
+    experience_max: int
+    count: int
+
+
+class CandidateFacets(BaseModel):
+    total: int
+    cities: List[FacetCount]
+    technologies: List[FacetCount]
+    experience: List[ExperienceFacetCount]
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "total": 12,
+                "cities": [
+                    {"id": 3, "name": "São Paulo - SP", "count": 9},
+                    {"id": 7, "name": "Santos - SP", "count": 3}
+                ],
+                "technologies": [
+                    {"id": 1, "name": "Python", "count": 8}
+                ],
+                "experience": [
+                    {"experience_min": 0, "experience_max": 1, "count": 2},
+                    {"experience_min": 12, "experience_max": 99, "count": 4}
+                ]
+            }
+        }
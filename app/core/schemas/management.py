@@ -0,0 +1,136 @@
+from datetime import datetime
+from enum import Enum
+from pydantic import BaseModel
+from typing import Optional
+
+
+class WaitTimes(BaseModel):
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+
+class DatabasePoolStats(BaseModel):
+    worker_pid: int
+    pool_size: int
+    max_overflow: int
+    timeout_seconds: float
+    max_age_seconds: float
+    pre_ping: bool
+    active: int
+    idle: int
+    waiting: int
+    checkouts: int
+    timeouts: int
+    connections_created: int
+    connections_recycled: int
+    pre_ping_failures: int
+    wait_time_ms: WaitTimes
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "worker_pid": 8,
+                "pool_size": 10,
+                "max_overflow": 5,
+                "timeout_seconds": 5.0,
+                "max_age_seconds": 3600.0,
+                "pre_ping": True,
+                "active": 3,
+                "idle": 7,
+                "waiting": 0,
+                "checkouts": 1520,
+                "timeouts": 0,
+                "connections_created": 11,
+                "connections_recycled": 1,
+                "pre_ping_failures": 0,
+                "wait_time_ms": {
+                    "p50": 0.02, "p95": 0.05, "p99": 3.1, "max": 12.4
+                }
+            }
+        }
+
+
+class SearchSyncStats(BaseModel):
+    running: bool
+    pending: int
+    retrying: int
+    lag_seconds: float
+    last_sync_on: Optional[datetime]
+    documents_synced: int
+    sync_errors: int
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "running": True,
+                "pending": 12,
+                "retrying": 0,
+                "lag_seconds": 3.2,
+                "last_sync_on": "2021-01-20T18:31:02.418000",
+                "documents_synced": 1520,
+                "sync_errors": 0
+            }
+        }
+
+
+class ProfileFormat(str, Enum):
+    speedscope = 'speedscope'
+    collapsed = 'collapsed'
+
+
+class ProfileSummary(BaseModel):
+    id: str
+    created_on: datetime
+    method: str
+    path: str
+    query: str
+    status_code: int
+    duration_ms: float
+    interval_ms: float
+    samples: int
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "id": "3f1c2b0e9d8a4c7b8e6f5a4b3c2d1e0f",
+                "created_on": "2021-01-20T18:31:02.418000",
+                "method": "GET",
+                "path": "/candidates",
+                "query": "experience_min=1&experience_max=5&techs=2,3",
+                "status_code": 200,
+                "duration_ms": 231.4,
+                "interval_ms": 5.0,
+                "samples": 45
+            }
+        }
+
+
+class AdmissionLimiterStats(BaseModel):
+    name: str
+    max_concurrency: int
+    max_queue: int
+    in_flight: int
+    queued: int
+    admitted: int
+    shed_queue_full: int
+    shed_deadline: int
+    shed_timeout: int
+    service_time_ms: Optional[float]
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "name": "candidates",
+                "max_concurrency": 8,
+                "max_queue": 16,
+                "in_flight": 8,
+                "queued": 3,
+                "admitted": 15230,
+                "shed_queue_full": 12,
+                "shed_deadline": 40,
+                "shed_timeout": 2,
+                "service_time_ms": 38.2
+            }
+        }
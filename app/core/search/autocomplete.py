@@ -0,0 +1,175 @@
+import bisect
+import heapq
+import unicodedata
+from collections import Counter
+
+
+"""
+    In-memory prefix indexes used by the typeahead endpoint. Every worker keeps
+    one index per searchable field ('tech' and 'city'), built from the
+    candidate snapshot, so suggestions are answered without touching the
+    database.
+"""
+
+# Biggest 'limit' the autocomplete endpoint accepts
+MAX_SUGGESTIONS = 50
+
+# Prefixes up to this length match too many names to be ranked on every
+# request, so their top suggestions are computed when the index is built
+SHORT_PREFIX_LENGTH = 2
+
+# (snapshot generation, indexes) of this worker
+_indexes = None
+
+
+def normalize_name(name):
+    """Lower-case a name and strip its accents, so "São Paulo" and "sao paulo"
+    are compared as equal
+
+    Args:
+        name (str): City or technology name
+
+    Returns:
+        str: Normalized name
+    """
+    decomposed = unicodedata.normalize('NFKD', name)
+    without_accents = ''.join(
+        char for char in decomposed if not unicodedata.combining(char)
+    )
+    return ' '.join(without_accents.casefold().split())
+
+
+def _word_starts(normalized_name):
+    """Positions where each word of the normalized name starts
+
+    Args:
+        normalized_name (str): Name returned by normalize_name
+
+    Returns:
+        list[int]: Start position of every word
+    """
+    starts = [0]
+    for position in range(1, len(normalized_name)):
+        if normalized_name[position].isalnum() \
+                and not normalized_name[position - 1].isalnum():
+            starts.append(position)
+    return starts
+
+
+def _rank(entry):
+    """Sort key putting the names with most candidates first"""
+    entry_id, name, candidate_count = entry
+    return -candidate_count, name, entry_id
+
+
+class PrefixIndex:
+    """Sorted array of normalized names searched with bisect.
+
+    Each name is indexed once per word, so "paulo" finds "São Paulo - SP" as
+    well as "sao" does.
+    """
+
+    def __init__(self, entries):
+        """
+        Args:
+            entries (iterable[tuple]): (id, name, candidate_count) tuples
+        """
+        keyed_entries = []
+        for entry_id, name, candidate_count in entries:
+            entry = (entry_id, name, candidate_count)
+            normalized = normalize_name(name)
+            for start in _word_starts(normalized):
+                keyed_entries.append((normalized[start:], entry))
+        keyed_entries.sort(key=lambda keyed: keyed[0])
+
+        self._keys = [key for key, _ in keyed_entries]
+        self._entries = [entry for _, entry in keyed_entries]
+        self._short_prefixes = self._rank_short_prefixes()
+
+    def __len__(self):
+        return len(set(self._entries))
+
+    def _rank_short_prefixes(self):
+        """Pre-compute the best suggestions of every short prefix
+
+        Returns:
+            dict[str, list[tuple]]: Ranked entries per prefix
+        """
+        grouped = {}
+        for key, entry in zip(self._keys, self._entries):
+            for length in range(1, SHORT_PREFIX_LENGTH + 1):
+                if len(key) >= length:
+                    grouped.setdefault(key[:length], set()).add(entry)
+
+        return {
+            prefix: heapq.nsmallest(MAX_SUGGESTIONS, entries, key=_rank)
+            for prefix, entries in grouped.items()
+        }
+
+    def search(self, query, limit=10):
+        """Find the names starting with the query, most popular first
+
+        Args:
+            query (str): Text typed by the user
+            limit (int): Maximum number of suggestions
+
+        Returns:
+            list[tuple]: (id, name, candidate_count) tuples
+        """
+        prefix = normalize_name(query)
+        if not prefix:
+            return []
+
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            return self._short_prefixes.get(prefix, [])[:limit]
+
+        start = bisect.bisect_left(self._keys, prefix)
+        end = bisect.bisect_left(self._keys, prefix + '\U0010ffff', lo=start)
+        matches = set(self._entries[start:end])
+
+        return heapq.nsmallest(limit, matches, key=_rank)
+
+
+def build_indexes(candidate_snapshot):
+    """Build the 'tech' and 'city' prefix indexes from the candidate snapshot
+
+    Args:
+        candidate_snapshot (CandidateSnapshot): Current candidate snapshot
+
+    Returns:
+        dict[str, PrefixIndex]: Prefix index per field
+    """
+    city_counts = Counter(candidate_snapshot.candidate_city_ids)
+    tech_counts = Counter(candidate_snapshot.tech_ids)
+
+    return {
+        'city': PrefixIndex(
+            (city_id, name, city_counts[city_id])
+            for city_id, name in candidate_snapshot.cities()
+        ),
+        'tech': PrefixIndex(
+            (tech_id, name, tech_counts[tech_id])
+            for tech_id, name in candidate_snapshot.techs()
+        ),
+    }
+
+
+def get_indexes(candidate_snapshot):
+    """Returns the prefix indexes of this worker, rebuilding them whenever a
+    new snapshot generation is published by an import
+
+    Args:
+        candidate_snapshot (CandidateSnapshot): Current candidate snapshot
+
+    Returns:
+        dict[str, PrefixIndex]: Prefix index per field
+    """
+    global _indexes
+
+    indexes = _indexes
+    if indexes is None or indexes[0] != candidate_snapshot.generation:
+        indexes = (
+            candidate_snapshot.generation, build_indexes(candidate_snapshot)
+        )
+        _indexes = indexes
+    return indexes[1]
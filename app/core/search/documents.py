@@ -0,0 +1,93 @@
+"""
+    Documents of the Elasticsearch 'candidates' index
+"""
+
+INDEX = 'candidates'
+
+
+def candidate_document(candidate_id, city, years_min, years_max,
+                       technologies):
+    """Create the 'candidates' document of a candidate
+
+    Args:
+        candidate_id (int): Candidate ID
+        city (str): City name, None for candidates without a city
+        years_min (int): Minimum years of experience
+        years_max (int): Maximum years of experience
+        technologies (list[dict]): Candidate techs, with the 'name' and
+            'is_main_tech' keys
+
+    Returns:
+        dict: Elasticsearch document
+    """
+    techs = [tech['name'] for tech in technologies]
+    return {
+        "candidate_id": candidate_id,
+        "years_experience": {
+            "gte": years_min,
+            "lte": years_max
+        },
+        "years_experience_min": years_min,
+        "years_experience_max": years_max,
+        "tech_count": len(set(techs)),
+        "city": city,
+        "techs": techs,
+        "techs_nested": [
+            {"name": tech['name'], "is_main_tech": tech['is_main_tech']}
+            for tech in technologies
+        ]
+    }
+
+
+def read_candidate_documents(db, candidate_ids):
+    """Read the documents of the candidates from the database, with one query
+    for the candidates and one for their technologies
+
+    Args:
+        db (DAL): pyDAL connection object
+        candidate_ids (list[int]): Candidate IDs
+
+    Returns:
+        dict[int, int], dict[int, dict]: Search versions and documents by
+        candidate ID, deleted candidates are not included
+    """
+    # candidates without a (known) city are documents too, with a null city
+    candidates = db(db.candidate.id.belongs(candidate_ids)).select(
+        db.candidate.ALL,
+        db.city.name,
+        left=db.city.on(db.candidate.city_id == db.city.id)
+    )
+
+    technologies = {}
+    references = db(
+        (db.candidate_tech_reference.tech_id == db.tech.id)
+        & db.candidate_tech_reference.candidate_id.belongs(candidate_ids)
+    ).select(
+        db.candidate_tech_reference.candidate_id,
+        db.candidate_tech_reference.is_main_tech,
+        db.tech.name,
+        orderby=[db.candidate_tech_reference.candidate_id, db.tech.id]
+    )
+    for reference in references:
+        technologies.setdefault(
+            reference.candidate_tech_reference.candidate_id, []
+        ).append({
+            "name": reference.tech.name,
+            "is_main_tech": reference.candidate_tech_reference.is_main_tech,
+        })
+
+    versions = {
+        row.candidate.id: row.candidate.search_version or 0
+        for row in candidates
+    }
+    documents = {
+        row.candidate.id: candidate_document(
+            row.candidate.id,
+            row.city.name,
+            row.candidate.years_experience_min,
+            row.candidate.years_experience_max,
+            technologies.get(row.candidate.id, [])
+        )
+        for row in candidates
+    }
+    return versions, documents
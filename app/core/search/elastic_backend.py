@@ -0,0 +1,257 @@
+from ..models.elasticsearch import get_elastic
+from ..schemas.candidates import Candidate
+from ..schemas.city import City
+from ..schemas.technology import Technology
+
+
+"""
+    Elasticsearch implementation of the GET /candidates search. It uses the
+    same filters and ranking as the MySQL implementation:
+    - years_experience_max, highest first
+    - number of matching technologies (every technology when no tech filter
+    is informed), highest first
+    - candidate ID, to break ties
+
+    The primary and the secondary (experience_max=99) searches are sent in a
+    single _msearch request.
+"""
+
+INDEX = 'candidates'
+RESULTS_SIZE = 5
+
+SOURCE_FIELDS = ['candidate_id', 'city', 'years_experience_min',
+                 'years_experience_max', 'techs_nested']
+
+# (snapshot generation, city IDs by name, tech IDs by name)
+_dictionaries = None
+
+
+class SearchBackendUnavailable(Exception):
+    pass
+
+
+def _ids_by_name(candidate_snapshot):
+    """Reverse name dictionaries of the snapshot, built once per generation
+
+    Args:
+        candidate_snapshot (CandidateSnapshot): Current candidate snapshot
+
+    Returns:
+        dict[str, int], dict[str, int]: City and tech IDs by name
+    """
+    global _dictionaries
+
+    dictionaries = _dictionaries
+    if dictionaries is None \
+            or dictionaries[0] != candidate_snapshot.generation:
+        dictionaries = (
+            candidate_snapshot.generation,
+            {name: city_id for city_id, name in candidate_snapshot.cities()},
+            {name: tech_id for tech_id, name in candidate_snapshot.techs()},
+        )
+        _dictionaries = dictionaries
+    return dictionaries[1], dictionaries[2]
+
+
+def _tech_names(candidate_snapshot, techs):
+    """Translate the comma separated tech IDs into tech names
+
+    Args:
+        candidate_snapshot (CandidateSnapshot): Current candidate snapshot
+        techs (str): Comma separated string of Tech IDs
+
+    Returns:
+        list[str]: Names of the known techs
+    """
+    names = []
+    for tech_id in techs.split(','):
+        try:
+            name = candidate_snapshot.tech_name(int(tech_id))
+        except ValueError:
+            continue
+        if name is not None and name not in names:
+            names.append(name)
+    return names
+
+
+def build_search(city_name, experience_min, experience_max, tech_names):
+    """Create the Elasticsearch search body matching the MySQL query of
+    '_search_candidates'
+
+    Args:
+        city_name (str): City name, None to search every city
+        experience_min (int): Minimum Years of experience
+        experience_max (int): Maximum Years of experience
+        tech_names (list[str]): Tech names, empty to search every tech
+
+    Returns:
+        dict: Search body
+    """
+    filters = [
+        {"range": {"years_experience_min": {"gte": experience_min}}},
+        {
+            "bool": {
+                "should": [
+                    {"range": {"years_experience_max": {
+                        "lte": experience_max
+                    }}},
+                    {"bool": {"filter": [
+                        {"term": {"years_experience_max": 99}},
+                        {"range": {"years_experience_min": {
+                            "lte": experience_max
+                        }}},
+                    ]}},
+                ],
+                "minimum_should_match": 1
+            }
+        },
+        # candidates without technologies, or a city, are not matched by
+        # the MySQL joins
+        {"range": {"tech_count": {"gte": 1}}},
+        {"exists": {"field": "city"}},
+    ]
+    if city_name is not None:
+        filters.append({"term": {"city": city_name}})
+
+    query = {"bool": {"filter": filters}}
+    sort = [{"years_experience_max": "desc"}]
+
+    if tech_names:
+        # each matching tech adds 1 to the score, so it counts them
+        query["bool"]["should"] = [
+            {"constant_score": {"filter": {"term": {"techs": name}},
+                                "boost": 1}}
+            for name in tech_names
+        ]
+        query["bool"]["minimum_should_match"] = 1
+        sort.append({"_score": "desc"})
+    else:
+        sort.append({"tech_count": "desc"})
+    sort.append({"candidate_id": "asc"})
+
+    return {
+        "query": query,
+        "sort": sort,
+        "size": RESULTS_SIZE,
+        "track_scores": True,
+        "_source": SOURCE_FIELDS,
+    }
+
+
+def _parse_hits(candidate_snapshot, response):
+    """Create the candidates of one of the _msearch responses
+
+    Args:
+        candidate_snapshot (CandidateSnapshot): Current candidate snapshot
+        response (dict): Elasticsearch search response
+
+    Raises:
+        SearchBackendUnavailable: if the search failed or returned names
+        unknown to the snapshot
+
+    Returns:
+        list[Candidate]: List of matched candidates
+    """
+    if 'error' in response:
+        raise SearchBackendUnavailable(response['error'])
+
+    city_ids, tech_ids = _ids_by_name(candidate_snapshot)
+
+    candidates = []
+    for hit in response['hits']['hits']:
+        document = hit['_source']
+        try:
+            city = City(id=city_ids[document['city']], name=document['city'])
+            technologies = [
+                Technology(
+                    id=tech_ids[tech['name']],
+                    name=tech['name'],
+                    is_main_tech=tech['is_main_tech']
+                )
+                for tech in document['techs_nested']
+            ]
+        except KeyError as error:
+            raise SearchBackendUnavailable(
+                'Unknown name in the candidates index: {}'.format(error)
+            )
+
+        technologies.sort(key=lambda technology: technology.id)
+        candidates.append(
+            Candidate(
+                id=document['candidate_id'],
+                city=city,
+                experience_min=document['years_experience_min'],
+                experience_max=document['years_experience_max'],
+                technologies=technologies
+            )
+        )
+    return candidates
+
+
+def search_candidates(get_snapshot, city_id, experience_min,
+                      experience_max, techs):
+    """Match candidates with the specified parameters using Elasticsearch.
+    Runs the primary search and the secondary one, with 'experience_max' 99,
+    in a single request. It blocks, so it must run in a worker thread
+
+    Args:
+        get_snapshot (callable): Returns the current candidate snapshot,
+            used to translate IDs into names. It may read the database on a
+            cold worker, so it is called here instead of in the event loop
+        city_id (int): City ID
+        experience_min (int): Minimum Years of experience
+        experience_max (int): Maximum Years of experience
+        techs (str): Comma separated string of Tech IDs
+
+    Raises:
+        SearchBackendUnavailable: if the snapshot could not be loaded or
+        Elasticsearch could not answer
+
+    Returns:
+        list[Candidate], list[Candidate]: Primary and secondary matches
+    """
+    from elasticsearch.exceptions import ElasticsearchException
+
+    try:
+        candidate_snapshot = get_snapshot()
+    except Exception as error:
+        # SnapshotError, or a database error while building the snapshot
+        raise SearchBackendUnavailable(
+            'Candidate snapshot unavailable: {}'.format(error)
+        ) from error
+
+    city_name = None
+    if city_id:
+        city_name = candidate_snapshot.city_name(city_id)
+        if city_name is None:
+            return [], []
+
+    tech_names = []
+    if techs:
+        tech_names = _tech_names(candidate_snapshot, techs)
+        if not tech_names:
+            return [], []
+
+    searches = []
+    for search_experience_max in (experience_max, 99):
+        searches.append({"index": INDEX})
+        searches.append(
+            build_search(city_name, experience_min, search_experience_max,
+                         tech_names)
+        )
+
+    try:
+        response = get_elastic().msearch(body=searches, index=INDEX)
+    except ElasticsearchException as error:
+        raise SearchBackendUnavailable(str(error)) from error
+
+    try:
+        main_response, secondary_response = response['responses']
+        return (
+            _parse_hits(candidate_snapshot, main_response),
+            _parse_hits(candidate_snapshot, secondary_response),
+        )
+    except (KeyError, TypeError, ValueError) as error:
+        raise SearchBackendUnavailable(
+            'Malformed _msearch response: {!r}'.format(error)
+        ) from error
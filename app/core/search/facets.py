@@ -0,0 +1,266 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+
+
+"""
+    Facet counts (per city, technology and experience bucket) for the filters
+    of GET /candidates, computed from aggregates built from the candidate
+    snapshot, once per generation.
+
+    Candidates are grouped by (city, experience bucket), where a bucket is a
+    distinct (years_experience_min, years_experience_max) pair, and ranked so
+    that the candidates of a group are contiguous. The posting list of a
+    technology holds the sorted ranks of the candidates knowing it, so the
+    candidates of a posting list in a range of groups are counted with two
+    binary searches instead of visiting them:
+    - the technology facet counts each posting list over the ranges of the
+    groups matching the city and experience filters
+    - filtering by more than one technology counts the candidates having any
+    of them by inclusion-exclusion over the intersections of their posting
+    lists, intersected starting with the smallest one
+
+    Each facet ignores its own filter, so the counts show how many candidates
+    every other option would match.
+"""
+
+# Facet results kept per generation
+CACHE_SIZE = 1024
+
+# Above this number of techs in the filter, the candidates having any of
+# them are counted from the union of the posting lists, as the
+# inclusion-exclusion needs 2 ** techs - 1 intersections
+MAX_INTERSECTED_TECHS = 4
+
+# FacetIndex of the current snapshot generation of this worker
+_index = None
+
+
+def experience_matches(years_min, years_max, experience_min, experience_max):
+    """Same experience filter used by the candidates search"""
+    return years_min >= experience_min and (
+        years_max <= experience_max
+        or (years_max == 99 and years_min <= experience_max)
+    )
+
+
+def _intersect(smaller, larger):
+    """Sorted ranks present in both sorted arrays
+
+    Args:
+        smaller (array): Sorted ranks, the shortest of the two arrays
+        larger (array): Sorted ranks
+
+    Returns:
+        array: Sorted ranks of the intersection
+    """
+    intersection = array('i')
+    position = 0
+    for rank in smaller:
+        position = bisect_left(larger, rank, position)
+        if position == len(larger):
+            break
+        if larger[position] == rank:
+            intersection.append(rank)
+    return intersection
+
+
+class FacetIndex:
+
+    def __init__(self, candidate_snapshot):
+        """
+        Args:
+            candidate_snapshot (CandidateSnapshot): Current candidate snapshot
+        """
+        self.generation = candidate_snapshot.generation
+        self._city_names = dict(candidate_snapshot.cities())
+        self._tech_names = dict(candidate_snapshot.techs())
+
+        offsets = candidate_snapshot.tech_offsets
+        tech_ids = candidate_snapshot.tech_ids
+
+        def group(position):
+            return (
+                candidate_snapshot.candidate_city_ids[position],
+                (candidate_snapshot.experience_min[position],
+                 candidate_snapshot.experience_max[position]),
+            )
+
+        # candidates with at least one technology, ranked by bucket and city
+        # so the groups of a bucket are contiguous too
+        positions = [
+            position for position in range(len(candidate_snapshot))
+            if offsets[position] != offsets[position + 1]
+        ]
+        positions.sort(key=lambda position: group(position)[::-1])
+
+        # (city_id, bucket) of each group, in rank order
+        self._groups = []
+        # rank of the first candidate of each group, then the number of
+        # ranked candidates
+        self._group_starts = array('i')
+        # tech_id: sorted ranks of the candidates knowing it
+        self._postings = {}
+
+        for rank, position in enumerate(positions):
+            candidate_group = group(position)
+            if not self._groups or self._groups[-1] != candidate_group:
+                self._groups.append(candidate_group)
+                self._group_starts.append(rank)
+            for tech_id in tech_ids[offsets[position]:offsets[position + 1]]:
+                postings = self._postings.setdefault(tech_id, array('i'))
+                if not postings or postings[-1] != rank:
+                    postings.append(rank)
+        self._group_starts.append(len(positions))
+
+        self._cache = OrderedDict()
+
+    def _group_counts(self, ranks):
+        """Number of ranks in each group
+
+        Args:
+            ranks (array): Sorted ranks
+
+        Returns:
+            list[int]: Count per group, in rank order
+        """
+        counts = []
+        start = 0
+        for end in self._group_starts[1:]:
+            position = bisect_left(ranks, end, start)
+            counts.append(position - start)
+            start = position
+        return counts
+
+    def _tech_group_counts(self, tech_ids):
+        """Candidates having any of the techs, per group
+
+        Args:
+            tech_ids (list[int]): Tech IDs
+
+        Returns:
+            list[int]: Count per group, in rank order
+        """
+        postings = sorted(
+            (self._postings[tech_id] for tech_id in tech_ids
+             if tech_id in self._postings),
+            key=len
+        )
+        if len(postings) > MAX_INTERSECTED_TECHS:
+            return self._group_counts(
+                array('i', sorted(set().union(*postings)))
+            )
+
+        counts = [0] * len(self._groups)
+
+        def add(start, intersection, sign):
+            for index in range(start, len(postings)):
+                if intersection is None:
+                    ranks = postings[index]
+                else:
+                    ranks = _intersect(intersection, postings[index])
+                if not ranks:
+                    continue
+                for group_index, count in enumerate(self._group_counts(ranks)):
+                    counts[group_index] += sign * count
+                add(index + 1, ranks, -sign)
+
+        add(0, None, 1)
+        return counts
+
+    def facets(self, city_id, experience_min, experience_max, tech_ids):
+        """Count the candidates per city, tech and experience bucket
+
+        Args:
+            city_id (int): City ID, None for every city
+            experience_min (int): Minimum Years of experience
+            experience_max (int): Maximum Years of experience
+            tech_ids (list[int]): Tech IDs, None for every tech
+
+        Returns:
+            dict: 'total', 'cities', 'technologies' and 'experience' counts
+        """
+        key = (city_id, experience_min, experience_max,
+               tuple(sorted(set(tech_ids))) if tech_ids is not None else None)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        starts = self._group_starts
+        if tech_ids is None:
+            group_counts = [
+                starts[index + 1] - starts[index]
+                for index in range(len(self._groups))
+            ]
+        else:
+            group_counts = self._tech_group_counts(list(key[3]))
+
+        cities = Counter()
+        buckets = Counter()
+        # rank ranges of the groups matching the city and experience filters
+        ranges = []
+        for index, (group, count) in enumerate(zip(self._groups,
+                                                   group_counts)):
+            city_ok = not city_id or group[0] == city_id
+            bucket_ok = experience_matches(group[1][0], group[1][1],
+                                           experience_min, experience_max)
+            if bucket_ok:
+                cities[group[0]] += count
+            if city_ok:
+                buckets[group[1]] += count
+            if city_ok and bucket_ok:
+                if ranges and ranges[-1][1] == starts[index]:
+                    ranges[-1][1] = starts[index + 1]
+                else:
+                    ranges.append([starts[index], starts[index + 1]])
+
+        technologies = Counter()
+        for tech_id, postings in self._postings.items():
+            for start, end in ranges:
+                technologies[tech_id] += bisect_left(postings, end) \
+                    - bisect_left(postings, start)
+
+        result = {
+            'total': cities[city_id] if city_id else sum(cities.values()),
+            'cities': self._named(cities, self._city_names),
+            'technologies': self._named(technologies, self._tech_names),
+            'experience': [
+                {'experience_min': bucket[0], 'experience_max': bucket[1],
+                 'count': count}
+                for bucket, count in sorted(buckets.items()) if count
+            ],
+        }
+
+        self._cache[key] = result
+        if len(self._cache) > CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _named(counts, names):
+        """Facet entries with their names, most candidates first"""
+        entries = [
+            {'id': entry_id, 'name': names.get(entry_id, ''), 'count': count}
+            for entry_id, count in counts.items() if count
+        ]
+        entries.sort(key=lambda entry: (-entry['count'], entry['name']))
+        return entries
+
+
+def get_index(candidate_snapshot):
+    """Returns the facet index of this worker, rebuilding it (and so dropping
+    the cached results) whenever a new snapshot generation is published
+
+    Args:
+        candidate_snapshot (CandidateSnapshot): Current candidate snapshot
+
+    Returns:
+        FacetIndex: Facet index of the snapshot
+    """
+    global _index
+
+    index = _index
+    if index is None or index.generation != candidate_snapshot.generation:
+        index = FacetIndex(candidate_snapshot)
+        _index = index
+    return index
@@ -0,0 +1,299 @@
+import json
+import re
+from .. import settings
+
+
+"""
+    Rewrites the _msearch requests sent by ReactiveSearch before they are
+    forwarded to Elasticsearch, limiting how expensive each search can be and
+    how much data is returned.
+"""
+
+INDEX = 'candidates'
+
+# Fields of the 'candidates' documents read by the front-end
+SOURCE_FIELDS = ['candidate_id', 'years_experience', 'city', 'techs',
+                 'techs_nested']
+
+# Only these parts of the Elasticsearch response are returned by the proxy
+FILTER_PATH = ','.join([
+    'responses.status',
+    'responses.took',
+    'responses.timed_out',
+    'responses.error',
+    'responses.hits.total',
+    'responses.hits.hits._index',
+    'responses.hits.hits._id',
+    'responses.hits.hits._score',
+    'responses.hits.hits._source',
+    'responses.aggregations',
+])
+
+# Header keys kept from each msearch entry, the index is always forced
+HEADER_KEYS = {'preference'}
+
+# Search body keys that are expensive and never used by the front-end
+DROPPED_KEYS = {'explain', 'profile', 'stored_fields', 'docvalue_fields',
+                'script_fields', 'runtime_mappings'}
+
+# Queries, and sorts, rejected anywhere in a search body
+FORBIDDEN_QUERIES = {'script', 'script_score', '_script', 'regexp', 'fuzzy'}
+
+# Queries whose value must not start with a wildcard
+WILDCARD_QUERIES = {'wildcard', 'query_string'}
+
+# A '*' or '?' starting a term of a query_string query
+LEADING_WILDCARD = re.compile(r'(?:^|[\s(){}\[\]:"+\-!&|^~])[*?]')
+
+# Aggregations whose 'size' and 'shard_size' set how many buckets are
+# returned
+SIZED_AGGREGATIONS = {'terms', 'significant_terms', 'multi_terms',
+                      'composite'}
+
+MAX_QUERY_DEPTH = 20
+MAX_AGGREGATION_DEPTH = 3
+MAX_AGGREGATIONS = 20
+
+
+class InvalidSearchRequest(ValueError):
+    pass
+
+
+def _parse_line(line):
+    try:
+        parsed = json.loads(line)
+    except ValueError:
+        raise InvalidSearchRequest('Each line must be a JSON object')
+
+    if not isinstance(parsed, dict):
+        raise InvalidSearchRequest('Each line must be a JSON object')
+    return parsed
+
+
+def _capped_integer(search, key, default, maximum):
+    """Returns search[key] limited to 'maximum'
+
+    Raises:
+        InvalidSearchRequest: if the value is not a positive integer
+    """
+    value = search.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise InvalidSearchRequest(
+            "'{}' must be a positive integer".format(key)
+        )
+    return min(value, maximum)
+
+
+def _check_query(query, depth=0):
+    """Reject the queries that are too deep or known to be expensive
+
+    Args:
+        query (dict|list): Query, or part of it
+
+    Raises:
+        InvalidSearchRequest: if the query is not allowed
+    """
+    if depth > MAX_QUERY_DEPTH:
+        raise InvalidSearchRequest('Query is nested too deep')
+
+    if isinstance(query, list):
+        for item in query:
+            _check_query(item, depth + 1)
+        return
+
+    if not isinstance(query, dict):
+        return
+
+    for key, value in query.items():
+        if key in FORBIDDEN_QUERIES:
+            raise InvalidSearchRequest(
+                "'{}' queries are not allowed".format(key)
+            )
+        if key in WILDCARD_QUERIES and _has_leading_wildcard(key, value):
+            raise InvalidSearchRequest('Leading wildcards are not allowed')
+        _check_query(value, depth + 1)
+
+
+def _has_leading_wildcard(query_type, query):
+    """Whether a 'wildcard' pattern, or any term of a 'query_string' query,
+    starts with a wildcard"""
+    if query_type == 'query_string':
+        text = query.get('query') if isinstance(query, dict) else query
+        return isinstance(text, str) \
+            and LEADING_WILDCARD.search(text) is not None
+
+    if isinstance(query, dict):
+        return any(_has_leading_wildcard(query_type, value)
+                   for value in query.values())
+    return isinstance(query, str) and query[:1] in ('*', '?')
+
+
+def _rewrite_top_hits(top_hits):
+    """Apply the limits of the search hits to a 'top_hits' aggregation,
+    in place"""
+    for key in DROPPED_KEYS:
+        top_hits.pop(key, None)
+    _check_query(top_hits)
+
+    for key, maximum in (('size', settings.ELASTIC_PROXY_MAX_SIZE),
+                         ('from', settings.ELASTIC_PROXY_MAX_FROM)):
+        if key in top_hits:
+            top_hits[key] = _capped_integer(top_hits, key, 0, maximum)
+
+    top_hits['_source'] = _rewrite_source(top_hits.get('_source'))
+
+
+def _rewrite_aggregations(aggregations, depth=1, counter=None):
+    """Cap the number of buckets of every aggregation, in place
+
+    Args:
+        aggregations (dict): 'aggs' of a search body
+        depth (int): Aggregation nesting level
+        counter (list[int]): Number of aggregations seen so far
+
+    Raises:
+        InvalidSearchRequest: if there are too many or too deep aggregations
+    """
+    counter = counter if counter is not None else [0]
+
+    if not isinstance(aggregations, dict):
+        raise InvalidSearchRequest("'aggs' must be a JSON object")
+    if depth > MAX_AGGREGATION_DEPTH:
+        raise InvalidSearchRequest('Aggregations are nested too deep')
+
+    for aggregation in aggregations.values():
+        if not isinstance(aggregation, dict):
+            raise InvalidSearchRequest(
+                'Each aggregation must be a JSON object'
+            )
+
+        counter[0] += 1
+        if counter[0] > MAX_AGGREGATIONS:
+            raise InvalidSearchRequest('Too many aggregations')
+
+        for aggregation_type, definition in aggregation.items():
+            if aggregation_type in ('aggs', 'aggregations'):
+                _rewrite_aggregations(definition, depth + 1, counter)
+            elif aggregation_type == 'top_hits' \
+                    and isinstance(definition, dict):
+                _rewrite_top_hits(definition)
+            elif aggregation_type in SIZED_AGGREGATIONS \
+                    and isinstance(definition, dict):
+                _check_query(definition)
+                for key in ('size', 'shard_size'):
+                    if key in definition:
+                        definition[key] = _capped_integer(
+                            definition, key, 0,
+                            settings.ELASTIC_PROXY_MAX_AGGREGATION_SIZE
+                        )
+            else:
+                _check_query(definition)
+
+
+def _rewrite_source(source):
+    """Limit the returned '_source' to the fields used by the front-end
+
+    Args:
+        source: '_source' requested by the client
+
+    Returns:
+        dict|bool: '_source' sent to Elasticsearch, False for no source
+    """
+    if source is False:
+        return False
+
+    if isinstance(source, dict):
+        includes = source.get('includes', ['*'])
+    elif isinstance(source, (list, str)):
+        includes = source
+    else:
+        includes = ['*']
+
+    if isinstance(includes, str):
+        includes = [includes]
+
+    if '*' in includes:
+        return {'includes': list(SOURCE_FIELDS)}
+
+    fields = [field for field in SOURCE_FIELDS if field in includes]
+    if not fields:
+        raise InvalidSearchRequest("'_source' has no allowed field")
+    return {'includes': fields}
+
+
+def _rewrite_search(search):
+    """Rewrite one search body of the msearch request
+
+    Args:
+        search (dict): Search body sent by the client
+
+    Returns:
+        dict: Search body to be sent to Elasticsearch
+    """
+    for key in DROPPED_KEYS:
+        search.pop(key, None)
+
+    search['size'] = _capped_integer(search, 'size', 10,
+                                     settings.ELASTIC_PROXY_MAX_SIZE)
+    search['from'] = _capped_integer(search, 'from', 0,
+                                     settings.ELASTIC_PROXY_MAX_FROM)
+
+    for key in ('query', 'post_filter', 'sort'):
+        if key in search:
+            _check_query(search[key])
+
+    for key in ('aggs', 'aggregations'):
+        if key in search:
+            _rewrite_aggregations(search[key])
+
+    search['_source'] = _rewrite_source(search.get('_source'))
+    return search
+
+
+def rewrite_msearch_body(body):
+    """Parse the NDJSON body of an _msearch request and rewrite every entry:
+    - forces the 'candidates' index
+    - caps 'size', 'from' and the aggregations number of buckets or hits
+    - restricts '_source' to the fields used by the front-end
+    - rejects scripts, regexps and queries nested too deep
+
+    Args:
+        body (bytes): _msearch request body
+
+    Raises:
+        InvalidSearchRequest: if the body is invalid or too expensive
+
+    Returns:
+        str: NDJSON body to be forwarded to Elasticsearch
+    """
+    if len(body) > settings.ELASTIC_PROXY_MAX_BODY_BYTES:
+        raise InvalidSearchRequest('Search request is too big')
+
+    try:
+        text = body.decode('utf-8')
+    except UnicodeDecodeError:
+        raise InvalidSearchRequest('Search request must be UTF-8 encoded')
+
+    lines = [line for line in text.split('\n') if line.strip()]
+    if not lines or len(lines) % 2 != 0:
+        raise InvalidSearchRequest(
+            'Search request must have a header and a body line per search'
+        )
+    if len(lines) // 2 > settings.ELASTIC_PROXY_MAX_SEARCHES:
+        raise InvalidSearchRequest('Too many searches in a single request')
+
+    rewritten = []
+    for header_line, search_line in zip(lines[::2], lines[1::2]):
+        header = {
+            key: value for key, value in _parse_line(header_line).items()
+            if key in HEADER_KEYS
+        }
+        header['index'] = INDEX
+
+        search = _rewrite_search(_parse_line(search_line))
+
+        rewritten.append(json.dumps(header))
+        rewritten.append(json.dumps(search))
+    rewritten.append('')
+
+    return '\n'.join(rewritten)
@@ -0,0 +1,375 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+
+"""
+    Compact columnar snapshot of the candidates, written by the import and
+    memory-mapped read-only by every uvicorn worker. As the file is mapped
+    instead of read, its pages are shared by all the workers of the host and
+    no worker needs to scan the database when it starts.
+
+    File layout:
+        - MAGIC (8 bytes)
+        - header size (unsigned 32 bits little-endian integer)
+        - header (JSON): format version, generation and where each column is
+        - columns, each one aligned to 8 bytes
+
+    A new snapshot is written to a temporary file which then replaces the
+    current one with os.replace, so readers see either the old or the new
+    file, never a partial one.
+"""
+
+MAGIC = b'JFSNAP\x00\x00'
+FORMAT_VERSION = 2
+
+_HEADER_SIZE = struct.Struct('<I')
+_ALIGNMENT = 8
+
+# Column name: array typecode
+COLUMNS = {
+    # Candidates, sorted by ID
+    'candidate_ids': 'i',
+    'candidate_city_ids': 'i',
+    'experience_min': 'H',
+    'experience_max': 'H',
+    # CSR adjacency list: the techs of the candidate at position N are
+    # tech_ids[tech_offsets[N]:tech_offsets[N + 1]]
+    'tech_offsets': 'i',
+    'tech_ids': 'i',
+    'tech_is_main': 'B',
+    # Name dictionaries, sorted by ID: the name of the city at position N is
+    # city_names[city_name_offsets[N]:city_name_offsets[N + 1]]
+    'city_ids': 'i',
+    'city_name_offsets': 'i',
+    'city_names': 'B',
+    'tech_dict_ids': 'i',
+    'tech_name_offsets': 'i',
+    'tech_names': 'B',
+}
+
+# Range of the experience columns, values out of it are clamped
+_EXPERIENCE_RANGE = (0, 2 ** 16 - 1)
+
+_lock = threading.Lock()
+_current = None
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class CandidateSnapshot:
+    """Read-only view over a memory-mapped snapshot file. Columns are exposed
+    as memoryviews, so reading them does not copy the data"""
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Snapshot file path
+
+        Raises:
+            SnapshotError: if the file is not a snapshot in a known version
+        """
+        with open(path, 'rb') as snapshot_file:
+            file_stat = os.fstat(snapshot_file.fileno())
+            self._mmap = mmap.mmap(
+                snapshot_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+        self.path = path
+        self.file_id = _file_id(file_stat)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise SnapshotError('{} is not a candidate snapshot'.format(path))
+
+        header_start = len(MAGIC) + _HEADER_SIZE.size
+        header_size, = _HEADER_SIZE.unpack_from(self._mmap, len(MAGIC))
+        header = json.loads(
+            self._mmap[header_start:header_start + header_size]
+        )
+
+        if header['format_version'] != FORMAT_VERSION:
+            raise SnapshotError(
+                'Unsupported snapshot format version {}'.format(
+                    header['format_version']
+                )
+            )
+
+        self.generation = header['generation']
+        self.created_on = header['created_on']
+
+        buffer = memoryview(self._mmap)
+        for name, typecode in COLUMNS.items():
+            offset, size = header['columns'][name]
+            setattr(self, name, buffer[offset:offset + size].cast(typecode))
+
+    def __len__(self):
+        return len(self.candidate_ids)
+
+    def candidate_techs(self, position):
+        """Techs of the candidate at the given position
+
+        Args:
+            position (int): Candidate position in the 'candidate_ids' column
+
+        Returns:
+            list[tuple[int, bool]]: (tech_id, is_main_tech) tuples
+        """
+        start = self.tech_offsets[position]
+        end = self.tech_offsets[position + 1]
+        return [
+            (self.tech_ids[index], bool(self.tech_is_main[index]))
+            for index in range(start, end)
+        ]
+
+    def city_name(self, city_id):
+        """Returns the name of a city, None if the ID is unknown"""
+        return _lookup_name(self.city_ids, self.city_name_offsets,
+                            self.city_names, city_id)
+
+    def tech_name(self, tech_id):
+        """Returns the name of a technology, None if the ID is unknown"""
+        return _lookup_name(self.tech_dict_ids, self.tech_name_offsets,
+                            self.tech_names, tech_id)
+
+    def cities(self):
+        """Returns every city of the snapshot
+
+        Returns:
+            list[tuple[int, str]]: (city_id, name) tuples
+        """
+        return _iterate_names(self.city_ids, self.city_name_offsets,
+                              self.city_names)
+
+    def techs(self):
+        """Returns every technology of the snapshot
+
+        Returns:
+            list[tuple[int, str]]: (tech_id, name) tuples
+        """
+        return _iterate_names(self.tech_dict_ids, self.tech_name_offsets,
+                              self.tech_names)
+
+
+def _file_id(file_stat):
+    """Identify a version of the snapshot file, it changes whenever the file
+    is replaced"""
+    return file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size
+
+
+def _lookup_name(ids, offsets, names, entry_id):
+    position = bisect_left(ids, entry_id)
+    if position == len(ids) or ids[position] != entry_id:
+        return None
+    return bytes(
+        names[offsets[position]:offsets[position + 1]]
+    ).decode('utf-8')
+
+
+def _iterate_names(ids, offsets, names):
+    return [
+        (ids[position],
+         bytes(names[offsets[position]:offsets[position + 1]]).decode('utf-8'))
+        for position in range(len(ids))
+    ]
+
+
+def _name_dictionary(rows):
+    """Create the ID, offsets and names columns of a name dictionary
+
+    Args:
+        rows (Rows): pyDAL rows with 'id' and 'name', sorted by ID
+
+    Returns:
+        array, array, bytes: IDs, name offsets and UTF-8 encoded names
+    """
+    ids = array('i')
+    offsets = array('i', [0])
+    names = bytearray()
+    for row in rows:
+        ids.append(row.id)
+        names += row.name.encode('utf-8')
+        offsets.append(len(names))
+    return ids, offsets, bytes(names)
+
+
+def _experience(value, default):
+    """Years of experience stored in the snapshot, the column default when
+    the value is NULL"""
+    if value is None:
+        value = default
+    return min(max(value, _EXPERIENCE_RANGE[0]), _EXPERIENCE_RANGE[1])
+
+
+def _read_columns(db):
+    """Scan the database and create the snapshot columns
+
+    Args:
+        db (DAL): pyDAL connection object
+
+    Returns:
+        dict[str, array|bytes]: Data of each column
+    """
+    columns = {name: array(typecode) for name, typecode in COLUMNS.items()}
+
+    candidates = db(db.candidate.id > 0).select(
+        db.candidate.id,
+        db.candidate.city_id,
+        db.candidate.years_experience_min,
+        db.candidate.years_experience_max,
+        orderby=db.candidate.id,
+    )
+    references = db(db.candidate_tech_reference.id > 0).select(
+        db.candidate_tech_reference.candidate_id,
+        db.candidate_tech_reference.tech_id,
+        db.candidate_tech_reference.is_main_tech,
+        orderby=db.candidate_tech_reference.candidate_id
+        | db.candidate_tech_reference.tech_id,
+    )
+
+    references = iter(references)
+    reference = next(references, None)
+    columns['tech_offsets'].append(0)
+    for candidate in candidates:
+        columns['candidate_ids'].append(candidate.id)
+        columns['candidate_city_ids'].append(candidate.city_id or 0)
+        columns['experience_min'].append(_experience(
+            candidate.years_experience_min,
+            db.candidate.years_experience_min.default
+        ))
+        columns['experience_max'].append(_experience(
+            candidate.years_experience_max,
+            db.candidate.years_experience_max.default
+        ))
+
+        # skip references of candidates that no longer exist
+        while reference is not None \
+                and reference.candidate_id < candidate.id:
+            reference = next(references, None)
+        while reference is not None \
+                and reference.candidate_id == candidate.id:
+            columns['tech_ids'].append(reference.tech_id)
+            columns['tech_is_main'].append(int(bool(reference.is_main_tech)))
+            reference = next(references, None)
+        columns['tech_offsets'].append(len(columns['tech_ids']))
+
+    (columns['city_ids'],
+     columns['city_name_offsets'],
+     columns['city_names']) = _name_dictionary(
+        db(db.city.id > 0).select(db.city.id, db.city.name,
+                                  orderby=db.city.id)
+    )
+    (columns['tech_dict_ids'],
+     columns['tech_name_offsets'],
+     columns['tech_names']) = _name_dictionary(
+        db(db.tech.id > 0).select(db.tech.id, db.tech.name,
+                                  orderby=db.tech.id)
+    )
+
+    return columns
+
+
+def _padding(size):
+    return b'\x00' * (-size % _ALIGNMENT)
+
+
+def write_snapshot(db, path):
+    """Scan the database and atomically replace the snapshot file
+
+    Args:
+        db (DAL): pyDAL connection object
+        path (str): Snapshot file path
+
+    Returns:
+        CandidateSnapshot: The snapshot just written
+    """
+    columns = _read_columns(db)
+    blobs = {name: bytes(data) for name, data in columns.items()}
+
+    header = {
+        'format_version': FORMAT_VERSION,
+        'generation': time.time_ns(),
+        'created_on': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'columns': {},
+    }
+
+    # The header holds the column offsets, which depend on the header size,
+    # so reserve enough room for the largest offsets before placing them
+    header['columns'] = {name: [2 ** 62, 2 ** 62] for name in blobs}
+    header_room = len(json.dumps(header).encode('utf-8'))
+    position = len(MAGIC) + _HEADER_SIZE.size + header_room
+    position += -position % _ALIGNMENT
+
+    for name, blob in blobs.items():
+        header['columns'][name] = [position, len(blob)]
+        position += len(blob) + len(_padding(len(blob)))
+
+    header_bytes = json.dumps(header).encode('utf-8').ljust(header_room)
+
+    # a unique temporary file, as several threads or workers may write the
+    # snapshot at once
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=os.path.basename(path) + '.',
+        suffix='.tmp'
+    )
+    try:
+        with os.fdopen(file_descriptor, 'wb') as snapshot_file:
+            snapshot_file.write(MAGIC)
+            snapshot_file.write(_HEADER_SIZE.pack(len(header_bytes)))
+            snapshot_file.write(header_bytes)
+            snapshot_file.write(_padding(snapshot_file.tell()))
+            for blob in blobs.values():
+                snapshot_file.write(blob)
+                snapshot_file.write(_padding(len(blob)))
+            snapshot_file.flush()
+            os.fchmod(snapshot_file.fileno(), 0o644)
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return get_snapshot(path)
+
+
+def get_snapshot(path):
+    """Returns the snapshot currently at 'path', mapping it again whenever the
+    file was replaced by a newer import
+
+    Args:
+        path (str): Snapshot file path
+
+    Returns:
+        CandidateSnapshot: The current snapshot, None if there is no file
+    """
+    global _current
+
+    try:
+        file_id = _file_id(os.stat(path))
+    except FileNotFoundError:
+        return None
+
+    current = _current
+    if current is not None and current.path == path \
+            and current.file_id == file_id:
+        return current
+
+    with _lock:
+        current = _current
+        if current is None or current.path != path \
+                or current.file_id != file_id:
+            # The previous mapping is closed by the garbage collector once
+            # the requests still using it are done
+            _current = CandidateSnapshot(path)
+        return _current
@@ -0,0 +1,321 @@
+import datetime
+import json
+import threading
+import uuid
+from .documents import INDEX, read_candidate_documents
+from .. import settings
+
+
+"""
+    Incremental sync of the Elasticsearch 'candidates' index from the
+    'search_outbox' table.
+
+    Every write to 'candidate' or 'candidate_tech_reference' records the
+    candidate ID in the outbox, in the same transaction. The syncer reads the
+    outbox in batches, reads the current documents of the affected
+    candidates from the database and upserts them (or deletes the ones of
+    deleted candidates) with a single bulk request. Outbox rows are only
+    deleted after Elasticsearch confirms the write, failed rows are retried
+    with an exponential backoff.
+
+    Several syncers run at once (one per uvicorn worker, plus the import).
+    Each batch is claimed for 'lease' seconds with a conditional update of
+    the due, unclaimed rows, which a single syncer wins, so a change is not
+    bulk indexed by every worker. Rows of a syncer that stopped are claimed
+    again once the lease expires.
+
+    A candidate may still be synced by two syncers when it changes while
+    claimed, so each document is written with Elasticsearch external
+    versioning,
+    using the candidate 'search_version', incremented by every change in the
+    same transaction and read together with the document. A syncer that read
+    an older document gets a version conflict instead of overwriting a newer
+    one, and its rows are done: a newer sync already covered them. Deleted
+    candidates use the version recorded in their outbox rows.
+
+    Elasticsearch forgets the versions of deleted documents after the
+    'index.gc_deletes' setting (60s), so a syncer drops its batch instead of
+    writing it once its lease expired: the lease plus BULK_TIMEOUT must stay
+    below 'index.gc_deletes', or a late write could bring a deleted
+    candidate back.
+"""
+
+# Seconds before retrying a failed row, doubled on each attempt
+RETRY_BACKOFF = 1.0
+MAX_RETRY_BACKOFF = 300.0
+
+# Seconds Elasticsearch has to answer a bulk request
+BULK_TIMEOUT = 10
+
+
+def _bulk_body(versions, documents):
+    """Create the bulk request syncing the candidates
+
+    Args:
+        versions (dict[int, int]): Document version by candidate ID
+        documents (dict[int, dict]): Documents of the existing candidates
+
+    Returns:
+        str: Elasticsearch bulk request
+    """
+    bulk_body = []
+    for candidate_id, version in versions.items():
+        action = {
+            "_id": candidate_id,
+            "_index": INDEX,
+            "version": version,
+            "version_type": "external",
+        }
+        if candidate_id in documents:
+            # the update API does not support external versions, so the
+            # whole document is indexed
+            bulk_body.append(json.dumps({"index": action}))
+            bulk_body.append(json.dumps(documents[candidate_id]))
+        else:
+            bulk_body.append(json.dumps({"delete": action}))
+    bulk_body.append('')
+
+    return '\n'.join(bulk_body)
+
+
+def _failed_items(response):
+    """Errors of the bulk response items. Deleting a missing document is not
+    an error, nor is a version conflict, which means a newer version of the
+    document was already written
+
+    Args:
+        response (dict): Elasticsearch bulk response
+
+    Returns:
+        dict[int, str]: Error message by candidate ID
+    """
+    failed = {}
+    for item in response.get('items', []):
+        result = next(iter(item.values()))
+        if result.get('status', 500) < 300 \
+                or result.get('status') in (404, 409):
+            continue
+        failed[int(result['_id'])] = json.dumps(result.get('error'))[:255]
+    return failed
+
+
+class OutboxSyncer:
+
+    def __init__(self, interval, batch_size, lease):
+        """
+        Args:
+            interval (float): Seconds between syncs of the background thread,
+                0 to disable it
+            batch_size (int): Outbox rows read per bulk request
+            lease (float): Seconds a batch stays claimed by this syncer
+        """
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease = lease
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.last_sync_on = None
+        self.documents_synced = 0
+        self.sync_errors = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def sync_batch(self, db):
+        """Sync the candidates of the oldest due outbox rows
+
+        Args:
+            db (DAL): pyDAL connection object
+
+        Returns:
+            int, int: Candidates synced and failed
+        """
+        from elasticsearch.exceptions import ElasticsearchException
+        from ..models.elasticsearch import get_elastic
+
+        outbox = db.search_outbox
+        now = datetime.datetime.utcnow()
+        claimable = (outbox.next_attempt_on <= now) & (
+            (outbox.claimed_until == None) | (outbox.claimed_until <= now)
+        )
+        due = db(claimable).select(
+            outbox.candidate_id,
+            orderby=outbox.id,
+            limitby=(0, self.batch_size)
+        )
+        if not due:
+            return 0, 0
+
+        # every due row of the candidates, the update only claims the rows
+        # still unclaimed when it runs, which lock them on MySQL
+        claim = uuid.uuid4().hex
+        claimed_until = now + datetime.timedelta(seconds=self.lease)
+        db(claimable
+           & outbox.candidate_id.belongs({row.candidate_id for row in due})
+           ).update(claimed_by=claim, claimed_until=claimed_until)
+        db.commit()
+
+        rows = db(outbox.claimed_by == claim).select(orderby=outbox.id)
+        if not rows:
+            # claimed by another syncer
+            return 0, 0
+
+        candidate_ids = list({row.candidate_id: True for row in rows})
+        versions, documents = read_candidate_documents(db, candidate_ids)
+        # deleted candidates, the delete recorded their last version
+        for row in rows:
+            if row.candidate_id not in documents:
+                versions[row.candidate_id] = max(
+                    versions.get(row.candidate_id, 0), row.version or 0
+                )
+
+        if datetime.datetime.utcnow() >= claimed_until:
+            # the rows may be claimed by another syncer by now, which
+            # writes the documents instead
+            return 0, 0
+
+        try:
+            response = get_elastic().bulk(
+                _bulk_body(versions, documents),
+                INDEX,
+                timeout='{}s'.format(BULK_TIMEOUT),
+                request_timeout=BULK_TIMEOUT
+            )
+            failed = _failed_items(response)
+        except ElasticsearchException as error:
+            failed = {
+                candidate_id: str(error)[:255]
+                for candidate_id in candidate_ids
+            }
+
+        synced_ids = [
+            candidate_id for candidate_id in candidate_ids
+            if candidate_id not in failed
+        ]
+        # only the rows read are deleted, rows written meanwhile may not be
+        # in the documents read
+        synced_rows = [
+            row.id for row in rows if row.candidate_id not in failed
+        ]
+        if synced_rows:
+            db(db.search_outbox.id.belongs(synced_rows)).delete()
+
+        for row in rows:
+            if row.candidate_id not in failed:
+                continue
+            backoff = min(MAX_RETRY_BACKOFF,
+                          RETRY_BACKOFF * 2 ** row.attempts)
+            row.update_record(
+                attempts=row.attempts + 1,
+                next_attempt_on=now + datetime.timedelta(seconds=backoff),
+                last_error=failed[row.candidate_id],
+                claimed_by=None,
+                claimed_until=None,
+            )
+        db.commit()
+
+        with self._lock:
+            self.last_sync_on = now
+            self.documents_synced += len(synced_ids)
+            self.sync_errors += len(failed)
+        return len(synced_ids), len(failed)
+
+    def sync(self, db):
+        """Sync batches until the due outbox rows are synced or a batch fails
+
+        Args:
+            db (DAL): pyDAL connection object
+
+        Returns:
+            int: Candidates synced
+        """
+        synced_total = 0
+        while True:
+            synced, failed = self.sync_batch(db)
+            synced_total += synced
+            if failed or not synced:
+                return synced_total
+
+    def _run(self, connect):
+        while not self._stop.wait(self.interval):
+            try:
+                db = connect()
+                try:
+                    self.sync(db)
+                finally:
+                    db.close()
+            except Exception as error:
+                from sentry_sdk import capture_exception
+
+                with self._lock:
+                    self.sync_errors += 1
+                capture_exception(error)
+
+    def start(self, connect):
+        """Sync the outbox every 'interval' seconds in a background thread,
+        which has its own database connection because pyDAL keeps connections
+        in thread locals
+
+        Args:
+            connect (callable): Returns a new pyDAL connection object
+        """
+        if not self.interval or self.running:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(connect,),
+                                        name='search-outbox-syncer',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+
+        self._stop.set()
+        self._thread.join()
+
+    def stats(self, db):
+        """Syncer lag and counters
+
+        Args:
+            db (DAL): pyDAL connection object
+
+        Returns:
+            dict: Candidates waiting to be synced, lag and counters of this
+            worker
+        """
+        outbox = db.search_outbox
+        pending = outbox.candidate_id.count(distinct=True)
+        oldest = outbox.created_on.min()
+        row = db(outbox.id > 0).select(pending, oldest).first()
+        retrying = db(outbox.attempts > 0).count(distinct=outbox.candidate_id)
+
+        lag_seconds = 0.0
+        if row[oldest] is not None:
+            lag_seconds = max(
+                0.0,
+                (datetime.datetime.utcnow() - row[oldest]).total_seconds()
+            )
+
+        with self._lock:
+            return {
+                'running': self.running,
+                'pending': row[pending],
+                'retrying': retrying,
+                'lag_seconds': round(lag_seconds, 3),
+                'last_sync_on': self.last_sync_on,
+                'documents_synced': self.documents_synced,
+                'sync_errors': self.sync_errors,
+            }
+
+
+outbox_syncer = OutboxSyncer(
+    interval=settings.SEARCH_SYNC_INTERVAL,
+    batch_size=settings.SEARCH_SYNC_BATCH_SIZE,
+    lease=settings.SEARCH_SYNC_LEASE,
+)
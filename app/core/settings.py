@@ -9,10 +9,91 @@ DB_HOST = os.getenv('DB_HOST', 'not_informed')
 DB_NAME = os.getenv('DB_NAME', 'not_informed')
 DB_USER = os.getenv('DB_USER', 'not_informed')
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'not_informed')
+# Optional full pyDAL URI, overrides the MySQL variables above when informed.
+# Ex.: "sqlite://jobfinder.sqlite" for benchmarks and local runs
+DB_URI = os.getenv('DB_URI', '')
+
+# Connection pool of each uvicorn worker, the database may receive up to
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+DB_CONN_MAX_AGE = float(os.getenv('DB_CONN_MAX_AGE', '3600'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
 
 ELASTIC_HOST = os.getenv('ELASTIC_HOST', 'not_informed')
 ELASTIC_USERNAME = os.getenv('ELASTIC_USERNAME', 'not_informed')
 ELASTIC_PASSWORD = os.getenv('ELASTIC_PASSWORD', 'not_informed')
 
+# Backend used by GET /candidates: "mysql" or "elasticsearch"
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'mysql')
+
+# Seconds between syncs of the 'search_outbox' table to Elasticsearch, done
+# by a background thread of each worker, 0 disables it
+SEARCH_SYNC_INTERVAL = float(os.getenv('SEARCH_SYNC_INTERVAL', '5'))
+SEARCH_SYNC_BATCH_SIZE = int(os.getenv('SEARCH_SYNC_BATCH_SIZE', '500'))
+# Seconds a batch of outbox rows stays claimed by the syncer of a worker,
+# plus the bulk timeout (10s) it must stay below Elasticsearch's
+# 'index.gc_deletes' (60s)
+SEARCH_SYNC_LEASE = float(os.getenv('SEARCH_SYNC_LEASE', '30'))
+
+# Limits applied by the Elasticsearch _msearch proxy to each search
+ELASTIC_PROXY_MAX_SIZE = int(os.getenv('ELASTIC_PROXY_MAX_SIZE', '50'))
+ELASTIC_PROXY_MAX_FROM = int(os.getenv('ELASTIC_PROXY_MAX_FROM', '500'))
+ELASTIC_PROXY_MAX_AGGREGATION_SIZE = int(
+    os.getenv('ELASTIC_PROXY_MAX_AGGREGATION_SIZE', '100')
+)
+ELASTIC_PROXY_MAX_SEARCHES = int(os.getenv('ELASTIC_PROXY_MAX_SEARCHES', '10'))
+ELASTIC_PROXY_MAX_BODY_BYTES = int(
+    os.getenv('ELASTIC_PROXY_MAX_BODY_BYTES', '65536')
+)
+
+# Admission control: requests running at once and waiting per endpoint, 0
+# disables the limit. Requests are rejected with a 503 when the expected wait
+# exceeds the 'X-Request-Timeout-Ms' header or ADMISSION_DEFAULT_DEADLINE_MS.
+# The concurrency of the database backed routes (candidates, export and
+# lookups) adds up below DB_POOL_SIZE + DB_MAX_OVERFLOW, so management and
+# health check requests still get connections. Client deadlines are capped at
+# ADMISSION_MAX_DEADLINE_MS
+ADMISSION_CANDIDATES_CONCURRENCY = int(
+    os.getenv('ADMISSION_CANDIDATES_CONCURRENCY', '8')
+)
+ADMISSION_CANDIDATES_QUEUE = int(os.getenv('ADMISSION_CANDIDATES_QUEUE', '16'))
+ADMISSION_PROXY_CONCURRENCY = int(
+    os.getenv('ADMISSION_PROXY_CONCURRENCY', '20')
+)
+ADMISSION_PROXY_QUEUE = int(os.getenv('ADMISSION_PROXY_QUEUE', '40'))
+ADMISSION_EXPORT_CONCURRENCY = int(
+    os.getenv('ADMISSION_EXPORT_CONCURRENCY', '2')
+)
+ADMISSION_EXPORT_QUEUE = int(os.getenv('ADMISSION_EXPORT_QUEUE', '0'))
+ADMISSION_LOOKUP_CONCURRENCY = int(
+    os.getenv('ADMISSION_LOOKUP_CONCURRENCY', '3')
+)
+ADMISSION_LOOKUP_QUEUE = int(os.getenv('ADMISSION_LOOKUP_QUEUE', '16'))
+ADMISSION_DEFAULT_DEADLINE_MS = float(
+    os.getenv('ADMISSION_DEFAULT_DEADLINE_MS', '3000')
+)
+ADMISSION_MAX_DEADLINE_MS = float(
+    os.getenv('ADMISSION_MAX_DEADLINE_MS', '30000')
+)
+
+# Candidates read per query by GET /candidates/export
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+# Request profiling, enabled when PROFILING_SECRET is informed (requests
+# sending it in the 'X-Profile' header are profiled) or PROFILING_SAMPLE_RATE
+# is above 0. The last PROFILING_MAX_PROFILES profiles are kept in
+# PROFILING_DIR
+PROFILING_SECRET = os.getenv('PROFILING_SECRET', '')
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', '5'))
+PROFILING_DIR = os.getenv('PROFILING_DIR', './profiles')
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '50'))
+
 SENTRY_DSN = os.getenv('SENTRY_DSN', '')
 SENTRY_ENVIRONMENT = os.getenv('SENTRY_ENVIRONMENT', '')
+
+# Columnar candidate snapshot shared by the uvicorn workers, written by the
+# import. Every worker must be able to read it, ex.: a shared volume
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', './candidates.snapshot')
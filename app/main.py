@@ -1,26 +1,16 @@
 from fastapi import FastAPI, Depends
 from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-import sentry_sdk
-from sentry_sdk.integrations.flask import FlaskIntegration
-from .core.dependencies import get_db
+from .core.dependencies import get_db, connect_db
 from .core.schemas.main import HealthCheck
 from .core.routers import candidates
 from .core.routers import management
+from .core.middleware.admission import AdmissionControlMiddleware, \
+                                       admission_limiters
+from .core.search.sync import outbox_syncer
 from .core import settings
 
 
-"""
-    Using sentry to track application usage and errors, we use the
-    FlaskIntegration because it is compatible with FastAPI
-"""
-sentry_sdk.init(
-    dsn=settings.SENTRY_DSN,
-    integrations=[FlaskIntegration()],
-    environment=settings.SENTRY_ENVIRONMENT,
-    traces_sample_rate=1.0
-)
-
 app = FastAPI()
 app.include_router(candidates.router, tags=['candidates'])
 app.include_router(management.router, tags=['management'])
@@ -31,6 +21,15 @@ origins = [
     "https://jobfinder.viniciusghellere.dev",
 ]
 
+# added before CORS, so the CORS middleware wraps it and the 503 responses
+# shedding load get the CORS headers too
+app.add_middleware(
+    AdmissionControlMiddleware,
+    limiters=admission_limiters,
+    default_deadline=settings.ADMISSION_DEFAULT_DEADLINE_MS / 1000,
+    max_deadline=settings.ADMISSION_MAX_DEADLINE_MS / 1000,
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -39,6 +38,59 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.PROFILING_SECRET or settings.PROFILING_SAMPLE_RATE > 0:
+    from .core.middleware.profiling import ProfilingMiddleware, profile_store
+
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        secret=settings.PROFILING_SECRET,
+        sample_rate=settings.PROFILING_SAMPLE_RATE,
+        interval=settings.PROFILING_INTERVAL_MS / 1000,
+    )
+
+    @app.on_event("startup")
+    def use_profiled_executor():
+        """Sample the threadpool threads serving profiled requests"""
+        import asyncio
+        from .core.middleware.profiling import ProfiledExecutor
+
+        asyncio.get_event_loop().set_default_executor(ProfiledExecutor())
+
+
+@app.on_event("startup")
+def init_sentry():
+    """
+        Using sentry to track application usage and errors, we use the
+        FlaskIntegration because it is compatible with FastAPI.
+
+        It is initialized on startup instead of on import, and only when a DSN
+        is configured, so importing the application stays fast
+    """
+    if not settings.SENTRY_DSN:
+        return
+
+    import sentry_sdk
+    from sentry_sdk.integrations.flask import FlaskIntegration
+
+    sentry_sdk.init(
+        dsn=settings.SENTRY_DSN,
+        integrations=[FlaskIntegration()],
+        environment=settings.SENTRY_ENVIRONMENT,
+        traces_sample_rate=1.0
+    )
+
+
+@app.on_event("startup")
+def start_search_sync():
+    """Sync the search outbox to Elasticsearch in a background thread"""
+    outbox_syncer.start(connect_db)
+
+
+@app.on_event("shutdown")
+def stop_search_sync():
+    outbox_syncer.stop()
+
 
 @app.get("/")
 async def root():
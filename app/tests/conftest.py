@@ -0,0 +1,82 @@
+import pytest
+from pydal import DAL
+from ..core.models.database_tables import define_tables
+from ..core.search import snapshot
+from ..core import settings
+
+
+CITIES = {
+    1: 'São Paulo - SP',
+    2: 'Santos - SP',
+    3: 'Salvador - BA',
+    4: 'Florianópolis - SC',
+}
+
+TECHS = {
+    1: 'Java',
+    2: 'JavaScript',
+    3: 'Python',
+    4: 'Java (Android)',
+}
+
+# (id, city_id, years_experience_min, years_experience_max, {tech_id: main})
+CANDIDATES = [
+    (1, 1, 0, 1, {1: True, 2: False}),
+    (2, 1, 2, 3, {2: True, 3: False}),
+    (3, 1, 12, 99, {1: True, 2: False, 3: False}),
+    (4, 2, 4, 5, {2: True}),
+    (5, 3, 1, 2, {3: True, 1: False}),
+    (6, 3, 7, 8, {1: True, 4: False}),
+    (7, 4, 3, 4, {2: True, 3: True}),
+    (8, 1, 5, 6, {3: True}),
+]
+
+
+def seed_sample_data(db):
+    """Insert the sample cities, technologies and candidates into the DB
+
+    Args:
+        db (DAL): pyDAL connection object
+    """
+    for city_id, name in CITIES.items():
+        db.city.insert(id=city_id, name=name)
+
+    for tech_id, name in TECHS.items():
+        db.tech.insert(id=tech_id, name=name)
+
+    for candidate_id, city_id, years_min, years_max, techs in CANDIDATES:
+        db.candidate.insert(
+            id=candidate_id,
+            city_id=city_id,
+            years_experience_min=years_min,
+            years_experience_max=years_max,
+        )
+        for tech_id, is_main_tech in techs.items():
+            db.candidate_tech_reference.insert(
+                candidate_id=candidate_id,
+                tech_id=tech_id,
+                is_main_tech=is_main_tech,
+            )
+    db.commit()
+
+
+@pytest.fixture
+def sample_db(tmp_path):
+    """In-memory SQLite database with the project tables and sample data"""
+    db = DAL('sqlite:memory', folder=str(tmp_path))
+    define_tables(db)
+    seed_sample_data(db)
+
+    yield db
+
+    db.close()
+
+
+@pytest.fixture
+def sample_snapshot(sample_db, tmp_path, monkeypatch):
+    """Candidate snapshot of the sample data, used by the API as the current
+    one"""
+    snapshot_path = str(tmp_path / 'candidates.snapshot')
+    monkeypatch.setattr(settings, 'SNAPSHOT_PATH', snapshot_path)
+
+    return snapshot.write_snapshot(sample_db, snapshot_path)
@@ -0,0 +1,139 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from ..core.middleware.admission import AdmissionControlMiddleware, \
+                                        AdmissionLimiter, Rejected, \
+                                        admission_limiters, _deadline
+from ..main import app
+
+
+def _run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def test_limiter_queues_and_hands_slots_over():
+    limiter = AdmissionLimiter('test', max_concurrency=1, max_queue=1)
+
+    async def scenario():
+        await limiter.acquire(deadline=1)
+        waiting = asyncio.ensure_future(limiter.acquire(deadline=1))
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+
+        with pytest.raises(Rejected, match='Too many requests waiting'):
+            await limiter.acquire(deadline=1)
+
+        limiter.release(0.1)
+        await waiting
+        assert limiter.in_flight == 1
+        assert limiter.queued == 0
+
+        limiter.release(0.2)
+        assert limiter.in_flight == 0
+
+    _run(scenario())
+    stats = limiter.stats()
+    assert stats['admitted'] == 2
+    assert stats['shed_queue_full'] == 1
+    assert stats['service_time_ms'] == pytest.approx(120.0)
+
+
+def test_limiter_rejects_when_the_deadline_can_not_be_met():
+    limiter = AdmissionLimiter('test', max_concurrency=2, max_queue=10)
+    limiter.service_time = 1.0
+
+    async def scenario():
+        await limiter.acquire(deadline=0.1)
+        await limiter.acquire(deadline=0.1)
+
+        # one request leaves every 0.5s
+        assert limiter.expected_wait() == pytest.approx(0.5)
+        with pytest.raises(Rejected) as rejected:
+            await limiter.acquire(deadline=0.1)
+        assert rejected.value.retry_after == pytest.approx(0.5)
+
+        limiter.service_time = 0.01
+        with pytest.raises(Rejected, match='Deadline expired'):
+            await limiter.acquire(deadline=0.01)
+        assert limiter.queued == 0
+
+    _run(scenario())
+    stats = limiter.stats()
+    assert stats['shed_deadline'] == 1
+    assert stats['shed_timeout'] == 1
+    assert stats['in_flight'] == 2
+
+
+def test_rejected_requests_get_a_fast_503(sample_snapshot):
+    limiter = AdmissionLimiter('facets', max_concurrency=1, max_queue=0)
+    limiter.in_flight = 1
+    client = TestClient(AdmissionControlMiddleware(
+        app, limiters={('GET', '/candidates/facets'): limiter},
+        default_deadline=1, max_deadline=5
+    ))
+
+    response = client.get("/candidates/facets")
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
+
+    # routes without a limiter are not queued
+    response = client.get("/management/admission-stats")
+    assert response.status_code == 200
+    assert [limiter['name'] for limiter in response.json()] == \
+        ['candidates', 'elastic-proxy', 'export', 'lookups']
+
+    limiter.in_flight = 0
+    response = client.get("/candidates/facets",
+                          headers={'X-Request-Timeout-Ms': '500'})
+    assert response.status_code == 200
+    assert limiter.stats()['admitted'] == 1
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.parametrize('header, deadline', [
+    (None, 1.0),
+    (b'500', 0.5),
+    (b'-20', 0.0),
+    (b'60000', 5.0),
+    (b'not a number', 1.0),
+    (b'nan', 1.0),
+    (b'inf', 1.0),
+    (b'-inf', 1.0),
+])
+def test_deadline_is_finite_and_capped(header, deadline):
+    headers = [(b'x-request-timeout-ms', header)] if header else []
+
+    assert _deadline({'headers': headers}, 1.0, 5.0) == deadline
+
+
+def test_every_database_route_is_limited():
+    for path in ('/candidates', '/candidates/export', '/candidates/facets',
+                 '/candidates/search-options', '/candidates/autocomplete'):
+        assert ('GET', path) in admission_limiters
+
+    # the lookups share a limiter
+    assert admission_limiters[('GET', '/candidates/facets')] is \
+        admission_limiters[('GET', '/candidates/autocomplete')]
+
+
+def test_shed_requests_get_cors_headers_and_preflights_pass(monkeypatch):
+    limiter = admission_limiters[('GET', '/candidates')]
+    monkeypatch.setattr(limiter, 'in_flight', limiter.max_concurrency)
+    monkeypatch.setattr(limiter, 'max_queue', 0)
+    shed_queue_full = limiter.shed_queue_full
+    client = TestClient(app)
+    origin = 'http://localhost:3000'
+
+    response = client.get("/candidates", headers={'Origin': origin})
+    assert response.status_code == 503
+    assert response.headers['access-control-allow-origin'] == origin
+    assert limiter.shed_queue_full == shed_queue_full + 1
+
+    # the CORS preflight of a limited route is not queued
+    response = client.options("/candidates", headers={
+        'Origin': origin,
+        'Access-Control-Request-Method': 'GET',
+    })
+    assert response.status_code == 200
+    assert response.headers['access-control-allow-origin'] == origin
+    assert limiter.shed_queue_full == shed_queue_full + 1
@@ -0,0 +1,64 @@
+from fastapi.testclient import TestClient
+from ..core.search import autocomplete
+from ..main import app
+
+client = TestClient(app)
+
+
+def test_normalize_name():
+    assert autocomplete.normalize_name(' São  Paulo - SP ') == 'sao paulo - sp'
+    assert autocomplete.normalize_name('FLORIANÓPOLIS') == 'florianopolis'
+
+
+def test_prefix_index_ranks_by_candidate_count():
+    index = autocomplete.PrefixIndex([
+        (1, 'Java', 10),
+        (2, 'JavaScript', 30),
+        (3, 'Java (Android)', 5),
+        (4, 'Python', 20),
+    ])
+
+    assert [entry[0] for entry in index.search('jav')] == [2, 1, 3]
+    assert [entry[0] for entry in index.search('ja', limit=2)] == [2, 1]
+    assert index.search('android') == [(3, 'Java (Android)', 5)]
+    assert index.search('ruby') == []
+    assert index.search('  ') == []
+
+
+def test_autocomplete_city_ignores_accents(sample_snapshot):
+    response = client.get(
+        "/candidates/autocomplete", params={'field': 'city', 'q': 'sao'}
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        'field': 'city',
+        'suggestions': [
+            {'id': 1, 'name': 'São Paulo - SP', 'candidate_count': 4}
+        ]
+    }
+
+    response = client.get(
+        "/candidates/autocomplete", params={'field': 'city', 'q': 'S'}
+    )
+    names = [city['name'] for city in response.json()['suggestions']]
+    assert names == [
+        'São Paulo - SP', 'Salvador - BA', 'Florianópolis - SC', 'Santos - SP'
+    ]
+
+
+def test_autocomplete_tech(sample_snapshot):
+    response = client.get(
+        "/candidates/autocomplete",
+        params={'field': 'tech', 'q': 'java', 'limit': 2}
+    )
+    assert response.status_code == 200
+    suggestions = response.json()['suggestions']
+    assert [tech['name'] for tech in suggestions] == ['JavaScript', 'Java']
+    assert [tech['candidate_count'] for tech in suggestions] == [5, 4]
+
+
+def test_autocomplete_invalid_field(sample_snapshot):
+    response = client.get(
+        "/candidates/autocomplete", params={'field': 'country', 'q': 'br'}
+    )
+    assert response.status_code == 422
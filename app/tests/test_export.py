@@ -0,0 +1,108 @@
+import csv
+import io
+import json
+import pytest
+from fastapi.testclient import TestClient
+from ..core.dependencies import get_db_runner
+from ..core.routers.candidates import _read_candidates_batch, \
+                                      _search_candidates
+from ..core import settings
+from ..main import app
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def sample_db_api(sample_db, monkeypatch):
+    async def run_with_sample_db(function, *args):
+        # the in-memory database belongs to the thread that created it
+        return function(sample_db, *args)
+
+    monkeypatch.setattr(settings, 'EXPORT_BATCH_SIZE', 3)
+    app.dependency_overrides[get_db_runner] = lambda: run_with_sample_db
+
+    yield sample_db
+
+    app.dependency_overrides.clear()
+
+
+def test_read_candidates_in_batches(sample_db):
+    batches = [_read_candidates_batch(sample_db, None, 0, 99, None, 0, 3)]
+    while len(batches[-1]) == 3:
+        batches.append(_read_candidates_batch(
+            sample_db, None, 0, 99, None, batches[-1][-1].id, 3
+        ))
+
+    assert [len(batch) for batch in batches] == [3, 3, 2]
+    candidates = [candidate for batch in batches for candidate in batch]
+    assert [candidate.id for candidate in candidates] == list(range(1, 9))
+
+    # same candidates, with the same technologies, as the search
+    searched = _search_candidates(sample_db, None, 0, 99, None)
+    for candidate in searched:
+        assert candidates[candidate.id - 1] == candidate
+
+
+def test_export_ndjson(sample_db_api):
+    response = client.get("/candidates/export", params={
+        'experience_min': 1, 'experience_max': 5, 'techs': '2,3'
+    })
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line['id'] for line in lines] == [2, 4, 5, 7]
+    assert lines[0] == {
+        'id': 2,
+        'city': {'id': 1, 'name': 'São Paulo - SP'},
+        'experience_min': 2,
+        'experience_max': 3,
+        'technologies': [
+            {'id': 2, 'name': 'JavaScript', 'is_main_tech': True},
+            {'id': 3, 'name': 'Python', 'is_main_tech': False},
+        ],
+    }
+
+
+def test_export_csv(sample_db_api):
+    response = client.get("/candidates/export", params={
+        'format': 'csv', 'city_id': 3
+    })
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/csv')
+    assert 'candidates.csv' in response.headers['content-disposition']
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows == [
+        ['id', 'city_id', 'city', 'experience_min', 'experience_max',
+         'technologies', 'main_technologies'],
+        ['5', '3', 'Salvador - BA', '1', '2', 'Java;Python', 'Python'],
+        ['6', '3', 'Salvador - BA', '7', '8', 'Java;Java (Android)', 'Java'],
+    ]
+
+
+def test_export_invalid_format(sample_db_api):
+    response = client.get("/candidates/export", params={'format': 'xml'})
+    assert response.status_code == 422
+
+
+def test_export_reads_each_batch_separately(sample_db, monkeypatch):
+    batches_read = []
+
+    async def run_with_sample_db(function, *args):
+        batches_read.append(args)
+        return function(sample_db, *args)
+
+    monkeypatch.setattr(settings, 'EXPORT_BATCH_SIZE', 3)
+    app.dependency_overrides[get_db_runner] = lambda: run_with_sample_db
+    try:
+        response = client.get("/candidates/export", params={
+            'experience_min': 0, 'experience_max': 99
+        })
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 8
+    # keyset pagination, the last batch is shorter than EXPORT_BATCH_SIZE
+    assert batches_read == [(0,), (3,), (6,)]
@@ -0,0 +1,114 @@
+import itertools
+import pytest
+from collections import Counter
+from fastapi.testclient import TestClient
+from ..core.search import facets, snapshot
+from ..main import app
+from .conftest import CANDIDATES
+
+client = TestClient(app)
+
+
+def _expected_counts(city_id, experience_min, experience_max, tech_ids):
+    """Facet counts computed candidate by candidate from the sample data"""
+    cities, techs, buckets = Counter(), Counter(), Counter()
+    for _, candidate_city_id, years_min, years_max, candidate_techs \
+            in CANDIDATES:
+        city_ok = not city_id or candidate_city_id == city_id
+        experience_ok = facets.experience_matches(
+            years_min, years_max, experience_min, experience_max
+        )
+        techs_ok = tech_ids is None \
+            or bool(set(tech_ids) & set(candidate_techs))
+
+        if experience_ok and techs_ok:
+            cities[candidate_city_id] += 1
+        if city_ok and techs_ok:
+            buckets[(years_min, years_max)] += 1
+        if city_ok and experience_ok:
+            techs.update(list(candidate_techs))
+    return cities, techs, buckets
+
+
+def test_facets(sample_snapshot):
+    response = client.get(
+        "/candidates/facets",
+        params={'city_id': 1, 'experience_max': 6, 'techs': '3'}
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        'total': 2,
+        'cities': [
+            {'id': 1, 'name': 'São Paulo - SP', 'count': 2},
+            {'id': 4, 'name': 'Florianópolis - SC', 'count': 1},
+            {'id': 3, 'name': 'Salvador - BA', 'count': 1},
+        ],
+        'technologies': [
+            {'id': 2, 'name': 'JavaScript', 'count': 2},
+            {'id': 3, 'name': 'Python', 'count': 2},
+            {'id': 1, 'name': 'Java', 'count': 1},
+        ],
+        'experience': [
+            {'experience_min': 2, 'experience_max': 3, 'count': 1},
+            {'experience_min': 5, 'experience_max': 6, 'count': 1},
+            {'experience_min': 12, 'experience_max': 99, 'count': 1},
+        ],
+    }
+
+
+@pytest.mark.parametrize('max_intersected_techs', [1, 4])
+def test_facets_match_candidate_by_candidate_counts(sample_snapshot,
+                                                    monkeypatch,
+                                                    max_intersected_techs):
+    # with 1, techs filters are counted from the union of the posting lists
+    monkeypatch.setattr(facets, 'MAX_INTERSECTED_TECHS',
+                        max_intersected_techs)
+    index = facets.FacetIndex(sample_snapshot)
+
+    grid = itertools.product(
+        [None, 1, 3, 5],
+        [(0, 99), (0, 3), (2, 6), (5, 10)],
+        [None, [], [2], [1, 3], [3, 4, 9], [1, 2, 3], [1, 2, 3, 4]],
+    )
+    for city_id, (experience_min, experience_max), tech_ids in grid:
+        result = index.facets(city_id, experience_min, experience_max,
+                              tech_ids)
+        cities, techs, buckets = _expected_counts(
+            city_id, experience_min, experience_max, tech_ids
+        )
+
+        assert {city['id']: city['count'] for city in result['cities']} \
+            == +cities
+        assert {tech['id']: tech['count'] for tech in result['technologies']} \
+            == +techs
+        assert {
+            (bucket['experience_min'], bucket['experience_max']):
+            bucket['count'] for bucket in result['experience']
+        } == +buckets
+        expected_total = cities[city_id] if city_id \
+            else sum(cities.values())
+        assert result['total'] == expected_total
+
+
+def test_facets_cached_per_generation(sample_db, sample_snapshot):
+    index = facets.get_index(sample_snapshot)
+    result = index.facets(None, 0, 99, [3])
+    assert index.facets(None, 0, 99, [3, 3]) is result
+    assert facets.get_index(sample_snapshot) is index
+
+    sample_db(sample_db.candidate_tech_reference.tech_id == 3).delete()
+    sample_db.commit()
+    new_snapshot = snapshot.write_snapshot(sample_db, sample_snapshot.path)
+
+    new_index = facets.get_index(new_snapshot)
+    assert new_index is not index
+    assert new_index.facets(None, 0, 99, [3])['total'] == 0
+
+
+def test_facets_reject_invalid_tech_ids(sample_snapshot):
+    response = client.get("/candidates/facets", params={'techs': 'abc'})
+    assert response.status_code == 422
+
+    response = client.get("/candidates/facets", params={'techs': '3,'})
+    assert response.status_code == 200
+    assert response.json()['total'] == 5
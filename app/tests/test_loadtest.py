@@ -0,0 +1,29 @@
+from ..benchmarks.loadtest import run_load_test, percentiles
+
+
+def test_percentiles():
+    latencies = [index / 1000 for index in range(1, 101)]
+
+    assert percentiles(latencies) == {
+        'p50': 50.0, 'p95': 95.0, 'p99': 99.0, 'max': 100.0
+    }
+    assert percentiles([])['p99'] is None
+
+
+def test_load_test_report():
+    report = run_load_test(rate=20, duration=1, candidates=200, cities=20,
+                           techs=30, es_latency=0.001)
+
+    assert report['requests'] == 20
+    assert report['unfinished_requests'] == 0
+    assert report['errors'] == 0
+    assert set(report['endpoints']) == {'candidates', 'search-options',
+                                        'msearch'}
+    assert sum(
+        endpoint['requests'] for endpoint in report['endpoints'].values()
+    ) == 20
+    for endpoint in report['endpoints'].values():
+        assert set(endpoint['status_codes']) <= {'200'}
+    assert report['latency_ms']['p50'] <= report['latency_ms']['p99']
+    assert report['config']['search_backend'] == 'mysql'
+    assert report['db_pool']['timeouts'] == 0
@@ -0,0 +1,110 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+from ..core.search.msearch import rewrite_msearch_body, \
+                                  InvalidSearchRequest, SOURCE_FIELDS
+from ..core import settings
+from ..main import app
+
+client = TestClient(app)
+
+
+def _ndjson(*lines):
+    return ''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8')
+
+
+def _parse(body):
+    return [json.loads(line) for line in body.splitlines()]
+
+
+def test_rewrite_caps_and_forces_index():
+    body = _ndjson(
+        {'preference': 'ReactiveListResult', 'index': 'other-index',
+         'routing': 'x'},
+        {'query': {'match_all': {}}, 'size': 100000, 'from': 50000,
+         '_source': {'includes': ['*'], 'excludes': []}, 'profile': True,
+         'aggs': {'techs': {'terms': {'field': 'techs', 'size': 100000},
+                            'aggs': {'top': {'top_hits': {'size': 500}}}}}},
+    )
+
+    header, search = _parse(rewrite_msearch_body(body))
+
+    assert header == {'preference': 'ReactiveListResult',
+                      'index': 'candidates'}
+    assert search['size'] == settings.ELASTIC_PROXY_MAX_SIZE
+    assert search['from'] == settings.ELASTIC_PROXY_MAX_FROM
+    assert 'profile' not in search
+    assert search['_source'] == {'includes': SOURCE_FIELDS}
+    techs = search['aggs']['techs']
+    assert techs['terms']['size'] == \
+        settings.ELASTIC_PROXY_MAX_AGGREGATION_SIZE
+    top_hits = techs['aggs']['top']['top_hits']
+    assert top_hits['size'] == settings.ELASTIC_PROXY_MAX_SIZE
+    assert top_hits['_source'] == {'includes': SOURCE_FIELDS}
+
+
+def test_rewrite_keeps_allowed_source_fields():
+    body = _ndjson({}, {'_source': ['city', 'password'], 'size': 5})
+
+    header, search = _parse(rewrite_msearch_body(body))
+
+    assert header == {'index': 'candidates'}
+    assert search['_source'] == {'includes': ['city']}
+    assert search['size'] == 5
+    assert search['from'] == 0
+
+
+def test_rewrite_without_source():
+    body = _ndjson({}, {'_source': False, 'aggs': {'top': {'top_hits': {
+        '_source': ['city', 'password'], 'script_fields': {}}}}})
+
+    header, search = _parse(rewrite_msearch_body(body))
+
+    assert search['_source'] is False
+    assert search['aggs']['top']['top_hits'] == \
+        {'_source': {'includes': ['city']}}
+
+
+def test_rewrite_splits_lines_on_newlines_only():
+    # JSON strings may hold characters str.splitlines also splits on
+    line = '{"query": {"match": {"city": "S\u2028o\x85P\u2029"}}}'
+    body = ('{}\n' + line + '\n').encode('utf-8')
+
+    header, search = _parse(rewrite_msearch_body(body))
+
+    assert search['query'] == \
+        {'match': {'city': 'S\u2028o\x85P\u2029'}}
+
+
+@pytest.mark.parametrize('lines', [
+    [{}],
+    [{}, {'query': {'script': {'script': 'sleep(1000)'}}}],
+    [{}, {'query': {'wildcard': {'city': {'value': '*Paulo'}}}}],
+    [{}, {'query': {'query_string': {'query': 'Java OR *Script'}}}],
+    [{}, {'query': {'query_string': {'query': 'city:(Santos ?alvador)'}}}],
+    [{}, {'size': -1}],
+    [{}, {'size': 'all'}],
+    [{}, {'_source': ['password']}],
+    [{}, {'aggs': {'a': {'terms': {'field': 'techs'}, 'aggs': {
+        'b': {'terms': {'field': 'city'}, 'aggs': {
+            'c': {'terms': {'field': 'techs'}, 'aggs': {
+                'd': {'terms': {'field': 'city'}}}}}}}}}}],
+])
+def test_rewrite_rejects_pathological_searches(lines):
+    with pytest.raises(InvalidSearchRequest):
+        rewrite_msearch_body(_ndjson(*lines))
+
+
+def test_rewrite_rejects_invalid_json():
+    with pytest.raises(InvalidSearchRequest):
+        rewrite_msearch_body(b'{}\nnot json\n')
+
+
+def test_proxy_returns_400_for_rejected_searches():
+    response = client.post(
+        "/candidates/elastic-proxy/candidates/_msearch",
+        _ndjson({}, {'query': {'regexp': {'city': '.*'}}}),
+        headers={'content-type': 'application/x-ndjson'}
+    )
+    assert response.status_code == 400
+    assert response.json() == {'detail': "'regexp' queries are not allowed"}
@@ -0,0 +1,119 @@
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+from pydal import DAL
+from ..core.models.pool import DatabasePool, PoolTimeout
+from ..main import app
+
+client = TestClient(app)
+
+
+def test_pool_limits_checkouts():
+    pool = DatabasePool(size=1, max_overflow=1, timeout=0.05, max_age=0,
+                        pre_ping=True)
+
+    async def checkout_three_times():
+        slot = await pool.acquire()
+        await pool.acquire()
+        with pytest.raises(PoolTimeout):
+            await pool.acquire()
+        pool.release(slot)
+        await pool.acquire()
+
+    asyncio.run(checkout_three_times())
+
+    stats = pool.stats()
+    assert stats['checkouts'] == 3
+    assert stats['timeouts'] == 1
+    assert stats['waiting'] == 0
+    assert stats['wait_time_ms']['max'] < 50
+
+
+def test_pool_releases_the_slot_of_another_loop():
+    pool = DatabasePool(size=1, max_overflow=0, timeout=0.05, max_age=0,
+                        pre_ping=True)
+    loop = asyncio.new_event_loop()
+    other_loop = asyncio.new_event_loop()
+
+    async def release(slot):
+        pool.release(slot)
+
+    try:
+        slot = loop.run_until_complete(pool.acquire())
+        # released while another loop is running
+        other_loop.run_until_complete(release(slot))
+        loop.run_until_complete(pool.acquire())
+    finally:
+        other_loop.close()
+        loop.close()
+
+    assert pool.stats()['timeouts'] == 0
+
+
+def test_pool_recycles_old_connections(tmp_path):
+    pool = DatabasePool(size=1, max_overflow=0, timeout=1, max_age=0.01,
+                        pre_ping=True)
+    db = DAL('sqlite:memory', folder=str(tmp_path),
+             after_connection=pool.after_connection)
+    first_connection = db._adapter.connection
+
+    time.sleep(0.02)
+    pool.checked_out(db)
+
+    assert db._adapter.connection is not first_connection
+    assert db.executesql('select 1;') == [(1,)]
+    stats = pool.stats()
+    assert stats['connections_created'] == 2
+    assert stats['connections_recycled'] == 1
+    assert stats['active'] == 1
+
+    pool.checked_in(db)
+    assert pool.stats()['active'] == 0
+    db.close()
+
+
+def test_pool_counts_failed_pre_pings(tmp_path):
+    pool = DatabasePool(size=1, max_overflow=0, timeout=1, max_age=0,
+                        pre_ping=True)
+    uri = 'sqlite://{}'.format(tmp_path / 'pool.sqlite')
+
+    def connect(stale_once=False):
+        db = DAL(uri, folder=str(tmp_path),
+                 after_connection=pool.after_connection)
+        # pyDAL does not pool SQLite connections unless told to
+        db._adapter.pool_size = 1
+        if stale_once:
+            test_connection = db._adapter.test_connection
+            calls = []
+
+            def stale_test_connection():
+                calls.append(1)
+                if len(calls) == 1:
+                    raise Exception('MySQL server has gone away')
+                test_connection()
+
+            db._adapter.test_connection = stale_test_connection
+        pool.instrument(db._adapter)
+        return db
+
+    db = connect()
+    db.executesql('select 1;')
+    db.close()
+
+    # the pooled connection went stale while idle
+    db = connect(stale_once=True)
+    assert db.executesql('select 1;') == [(1,)]
+    db.close()
+
+    stats = pool.stats()
+    assert stats['connections_created'] == 2
+    assert stats['pre_ping_failures'] == 1
+
+
+def test_db_pool_stats_endpoint():
+    response = client.get("/management/db-pool-stats")
+    assert response.status_code == 200
+    response_json = response.json()
+    assert response_json['pool_size'] == 10
+    assert set(response_json['wait_time_ms']) == {'p50', 'p95', 'p99', 'max'}
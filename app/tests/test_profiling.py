@@ -0,0 +1,148 @@
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from ..core.middleware import profiling
+from ..core.middleware.profiling import ProfileStore, ProfilingMiddleware
+from ..core.routers import management
+from ..core import settings
+from ..main import app
+
+
+@pytest.fixture
+def profile_store(tmp_path, monkeypatch):
+    store = ProfileStore(str(tmp_path / 'profiles'), max_profiles=2)
+    monkeypatch.setattr(management, 'profile_store', store)
+    return store
+
+
+def test_sampler_counts_the_stacks_of_a_thread():
+    sampler = profiling._Sampler(threading.get_ident(), interval=0.001)
+    sampler.start()
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+    sampler.stop()
+
+    assert sum(sampler.stacks.values()) > 0
+    function_names = {frame[0] for stack in sampler.stacks for frame in stack}
+    assert 'test_sampler_counts_the_stacks_of_a_thread' in function_names
+
+
+def busy_in_threadpool():
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_profiled_executor_samples_the_threads_of_the_request():
+    sampler = profiling._Sampler(threading.get_ident(), interval=0.001)
+    executor = profiling.ProfiledExecutor(max_workers=1)
+    sampler.start()
+    token = profiling._active_sampler.set(sampler)
+    try:
+        executor.submit(busy_in_threadpool).result()
+    finally:
+        profiling._active_sampler.reset(token)
+        sampler.stop()
+
+    function_names = {frame[0] for stack in sampler.stacks for frame in stack}
+    assert 'busy_in_threadpool' in function_names
+    assert sampler.thread_ids == {threading.get_ident()}
+
+    # work submitted outside of a profiled request is not sampled
+    executor.submit(busy_in_threadpool).result()
+    executor.shutdown()
+    assert sampler.thread_ids == {threading.get_ident()}
+
+
+def test_profile_requests_with_the_secret(sample_snapshot, profile_store,
+                                          monkeypatch):
+    monkeypatch.setattr(settings, 'PROFILING_SECRET', 's3cret')
+    secret = {'X-Profile': 's3cret'}
+    client = TestClient(
+        ProfilingMiddleware(app, store=profile_store, secret='s3cret')
+    )
+
+    response = client.get("/candidates/facets")
+    assert 'x-profile-id' not in response.headers
+    response = client.get("/candidates/facets",
+                          headers={'X-Profile': 'wrong'})
+    assert 'x-profile-id' not in response.headers
+    assert profile_store.list() == []
+
+    response = client.get("/candidates/facets", params={'city_id': 1},
+                          headers={'X-Profile': 's3cret'})
+    assert response.status_code == 200
+    profile_id = response.headers['x-profile-id']
+
+    profiles = client.get("/management/profiles", headers=secret).json()
+    assert [profile['id'] for profile in profiles] == [profile_id]
+    assert profiles[0]['path'] == '/candidates/facets'
+    assert profiles[0]['query'] == 'city_id=1'
+    assert profiles[0]['status_code'] == 200
+
+    response = client.get("/management/profiles/{}".format(profile_id),
+                          headers=secret)
+    assert response.status_code == 200
+    speedscope = response.json()
+    assert speedscope['profiles'][0]['type'] == 'sampled'
+    assert len(speedscope['profiles'][0]['samples']) == \
+        len(speedscope['profiles'][0]['weights'])
+
+    response = client.get("/management/profiles/{}".format(profile_id),
+                          params={'format': 'collapsed'}, headers=secret)
+    assert response.status_code == 200
+
+    response = client.get("/management/profiles/not-a-profile",
+                          headers=secret)
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize('secret, headers', [
+    ('s3cret', {}),
+    ('s3cret', {'X-Profile': 'wrong'}),
+    ('', {}),
+    ('', {'X-Profile': ''}),
+])
+def test_profiles_require_the_secret(profile_store, monkeypatch, secret,
+                                     headers):
+    monkeypatch.setattr(settings, 'PROFILING_SECRET', secret)
+    profile_store.save({'id': 'a' * 32, 'frames': [], 'stacks': []})
+    client = TestClient(app)
+
+    response = client.get("/management/profiles", headers=headers)
+    assert response.status_code == 403
+    response = client.get("/management/profiles/{}".format('a' * 32),
+                          headers=headers)
+    assert response.status_code == 403
+
+
+def test_profile_store_is_a_ring_buffer(profile_store):
+    for profile_id in ('a' * 32, 'b' * 32, 'c' * 32):
+        profile_store.save({'id': profile_id, 'frames': [], 'stacks': []})
+
+    assert [profile['id'] for profile in profile_store.list()] == \
+        ['c' * 32, 'b' * 32]
+    assert profile_store.load('a' * 32) is None
+
+
+def test_profile_formats():
+    profile = {
+        'method': 'GET',
+        'path': '/candidates',
+        'interval_ms': 5.0,
+        'samples': 3,
+        'frames': [['main', 'a.py', 1], ['query', 'b.py', 10]],
+        'stacks': [[[0, 1], 2], [[0], 1]],
+    }
+
+    assert profiling.to_collapsed(profile) == \
+        'main (a.py:1);query (b.py:10) 2\nmain (a.py:1) 1\n'
+
+    speedscope = profiling.to_speedscope(profile)
+    assert speedscope['shared']['frames'][1] == \
+        {'name': 'query', 'file': 'b.py', 'line': 10}
+    assert speedscope['profiles'][0]['samples'] == [[0, 1], [0]]
+    assert speedscope['profiles'][0]['weights'] == [10.0, 5.0]
+    assert speedscope['profiles'][0]['endValue'] == 15.0
@@ -0,0 +1,111 @@
+import itertools
+import pytest
+from fastapi.testclient import TestClient
+from ..benchmarks.elastic_stub import ElasticStub, documents_from_snapshot
+from ..core.dependencies import get_db
+from ..core.routers import candidates
+from ..core.routers.candidates import _search_candidates
+from ..core.search import elastic_backend
+from ..core.search.snapshot import SnapshotError
+from ..core import settings
+from ..main import app
+
+client = TestClient(app)
+
+CITIES = [None, 1, 2, 3, 99]
+EXPERIENCES = [(0, 99), (0, 3), (1, 9), (4, 10), (12, 99), (2, 5), (5, 1)]
+TECHS = [None, '1', '2,3', '4', '1,2,3,4', '3,3', '9']
+
+
+@pytest.fixture
+def elastic_stub(sample_snapshot, monkeypatch):
+    stub = ElasticStub(documents_from_snapshot(sample_snapshot))
+    monkeypatch.setattr(settings, 'ELASTIC_HOST', stub.start())
+
+    yield stub
+
+    stub.stop()
+
+
+@pytest.fixture
+def elastic_backend_api(sample_db, elastic_stub, monkeypatch):
+    monkeypatch.setattr(settings, 'SEARCH_BACKEND', 'elasticsearch')
+    app.dependency_overrides[get_db] = lambda: sample_db
+
+    yield elastic_stub
+
+    app.dependency_overrides.clear()
+
+
+def test_backends_parity(sample_db, sample_snapshot, elastic_stub):
+    for city_id, (experience_min, experience_max), techs in \
+            itertools.product(CITIES, EXPERIENCES, TECHS):
+        mysql_main = _search_candidates(sample_db, city_id, experience_min,
+                                        experience_max, techs)
+        mysql_secondary = _search_candidates(sample_db, city_id,
+                                             experience_min, 99, techs)
+
+        elastic_main, elastic_secondary = elastic_backend.search_candidates(
+            lambda: sample_snapshot, city_id, experience_min, experience_max,
+            techs
+        )
+
+        assert elastic_main == mysql_main
+        assert elastic_secondary == mysql_secondary
+
+
+def test_search_uses_a_single_elastic_request(elastic_backend_api):
+    response = client.get("/candidates", params={
+        'experience_min': 1, 'experience_max': 5, 'techs': '2,3'
+    })
+
+    assert response.status_code == 200
+    assert elastic_backend_api.requests == 1
+    response_json = response.json()
+    assert [c['id'] for c in response_json['main_candidates']] == \
+        [4, 7, 2, 5]
+    assert [c['id'] for c in response_json['secondary_candidates']] == [3, 8]
+
+
+def test_search_falls_back_to_mysql(elastic_backend_api, monkeypatch):
+    # nothing listens on the port of a closed stub
+    closed_stub = ElasticStub([])
+    monkeypatch.setattr(settings, 'ELASTIC_HOST', closed_stub.url)
+    closed_stub._server.server_close()
+
+    response = client.get("/candidates", params={
+        'experience_min': 1, 'experience_max': 5, 'techs': '2,3'
+    })
+
+    assert response.status_code == 200
+    response_json = response.json()
+    assert [c['id'] for c in response_json['main_candidates']] == \
+        [4, 7, 2, 5]
+    assert [c['id'] for c in response_json['secondary_candidates']] == [3, 8]
+
+
+def _failing_snapshot():
+    raise SnapshotError('candidates.snapshot is not a candidate snapshot')
+
+
+class _MalformedElastic:
+
+    def msearch(self, body, index):
+        return {'responses': [{'hits': {}}]}
+
+
+@pytest.mark.parametrize('failure', ['snapshot', 'response'])
+def test_search_falls_back_to_mysql_on_backend_errors(elastic_backend_api,
+                                                      monkeypatch, failure):
+    if failure == 'snapshot':
+        monkeypatch.setattr(candidates, 'get_snapshot', _failing_snapshot)
+    else:
+        monkeypatch.setattr(elastic_backend, 'get_elastic', _MalformedElastic)
+
+    response = client.get("/candidates", params={
+        'experience_min': 1, 'experience_max': 5, 'techs': '2,3'
+    })
+
+    assert response.status_code == 200
+    assert [c['id'] for c in response.json()['main_candidates']] == \
+        [4, 7, 2, 5]
@@ -0,0 +1,181 @@
+import pytest
+from ..core.search.documents import read_candidate_documents
+from ..benchmarks.elastic_stub import ElasticStub, documents_from_snapshot
+from ..core.search import sync
+from ..core.search.sync import OutboxSyncer
+from ..core import settings
+
+
+@pytest.fixture
+def empty_elastic_stub(monkeypatch):
+    stub = ElasticStub([])
+    monkeypatch.setattr(settings, 'ELASTIC_HOST', stub.start())
+
+    yield stub
+
+    stub.stop()
+
+
+def _outbox_candidate_ids(db):
+    return {row.candidate_id for row in db(db.search_outbox).select()}
+
+
+def test_writes_are_recorded_in_the_outbox(sample_db):
+    assert _outbox_candidate_ids(sample_db) == set(range(1, 9))
+    sample_db(sample_db.search_outbox).delete()
+
+    sample_db(sample_db.candidate_tech_reference.tech_id == 4).delete()
+    sample_db(sample_db.candidate.id == 4).update(years_experience_max=6)
+    sample_db.rollback()
+    assert _outbox_candidate_ids(sample_db) == set(range(1, 9))
+
+    sample_db(sample_db.search_outbox).delete()
+    sample_db(sample_db.candidate_tech_reference.tech_id == 4).delete()
+    sample_db(sample_db.candidate.id == 4).update(years_experience_max=6)
+    assert _outbox_candidate_ids(sample_db) == {4, 6}
+
+    # a reference moved to another candidate syncs both
+    sample_db(sample_db.search_outbox).delete()
+    sample_db(sample_db.candidate_tech_reference.candidate_id == 4).update(
+        candidate_id=5
+    )
+    assert _outbox_candidate_ids(sample_db) == {4, 5}
+
+
+def test_sync(sample_db, sample_snapshot, empty_elastic_stub):
+    syncer = OutboxSyncer(interval=0, batch_size=100, lease=30)
+
+    assert syncer.sync(sample_db) == 8
+    assert _outbox_candidate_ids(sample_db) == set()
+    assert list(empty_elastic_stub.documents.values()) == \
+        documents_from_snapshot(sample_snapshot)
+
+    sample_db(sample_db.candidate.id == 8).delete()
+    sample_db.candidate_tech_reference.insert(candidate_id=4, tech_id=1)
+    sample_db.commit()
+
+    syncer.batch_size = 1
+    assert syncer.sync(sample_db) == 2
+    assert '8' not in empty_elastic_stub.documents
+    assert empty_elastic_stub.documents['4']['techs'] == \
+        ['Java', 'JavaScript']
+    assert syncer.stats(sample_db)['pending'] == 0
+
+
+def test_candidates_without_a_city_are_synced(sample_db, sample_snapshot,
+                                              empty_elastic_stub):
+    sample_db(sample_db.candidate.id == 4).update(city_id=None)
+    sample_db(sample_db.candidate.id == 5).update(city_id=99)
+    sample_db.commit()
+
+    _, documents = read_candidate_documents(sample_db, [4, 5])
+    assert documents[4]['city'] is None
+    assert documents[5]['city'] is None
+
+    OutboxSyncer(interval=0, batch_size=100, lease=30).sync(sample_db)
+    assert empty_elastic_stub.documents['4']['city'] is None
+    assert empty_elastic_stub.documents['5']['techs'] == ['Java', 'Python']
+
+
+def test_failed_sync_is_retried(sample_db, monkeypatch):
+    # nothing listens on the port of a closed stub
+    closed_stub = ElasticStub([])
+    monkeypatch.setattr(settings, 'ELASTIC_HOST', closed_stub.url)
+    closed_stub._server.server_close()
+    # above the second precision of the stored datetimes
+    monkeypatch.setattr(sync, 'RETRY_BACKOFF', 60.0)
+
+    syncer = OutboxSyncer(interval=0, batch_size=100, lease=30)
+    assert syncer.sync(sample_db) == 0
+
+    stats = syncer.stats(sample_db)
+    assert stats['pending'] == stats['retrying'] == 8
+    assert stats['sync_errors'] == 8
+
+    # the failed rows are only retried after their backoff
+    assert syncer.sync_batch(sample_db) == (0, 0)
+
+
+def test_stale_sync_does_not_overwrite_a_newer_one(sample_db, sample_snapshot,
+                                                   empty_elastic_stub,
+                                                   monkeypatch):
+    syncer_a = OutboxSyncer(interval=0, batch_size=100, lease=30)
+    syncer_b = OutboxSyncer(interval=0, batch_size=100, lease=30)
+    interleaved = []
+
+    def read_then_interleave(db, candidate_ids):
+        versions, documents = read_candidate_documents(db, candidate_ids)
+        if not interleaved:
+            interleaved.append(True)
+            # after syncer A read its documents, the candidate changes and
+            # syncer B syncs the change before A sends its bulk request
+            db(db.candidate.id == 4).update(years_experience_max=50)
+            db.commit()
+            syncer_b.sync(db)
+        return versions, documents
+
+    monkeypatch.setattr(sync, 'read_candidate_documents',
+                        read_then_interleave)
+    syncer_a.sync(sample_db)
+
+    assert empty_elastic_stub.documents['4']['years_experience_max'] == 50
+    assert syncer_a.stats(sample_db)['pending'] == 0
+    assert syncer_a.sync_errors == 0
+
+
+def test_versions_follow_the_commit_order(sample_db, sample_snapshot,
+                                          empty_elastic_stub):
+    syncer = OutboxSyncer(interval=0, batch_size=100, lease=30)
+    syncer.sync(sample_db)
+
+    sample_db(sample_db.candidate.id == 4).update(years_experience_max=40)
+    sample_db.commit()
+    syncer.sync(sample_db)
+
+    # a change committed after the previous one, with a lower outbox row ID
+    sample_db(sample_db.candidate.id == 4).update(years_experience_max=50)
+    sample_db(sample_db.search_outbox.candidate_id == 4).update(id=1)
+    sample_db.commit()
+    syncer.sync(sample_db)
+
+    assert empty_elastic_stub.documents['4']['years_experience_max'] == 50
+    assert syncer.stats(sample_db)['pending'] == 0
+
+    # deletes use the version recorded in the outbox
+    sample_db(sample_db.candidate.id == 4).delete()
+    sample_db.commit()
+    syncer.sync(sample_db)
+    assert '4' not in empty_elastic_stub.documents
+    assert empty_elastic_stub.versions['4'] == 5
+
+
+def test_claimed_rows_are_synced_by_a_single_syncer(sample_db,
+                                                    sample_snapshot,
+                                                    empty_elastic_stub,
+                                                    monkeypatch):
+    syncer_a = OutboxSyncer(interval=0, batch_size=100, lease=30)
+    syncer_b = OutboxSyncer(interval=0, batch_size=100, lease=30)
+    synced_by_b = []
+
+    def read_while_claimed(db, candidate_ids):
+        if not synced_by_b:
+            # another worker syncs while A holds the claim of every row
+            synced_by_b.append(syncer_b.sync(db))
+        return read_candidate_documents(db, candidate_ids)
+
+    monkeypatch.setattr(sync, 'read_candidate_documents', read_while_claimed)
+
+    assert syncer_a.sync(sample_db) == 8
+    assert synced_by_b == [0]
+    assert syncer_a.stats(sample_db)['pending'] == 0
+
+
+def test_expired_claims_are_not_written(sample_db, empty_elastic_stub):
+    syncer = OutboxSyncer(interval=0, batch_size=100, lease=0)
+
+    assert syncer.sync_batch(sample_db) == (0, 0)
+    assert empty_elastic_stub.documents == {}
+
+    # the rows are claimed again by the next sync
+    syncer.lease = 30
+    assert syncer.sync(sample_db) == 8
@@ -0,0 +1,85 @@
+import os
+import threading
+from ..core.search import snapshot
+from .conftest import CANDIDATES
+
+
+def test_snapshot_columns(sample_snapshot):
+    assert len(sample_snapshot) == len(CANDIDATES)
+    assert list(sample_snapshot.candidate_ids) == [c[0] for c in CANDIDATES]
+    assert list(sample_snapshot.candidate_city_ids) == \
+        [c[1] for c in CANDIDATES]
+    assert list(sample_snapshot.experience_min) == [c[2] for c in CANDIDATES]
+    assert list(sample_snapshot.experience_max) == [c[3] for c in CANDIDATES]
+
+    for position, candidate in enumerate(CANDIDATES):
+        assert sample_snapshot.candidate_techs(position) == \
+            sorted(candidate[4].items())
+
+
+def test_snapshot_name_dictionaries(sample_snapshot):
+    assert sample_snapshot.city_name(1) == 'São Paulo - SP'
+    assert sample_snapshot.city_name(99) is None
+    assert sample_snapshot.tech_name(4) == 'Java (Android)'
+    assert sample_snapshot.techs()[0] == (1, 'Java')
+
+
+def test_snapshot_is_replaced_atomically(sample_db, sample_snapshot):
+    sample_db.candidate.insert(id=9, city_id=2, years_experience_min=1,
+                               years_experience_max=2)
+    sample_db.commit()
+
+    new_snapshot = snapshot.write_snapshot(sample_db, sample_snapshot.path)
+
+    assert new_snapshot is not sample_snapshot
+    assert new_snapshot.generation > sample_snapshot.generation
+    assert snapshot.get_snapshot(sample_snapshot.path) is new_snapshot
+    assert list(new_snapshot.candidate_ids)[-1] == 9
+    assert new_snapshot.candidate_techs(len(new_snapshot) - 1) == []
+    # the old mapping stays readable for requests still using it
+    assert len(sample_snapshot) == len(CANDIDATES)
+
+
+def test_snapshot_experience_without_a_byte_range(sample_db, tmp_path):
+    sample_db.candidate.insert(id=9, city_id=2, years_experience_min=None,
+                               years_experience_max=None)
+    sample_db.candidate.insert(id=10, city_id=2, years_experience_min=300,
+                               years_experience_max=100000)
+    sample_db.commit()
+
+    new_snapshot = snapshot.write_snapshot(
+        sample_db, str(tmp_path / 'candidates.snapshot')
+    )
+
+    assert list(new_snapshot.experience_min)[-2:] == [0, 300]
+    assert list(new_snapshot.experience_max)[-2:] == [99, 65535]
+
+
+def test_snapshot_missing_file(tmp_path):
+    assert snapshot.get_snapshot(str(tmp_path / 'missing.snapshot')) is None
+
+
+def test_concurrent_writers(sample_db, tmp_path, monkeypatch):
+    # pyDAL connections belong to a thread, so the threads share the columns
+    columns = snapshot._read_columns(sample_db)
+    monkeypatch.setattr(snapshot, '_read_columns', lambda db: columns)
+    path = str(tmp_path / 'candidates.snapshot')
+
+    errors = []
+
+    def write():
+        try:
+            for _ in range(10):
+                snapshot.write_snapshot(None, path)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=write) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(str(tmp_path)) == ['candidates.snapshot']
+    assert len(snapshot.get_snapshot(path)) == len(CANDIDATES)
@@ -0,0 +1,24 @@
+import json
+import subprocess
+import sys
+from ..benchmarks.startup import REPOSITORY_ROOT
+
+# Modules that must only be imported on first use or on startup
+LAZY_MODULES = ['elasticsearch', 'requests', 'sentry_sdk', 'flask', 'pydal']
+
+
+def test_import_does_not_load_lazy_modules():
+    script = (
+        'import json, sys\n'
+        'import app.main\n'
+        'print(json.dumps([m for m in {} if m in sys.modules]))\n'
+    ).format(LAZY_MODULES)
+
+    output = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=REPOSITORY_ROOT,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+
+    assert json.loads(output) == []